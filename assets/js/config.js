@@ -7,12 +7,18 @@ function createMapOptions() {
     const mapWidth = 23040
     const mapHeight = 23040
     const mapImageURL = 'assets/maps/map.png'
+    const mapTilesURL = 'assets/maps/tiles/{z}/{x}/{y}.png' // scripts/generate_terrain_map.py --mode tiles
+    const mapTilesMaxNativeZoom = 0
+    const roadsLodManifestURL = 'assets/markers/roads_lod.json' // simplified road layers, scripts/generate_roads.py --lod-zooms
 
     return {
         apothem,
         mapWidth,
         mapHeight,
         mapImageURL,
+        mapTilesURL,
+        mapTilesMaxNativeZoom,
+        roadsLodManifestURL,
 
         // Rendering
         preferCanvas: true,
@@ -289,4 +289,198 @@ function composeIconImage() {
 // We will need to build an extensive config object from the desc files
 function composeGeoJson(validGeoJson, formating) {
 
-}
\ No newline at end of file
+}
+
+// Marker layers also come as compact columnar .bin files (scripts/marker_columns.py):
+// 8 byte magic, u32 header length, JSON header, then 8-byte aligned little-endian blocks
+const markerColumnsArrays = {
+    '<u1': Uint8Array, '|u1': Uint8Array, '<i1': Int8Array, '|i1': Int8Array,
+    '<u2': Uint16Array, '<i2': Int16Array, '<u4': Uint32Array, '<i4': Int32Array,
+    '<u8': BigUint64Array, '<i8': BigInt64Array, '<f8': Float64Array,
+}
+
+function decodeMarkerColumns(buffer) {
+    const magic = new TextDecoder().decode(new Uint8Array(buffer, 0, 8))
+    if (magic !== 'BCMARKS1') throw new Error('Not a marker columns file')
+    const headerLength = new DataView(buffer).getUint32(8, true)
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 12, headerLength)))
+    const dataStart = Math.ceil((12 + headerLength) / 8) * 8
+    const view = (dtype, offset, length) => new markerColumnsArrays[dtype](buffer, dataStart + offset, length)
+
+    const xy = view(header.geometry.dtype, header.geometry.offset, 2 * header.count)
+    const columns = header.columns.map(column => {
+        const values = view(column.dtype, column.offset, header.count)
+        if (column.kind === 'string') {
+            const offsets = view('<u4', column.offsets, column.strings + 1)
+            const bytes = new Uint8Array(buffer, dataStart + column.data, offsets[column.strings])
+            const decoder = new TextDecoder()
+            const table = Array.from({ length: column.strings }, (_, k) => decoder.decode(bytes.subarray(offsets[k], offsets[k + 1])))
+            return index => table[values[index]]
+        }
+        if (column.kind === 'decimal') return index => values[index].toString()
+        if (column.kind === 'bool') return index => values[index] !== 0
+        if (column.dtype === '<u8' || column.dtype === '<i8') return index => Number(values[index])
+        return index => values[index]
+    })
+
+    const features = new Array(header.count)
+    for (let index = 0; index < header.count; index++) {
+        const properties = {}
+        header.columns.forEach((column, k) => { properties[column.name] = columns[k](index) })
+        features[index] = {
+            type: 'Feature',
+            properties,
+            geometry: { type: 'Point', coordinates: [xy[2 * index], xy[2 * index + 1]] },
+        }
+    }
+    return header.collection ? { type: 'FeatureCollection', features } : features
+}
+
+// The .bin when it is there, the GeoJSON otherwise
+async function fetchMarkerLayer(geoJsonUrl) {
+    try {
+        const file = await fetch(geoJsonUrl.replace(/\.geojson$/, '.bin'))
+        if (file.ok) return decodeMarkerColumns(await file.arrayBuffer())
+    } catch (error) {
+        console.warn('Falling back to ' + geoJsonUrl, error)
+    }
+    const file = await fetch(geoJsonUrl)
+    return file.json()
+}
+
+// Marker layers sliced by scripts/generate_marker_tiles.py: index.json lists the
+// non-empty tiles per zoom, only the ones in view are fetched, each of them once
+async function loadMarkerTiles(leafletMap, folderUrl, paint) {
+    const index = await (await fetch(folderUrl + '/index.json')).json()
+    const zoom = Math.max(...Object.keys(index.zooms).map(Number))
+    const available = new Set(index.zooms[zoom].map(([x, y]) => x + '/' + y))
+    const requested = new Set()
+
+    function refresh() {
+        const bounds = leafletMap.getBounds()
+        const min = leafletMap.project(bounds.getNorthWest(), zoom).divideBy(index.tileSize).floor()
+        const max = leafletMap.project(bounds.getSouthEast(), zoom).divideBy(index.tileSize).floor()
+        for (let x = min.x; x <= max.x; x++) {
+            for (let y = min.y; y <= max.y; y++) {
+                const key = x + '/' + y
+                if (!available.has(key) || requested.has(key)) continue
+                requested.add(key)
+                fetch(folderUrl + '/' + zoom + '/' + key + '.geojson')
+                    .then(file => file.json())
+                    .then(paint)
+                    .catch(() => requested.delete(key))
+            }
+        }
+    }
+
+    leafletMap.on('moveend', refresh)
+    refresh()
+}
+
+// Per-zoom clusters written by scripts/generate_marker_clusters.py: on every zoom
+// the layers are emptied and refilled from the file of the nearest clustered zoom.
+// Lone markers go through `paint`, clusters through `paintCluster(feature, zoom)`
+async function loadMarkerClusters(leafletMap, folderUrl, layers, paint, paintCluster) {
+    const index = await (await fetch(folderUrl + '/index.json')).json()
+    const minZoom = index.zooms[0]
+    const maxZoom = index.zooms[index.zooms.length - 1]
+    const files = new Map()
+    let shown = null
+
+    async function refresh() {
+        const zoom = Math.min(Math.max(Math.round(leafletMap.getZoom()), minZoom), maxZoom)
+        if (zoom === shown) return
+        shown = zoom
+        if (!files.has(zoom)) files.set(zoom, fetch(folderUrl + '/' + zoom + '.geojson').then(file => file.json()))
+        let geojsonData
+        try {
+            geojsonData = await files.get(zoom)
+        } catch (e) {
+            files.delete(zoom)
+            shown = null
+            return
+        }
+        // The user may have zoomed again while the file was loading
+        if (zoom !== shown) return
+        layers.forEach(layer => layer.clearLayers())
+        const features = geojsonData.features
+        features.filter(feature => feature.properties.cluster).forEach(feature => paintCluster(feature, zoom))
+        paint({ type: 'FeatureCollection', features: features.filter(feature => !feature.properties.cluster) })
+    }
+
+    leafletMap.on('zoomend', refresh)
+    refresh()
+}
+
+// Name search index written by scripts/generate_search_index.py, the lookups
+// mirror its SearchIndex class: prefix matches walk the radix trie, fuzzy ones
+// rank the entries sharing trigrams with the query. The trigram postings are
+// not in the file, they are built here from the names
+async function loadSearchIndex(url) {
+    const index = await (await fetch(url)).json()
+    const searchKey = name => name.toLowerCase().split(/\s+/).filter(Boolean).join(' ')
+    const trigrams = key => {
+        const padded = '  ' + key + ' '
+        const found = new Set()
+        for (let i = 0; i < padded.length - 2; i++) found.add(padded.slice(i, i + 3))
+        return found
+    }
+    const minSimilarity = 0.3
+    const keys = index.names.map(searchKey)
+    const postings = new Map()
+    keys.forEach((key, id) => {
+        for (const trigram of trigrams(key)) {
+            if (!postings.has(trigram)) postings.set(trigram, [])
+            postings.get(trigram).push(id)
+        }
+    })
+
+    function prefix(query, limit) {
+        query = searchKey(query)
+        let node = index.trie[0]
+        while (query) {
+            const child = node.slice(3).map(id => index.trie[id])
+                .find(([label]) => label.startsWith(query) || query.startsWith(label))
+            if (!child) return []
+            node = child
+            query = query.slice(child[0].length)
+        }
+        const found = []
+        for (let id = node[1]; id < Math.min(node[2], node[1] + limit); id++) found.push(id)
+        return found
+    }
+
+    function fuzzy(query, limit) {
+        const wanted = trigrams(searchKey(query))
+        const shared = new Map()
+        for (const trigram of wanted) {
+            for (const id of postings.get(trigram) || []) shared.set(id, (shared.get(id) || 0) + 1)
+        }
+        const scored = []
+        for (const [id, count] of shared) {
+            const similarity = count / (wanted.size + trigrams(keys[id]).size - count)
+            if (similarity >= minSimilarity) scored.push([similarity, id])
+        }
+        return scored.sort((a, b) => b[0] - a[0] || a[1] - b[1]).slice(0, limit).map(([, id]) => id)
+    }
+
+    return {
+        layers: index.layers,
+        name: id => index.names[id],
+        layer: id => index.layers[index.layer[id]],
+        points(id) {
+            const points = []
+            for (let k = index.offsets[id]; k < index.offsets[id + 1]; k++) points.push([index.xy[2 * k], index.xy[2 * k + 1]])
+            return points
+        },
+        // Prefix matches first, then fuzzy ones up to `limit`
+        search(query, limit = 10) {
+            const found = prefix(query, limit)
+            for (const id of fuzzy(query, limit)) {
+                if (found.length >= limit) break
+                if (!found.includes(id)) found.push(id)
+            }
+            return found
+        }
+    }
+}
@@ -8,14 +8,36 @@ const appOptions = createAppOptions()
 const map = L.map('map', mapOptions)
 const layerRegistry = createLayerRegistry(map)
 
-layerRegistry.createLayer(
-    "mapImageLayer",
-    "imageOverlay",
-    {
-        url: mapOptions.mapImageURL,
-        bounds: [[0, 0], [mapOptions.mapHeight * mapOptions.apothem, mapOptions.mapWidth]],
-    }
-)
+const turnOnTiles = new URLSearchParams(window.location.search).get('tiles')
+if (turnOnTiles) {
+    layerRegistry.createLayer(
+        "mapTilesLayer",
+        "tile",
+        {
+            url: mapOptions.mapTilesURL,
+            minZoom: mapOptions.minZoom,
+            maxZoom: mapOptions.maxZoom,
+            minNativeZoom: mapOptions.minZoom,
+            maxNativeZoom: mapOptions.mapTilesMaxNativeZoom,
+            bounds: [[0, 0], [mapOptions.mapHeight * mapOptions.apothem, mapOptions.mapWidth]],
+        }
+    )
+} else {
+    layerRegistry.createLayer(
+        "mapImageLayer",
+        "imageOverlay",
+        {
+            url: mapOptions.mapImageURL,
+            bounds: [[0, 0], [mapOptions.mapHeight * mapOptions.apothem, mapOptions.mapWidth]],
+        }
+    )
+}
+
+// Load claims and caves tile by tile (scripts/generate_marker_tiles.py) instead of whole
+const turnOnMarkerTiles = new URLSearchParams(window.location.search).get('markerTiles')
+
+// Show claims and caves as precomputed per-zoom clusters (scripts/generate_marker_clusters.py)
+const turnOnMarkerClusters = new URLSearchParams(window.location.search).get('clusters')
 
 const turnOnHeatmap = new URLSearchParams(window.location.search).get('heatmap')
 if (turnOnHeatmap) {
@@ -193,11 +215,39 @@ const allLayers = {
 
 
 
+// Layers holding each layer of the search index, added to the map when one of its names is picked
+const searchIndexLayers = { claims: allClaims, caves: allCaves, temples: templesLayer, dungeons: dungeonsLayer }
+let searchIndex = null
+let searchIndexLoad = null
+
+// Search results as the plugin wants them, title -> latlng
+function searchIndexRecords(text) {
+    const center = map.getCenter()
+    const distance = ([x, y]) => (x - center.lng) ** 2 + (y - center.lat) ** 2
+    const records = {}
+    for (const id of searchIndex.search(text)) {
+        const points = searchIndex.points(id)
+        // Names shared by many markers (caves, temples) go to the one closest to the view
+        const [x, y] = points.reduce((best, point) => distance(point) < distance(best) ? point : best)
+        const latlng = L.latLng(y, x)
+        latlng.layer = searchIndexLayers[searchIndex.layer(id)]
+        const count = points.length > 1 ? ', ' + points.length : ''
+        records[searchIndex.name(id) + ' (' + searchIndex.layer(id) + count + ')'] = latlng
+    }
+    return records
+}
+
 // This is leaflet.search plugin configuration
-// This plugin need a "title" parameter in each marker to find stuff
+// This plugin need a "title" parameter in each marker to find stuff, until the
+// search index (scripts/generate_search_index.py) is loaded and answers instead
 const searchControlOptions = {
     position: 'topleft',
     layer: searchGroup,
+    sourceData: (text, callResponse) => callResponse(searchIndexRecords(text)),
+    formatData: (control, records) => records,
+    filterData: function (text, records) {
+        return searchIndex ? records : this._defaultFilterData(text, records)
+    },
     initial: false,
     marker: false,
     firstTipSubmit: true,
@@ -205,6 +255,18 @@ const searchControlOptions = {
 }
 const searchControl = new L.Control.Search(searchControlOptions)
 
+// The index is only downloaded once the search is opened, the loaded markers answer until it is there
+function loadSearchIndexOnce() {
+    searchIndexLoad ??= loadSearchIndex('assets/markers/search.json')
+        .then(index => {
+            searchIndex = index
+            // Without a layer the plugin asks sourceData
+            searchControl.options.layer = null
+        })
+        .catch(() => console.log('No search index, searching the loaded markers'))
+}
+searchControl.once('search:expanded', loadSearchIndexOnce)
+
 // Load the marker if it is no already on the map
 searchControl.on('search:locationfound', function (marker) {
     if (!map.hasLayer(marker.layer)) {
@@ -212,6 +274,31 @@ searchControl.on('search:locationfound', function (marker) {
     }
 })
 
+function clusterIcon(count) {
+    const size = count < 10 ? 30 : count < 100 ? 36 : 44
+    return L.divIcon({ className: 'marker-cluster', html: '<span>' + count + '</span>', iconSize: [size, size] })
+}
+// A cluster sits in the layer of its highest tier and zooms in when clicked
+function paintCluster(feature, zoom, popupText, layer) {
+    const latlng = L.GeoJSON.coordsToLatLng(feature.geometry.coordinates)
+    L.marker(latlng, { icon: clusterIcon(feature.properties.count) })
+        .bindTooltip(popupText)
+        .on('click', () => map.setView(latlng, zoom + 2))
+        .addTo(layer)
+}
+function paintClaimCluster(feature, zoom) {
+    const p = feature.properties
+    const popupText = p.count + ' claims (up to T' + p.max_tier + ')<br>'
+        + 'Banks : ' + p.has_bank + '<br>'
+        + 'Markets : ' + p.has_market + '<br>'
+        + 'Waystones : ' + p.has_waystone
+    paintCluster(feature, zoom, popupText, claimLayers[p.max_tier])
+}
+function paintCaveCluster(feature, zoom) {
+    const p = feature.properties
+    const popupText = p.count + ' caves (up to T' + p.max_tier + ')<br>' + 'Large : ' + p.large
+    paintCluster(feature, zoom, popupText, caveLayers[p.max_tier - 1])
+}
 // -------------------------------------- //
 // This is getting replaced
 // -------------------------------------- //
@@ -279,8 +366,14 @@ async function loadRuinedGeoJson() {
     })
 }
 async function loadClaimsGeoJson() {
-    const file = await fetch('assets/markers/claims.geojson')
-    const geojsonData = await file.json()
+    if (turnOnMarkerClusters) {
+        const layers = claimLayers.concat(banksLayer, marketsLayer, waystonesLayer)
+        return loadMarkerClusters(map, 'assets/markers/clusters/claims', layers, paintClaims, paintClaimCluster)
+    }
+    if (turnOnMarkerTiles) return loadMarkerTiles(map, 'assets/markers/tiles/claims', paintClaims)
+    paintClaims(await fetchMarkerLayer('assets/markers/claims.geojson'))
+}
+function paintClaims(geojsonData) {
     L.geoJSON(geojsonData, {
         pointToLayer: function (feature, latlng) {
 
@@ -319,8 +412,11 @@ async function loadClaimsGeoJson() {
     })
 }
 async function loadCavesGeoJson() {
-    const file = await fetch('assets/markers/caves.geojson')
-    const geojsonData = await file.json()
+    if (turnOnMarkerClusters) return loadMarkerClusters(map, 'assets/markers/clusters/caves', caveLayers, paintCaves, paintCaveCluster)
+    if (turnOnMarkerTiles) return loadMarkerTiles(map, 'assets/markers/tiles/caves', paintCaves)
+    paintCaves(await fetchMarkerLayer('assets/markers/caves.geojson'))
+}
+function paintCaves(geojsonData) {
     L.geoJSON(geojsonData, {
         pointToLayer: function (feature, latlng) {
 
@@ -459,6 +555,64 @@ async function loadGeoJsonFromFile(fileUrl, layer) {
 }
 
 
+// Road layers can come with simplified copies for low zooms (roads_rN_small.z-3.geojson ...),
+// the coarsest one still as detailed as the current zoom shows is loaded. The manifest lists
+// the copies that were built, {roads_rN_small: [-5, -3, -1]}, layers without any use their full file
+const roadsLodManifest = fetch(mapOptions.roadsLodManifestURL)
+    .then(response => response.ok ? response.json() : {})
+    .catch(() => ({}))
+
+function roadsFileForZoom(baseUrl, levels, zoom) {
+    const level = levels.find(levelZoom => zoom <= levelZoom)
+    return level === undefined ? baseUrl + '.geojson' : baseUrl + '.z' + level + '.geojson'
+}
+
+function loadRoadsByZoom(baseUrl, layer) {
+    const layerName = baseUrl.split('/').pop()
+    const files = new Map() // url -> parsed GeoJSON promise, every file is downloaded once
+    let levels = null
+    let shownUrl = null
+    let firstLoad = true
+
+    function load(url) {
+        if (!files.has(url)) {
+            files.set(url, fetch(url).then(async file => {
+                if (!file.ok) throw new Error(url + ': ' + file.status)
+                return validateGeoJson(await file.text())
+            }))
+        }
+        return files.get(url)
+    }
+
+    async function refresh() {
+        levels ??= [...((await roadsLodManifest)[layerName] || [])].sort((a, b) => a - b)
+        let fileUrl = roadsFileForZoom(baseUrl, levels, map.getZoom())
+        if (fileUrl === shownUrl) return
+        shownUrl = fileUrl
+        let geoJson
+        try {
+            geoJson = await load(fileUrl)
+        } catch (error) {
+            // Listed but not deployed, this layer sticks to its full file from now on
+            console.log(error)
+            levels = []
+            if (fileUrl !== shownUrl) return // a newer refresh is already loading
+            fileUrl = shownUrl = baseUrl + '.geojson'
+            geoJson = await load(fileUrl)
+        }
+        if (fileUrl !== shownUrl) return // zoomed again while this one was loading
+        layer.clearLayers()
+        paintGeoJson(geoJson, layer, firstLoad)
+        firstLoad = false
+    }
+
+    layer.on('add', () => {
+        refresh()
+        map.on('zoomend', refresh)
+    })
+    layer.on('remove', () => map.off('zoomend', refresh))
+}
+
 function paintGeoJson(geoJson, layer, pan = true) {
     L.geoJSON(geoJson, {
         pointToLayer: function (feature, latlng) {
@@ -569,6 +723,7 @@ treesLayer.addTo(map)
 templesLayer.addTo(map)
 ruinedLayer.addTo(map)
 searchControl.addTo(map)
+L.DomEvent.on(searchControl.getContainer(), 'focusin', loadSearchIndexOnce)
 
 const controlLayer = L.control.layers(null, genericToggle, { collapsed: false }).addTo(map)
 
@@ -715,15 +870,7 @@ loadGeoJsonFromBackend()
 
 // Load only when the user is requesting it
 gridsLayer.once('add', () => loadGeoJsonFromFile('assets/markers/grids.geojson', gridsLayer))
-region1Roads.once('add', () => loadGeoJsonFromFile('assets/markers/roads_r1_small.geojson', region1Roads))
-region2Roads.once('add', () => loadGeoJsonFromFile('assets/markers/roads_r2_small.geojson', region2Roads))
-region3Roads.once('add', () => loadGeoJsonFromFile('assets/markers/roads_r3_small.geojson', region3Roads))
-region4Roads.once('add', () => loadGeoJsonFromFile('assets/markers/roads_r4_small.geojson', region4Roads))
-region5Roads.once('add', () => loadGeoJsonFromFile('assets/markers/roads_r5_small.geojson', region5Roads))
-region6Roads.once('add', () => loadGeoJsonFromFile('assets/markers/roads_r6_small.geojson', region6Roads))
-region7Roads.once('add', () => loadGeoJsonFromFile('assets/markers/roads_r7_small.geojson', region7Roads))
-region8Roads.once('add', () => loadGeoJsonFromFile('assets/markers/roads_r8_small.geojson', region8Roads))
-region9Roads.once('add', () => loadGeoJsonFromFile('assets/markers/roads_r9_small.geojson', region9Roads))
+roadsLayers.forEach((layer, index) => loadRoadsByZoom(`assets/markers/roads_r${index + 1}_small`, layer))
 
 /* removing this for now, seems unnecessary (spread markers that are too close together)
 // Note : don't forget to add back <script src="assets/js/spider.js"></script> if you want this
@@ -0,0 +1,32 @@
+"""
+The bitcraftmap data generators, as a package.
+
+Every module can be imported without side effects, its work happens in main(argv=None)
+or in the functions main calls, so a driver or a worker pool can reuse them in process:
+
+    from scripts import generate_roads
+    fc, n_polys = generate_roads.build_roads(text, "fixed", 0.6)
+
+The modules import each other by their plain names (from instrumentation import
+stage), as they do when run as python scripts/<script>.py. This folder is put on
+sys.path and `from scripts import <module>` hands out those same modules, so a
+module is loaded once whichever way it is reached. `from scripts.<module> import
+name` also works, but loads a second copy of that one module under its dotted name.
+
+The command line is in __main__.py, python -m scripts --help.
+"""
+
+import importlib
+import os
+import sys
+
+_folder = os.path.dirname(os.path.abspath(__file__))
+if _folder not in sys.path:
+    sys.path.insert(0, _folder)
+
+
+def __getattr__(name):
+    # Modules are loaded on first access, importing the package loads none of them
+    if not name.startswith('_') and os.path.isfile(os.path.join(_folder, name + '.py')):
+        return importlib.import_module(name)
+    raise AttributeError("module 'scripts' has no attribute " + repr(name))
@@ -0,0 +1,66 @@
+"""
+One command line for all the generators, run from the repository root:
+
+python -m scripts --help
+python -m scripts roads region9.json roads9.geojson
+python -m scripts terrain --offline
+python -m scripts jobs --report reports/runs.jsonl
+
+Each command is the main() of one module and takes the same options as the
+script, `python -m scripts <command> --help` lists them. Only the module of the
+command given is imported: numpy, shapely, PIL, aiohttp or requests are loaded
+by the commands that use them, and light commands start without them.
+"""
+
+import importlib
+import sys
+
+# command: (module, description)
+commands = {
+    'terrain': ('generate_terrain_map', 'Terrain map PNG, tiles and hex map'),
+    'roads': ('generate_roads', 'Hexagonal roads from paved tile points'),
+    'build-roads': ('build_roads', 'Roads of several regions, fetched and built in parallel'),
+    'claims': ('generate_claims_geojson', 'Claims from bitjita into claims.geojson'),
+    'jobs': ('generate_jobs_geojson', 'Open crafting jobs from bitjita into jobs.geojson'),
+    'poi': ('static_poi_to_geojson', 'Caves, trees, temples and ruins from caves.json'),
+    'grids': ('generate_grids_geojson', 'Chunk and region grids'),
+    'icons': ('generate_icons_manifest', 'Icon manifest of assets/images/'),
+    'csv': ('generate_csv_desc_file', 'Cleaned enemy_desc.json and CSV'),
+    'resources': ('generate_resource_csv_desc', 'Flattened resource_desc.json and names'),
+    'flatten': ('flatten_game_data', 'Any GameData dump to CSV and/or Parquet'),
+    'columns': ('marker_columns', 'Columnar .bin files of marker layers'),
+    'tiles': ('generate_marker_tiles', 'z/x/y tiles of marker layers'),
+    'clusters': ('generate_marker_clusters', 'Per-zoom claim and cave clusters'),
+    'search': ('generate_search_index', 'Name search index'),
+    'assets': ('generate_assets', 'Flatten the extracted game assets'),
+    'cache': ('http_cache', 'Inspect or trim the shared HTTP cache'),
+    'build': ('build_pipeline', 'Incremental build of the map assets'),
+    'benchmark': ('benchmark_pipeline', 'Stage benchmarks on synthetic data'),
+}
+
+
+def usage():
+    lines = ['usage: python -m scripts <command> [options]', '', 'commands:']
+    for name, (module, description) in commands.items():
+        lines.append('  ' + name.ljust(13) + description)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0 if argv else 2
+    name, rest = argv[0], argv[1:]
+    if name not in commands:
+        print('Unknown command ' + repr(name) + '\n\n' + usage(), file=sys.stderr)
+        return 2
+
+    module = importlib.import_module(commands[name][0])
+    # Usage lines and run reports read like the command that was typed
+    sys.argv = ['python -m scripts ' + name] + rest
+    return module.main(rest)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Atomic writes for the files the map serves (marker GeoJSON, tiles, terrain
+PNGs, manifest.js, ...).
+
+atomic_open() writes to a temporary file next to the target and moves it over
+the target only once it is complete. os.replace is atomic within a filesystem,
+so a reader sees the old file or the new one, never a half-written one, and a
+write that fails leaves the old file in place.
+
+Folders of generated files (tiles, clusters) are rewritten file by file and the
+files the new run did not write are removed afterwards with remove_stale(), so
+the folder is never emptied while the site serves it.
+"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+
+temp_suffix = '.tmp'
+
+# mkstemp creates files readable by the owner only, the outputs get the usual mode
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+@contextmanager
+def atomic_open(path, mode='w', **kwargs):
+    """open(path, mode) that only replaces `path` once the with block completes."""
+    folder = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.' + os.path.basename(path) + '.', suffix=temp_suffix)
+    try:
+        with os.fdopen(fd, mode, **kwargs) as file:
+            yield file
+        os.chmod(temp_path, 0o666 & ~_umask)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def remove_stale(folder, keep):
+    """
+    Remove the files under `folder` that are not in `keep`, then the folders
+    left empty. Returns the number of files removed.
+    """
+    keep = {os.path.normpath(path) for path in keep}
+    removed = 0
+    for root, dirs, files in os.walk(folder, topdown=False):
+        for name in files:
+            path = os.path.normpath(os.path.join(root, name))
+            if path not in keep:
+                os.remove(path)
+                removed += 1
+        if root != folder and not os.listdir(root):
+            os.rmdir(root)
+    return removed
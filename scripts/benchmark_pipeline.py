@@ -0,0 +1,344 @@
+"""
+Benchmarks of the pipeline stages on synthetic data, so a change to a script
+can be checked against the time and memory of the previous version.
+
+Every suite builds its own input (untimed), then runs its stages in order, each
+stage reading what the previous one produced:
+
+- roads: random-walk paved tiles like the /paved endpoints return, through
+  generate_roads.py (load, stagger, nearest, hex_build, union, serialize)
+- terrain: a gzipped 2400x2400 .gwm, through generate_terrain_map.py (decode,
+  render of the hex map)
+- claims: bitjita claim lists with buildings, through the claims cache, the
+  GeoJSON / columnar writers, the clusters and the search index
+- game_data: a GameData dump like enemy_desc.json, through flatten_game_data.py
+  (parse, flatten)
+
+A stage's time is the best of --repeat runs, its memory the peak traced by
+tracemalloc over one more run (numpy arrays included), above what was held
+before it started. Results are compared with the baseline saved for the same
+--size, and the run exits with status 1 when a stage got slower or bigger than
+the baseline by more than --threshold.
+
+Usage:
+python scripts/benchmark_pipeline.py --save                  # record the baseline
+python scripts/benchmark_pipeline.py                         # compare with it
+python scripts/benchmark_pipeline.py --size large --suite roads terrain
+"""
+
+import argparse
+import gzip
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+baseline_file = 'scripts/benchmark_baseline.json'
+regression_threshold = 0.25   # fraction slower / bigger than the baseline that fails a run
+min_seconds = 0.01            # time differences below this are noise
+min_peak_mb = 1.0             # and so are memory differences below this
+
+# Input size of every suite
+sizes = {
+    'small': {'roads': 10000, 'terrain_render': 300, 'claims': 1000, 'game_data': 2000},
+    'medium': {'roads': 200000, 'terrain_render': 1200, 'claims': 10000, 'game_data': 20000},
+    'large': {'roads': 2000000, 'terrain_render': 2400, 'claims': 50000, 'game_data': 100000},
+}
+
+claim_words = ['Ferra', 'Stone', 'Oak', 'Hollow', 'River', 'Ash', 'Bright', 'Iron', 'Moss', 'Vale',
+               'Haven', 'Crest', 'Ford', 'Wick', 'Moor', 'Glen', 'Marsh', 'Peak', 'Reach', 'Watch']
+# Town Bank, Town Market, Waystone and a few ordinary buildings
+building_ids = [985246037, 934683282, 205715693, 1000, 1001, 1002, 1003, 1004]
+
+
+# ----------------------------------------- #
+# Synthetic inputs
+# ----------------------------------------- #
+def synthetic_paved_tiles(n, seed=0):
+    """
+    n distinct paved tiles as (x, y) integer pairs, laid as random-walk roads
+    that mostly keep their heading, over a world sized to keep them sparse.
+    """
+    rng = np.random.default_rng(seed)
+    side = int(math.sqrt(n) * 8) + 16
+    walk = 200
+    roads = n // walk + 1
+    keys = np.empty(0, dtype=np.int64)
+    while True:
+        starts = rng.integers(0, side, (roads, 1, 2))
+        headings = rng.integers(-1, 2, (roads, 1, 2))
+        turns = rng.integers(-1, 2, (roads, walk, 2))
+        steps = np.where(rng.random((roads, walk, 1)) < 0.8, headings, turns)
+        tiles = (starts + np.cumsum(steps, axis=1)).reshape(-1, 2) % side
+        keys = np.concatenate([keys, tiles[:, 0] * side + tiles[:, 1]])
+        # Distinct tiles in the order they were laid
+        _, first = np.unique(keys, return_index=True)
+        if len(first) >= n:
+            keys = keys[np.sort(first)[:n]]
+            return np.stack([keys // side, keys % side], axis=1).tolist()
+
+
+def synthetic_terrain_gwm(seed=0):
+    """Gzipped .gwm bytes of a 2400x2400 map, blocky so it compresses like the real one."""
+    import generate_terrain_map as terrain
+
+    rng = np.random.default_rng(seed)
+    cells = rng.integers(0, 256, (terrain.height // 8, terrain.width // 8, terrain.pixel_size), dtype=np.uint8)
+    pixels = cells.repeat(8, axis=0).repeat(8, axis=1)
+    return gzip.compress(bytes(terrain.header_size) + pixels.tobytes(), 6)
+
+
+def synthetic_claims(n, seed=0):
+    """n claims as the bitjita claim list returns them, with their buildings."""
+    rng = np.random.default_rng(seed)
+    claims = []
+    for k in range(n):
+        words = rng.choice(len(claim_words), 2, replace=False)
+        buildings = rng.choice(building_ids, int(rng.integers(0, 12)))
+        claims.append({
+            'entityId': str(1000000000000000 + k),
+            'name': claim_words[words[0]] + claim_words[words[1]].lower() + ' ' + str(k % 97),
+            'tier': int(rng.integers(1, 11)),
+            'locationX': int(rng.integers(0, 23040)),
+            'locationZ': int(rng.integers(0, 23040)),
+            'buildings': [{'buildingDescriptionId': int(b), 'entityId': str(k * 100 + i)}
+                          for i, b in enumerate(buildings)],
+        })
+    return claims
+
+
+def synthetic_game_data(n, seed=0):
+    """n records shaped like enemy_desc.json: scalars, nested objects and lists of objects."""
+    rng = np.random.default_rng(seed)
+    return [{
+        'enemy_type': k,
+        'name': 'Enemy ' + str(k),
+        'description': 'A synthetic enemy of tier ' + str(k % 10),
+        'rarity': {'Common': []} if k % 3 else {'Rare': []},
+        'max_health': int(rng.integers(10, 5000)),
+        'armor': float(rng.random()),
+        'awareness': {'daytime_detect_range': float(rng.random() * 20), 'nighttime_detect_range': float(rng.random() * 10)},
+        'extracted_item_stacks': [{'item_id': int(rng.integers(1, 5000)), 'quantity': int(rng.integers(1, 9)),
+                                   'description': 'loot'} for _ in range(int(rng.integers(0, 4)))],
+    } for k in range(n)]
+
+
+# ----------------------------------------- #
+# Suites, each a list of (stage, function) run in order
+# ----------------------------------------- #
+def roads_suite(size, workdir):
+    import generate_roads as roads
+
+    state = {'txt': json.dumps(synthetic_paved_tiles(size['roads']))}
+    apothem = 0.6  # roads.sh builds with --mode fixed and the default apothem
+
+    def hex_build():
+        lattice = roads.HexLattice(apothem)
+        state['edges'] = lattice.boundary_edges(*roads.lattice_coords(state['staggered']))
+
+    def union():
+        state['coords'] = roads.round_rings_2(roads.assemble_polygons(roads.chain_rings(state['edges'])))
+
+    def serialize():
+        coords = roads.simplify_coords(state['coords'], 0.0)
+        fc = {"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": {}, "geometry": {"type": "MultiPolygon", "coordinates": coords}}]}
+        roads.write_geojson(fc, os.path.join(workdir, 'roads.geojson'))
+
+    return [
+        ('load', lambda: state.update(points=roads.load_points_from_text(state['txt']))),
+        ('stagger', lambda: state.update(staggered=roads.stagger_points(state['points']))),
+        ('nearest', lambda: roads.nearest_dist_per_point(state['staggered'])),
+        ('hex_build', hex_build),
+        ('union', union),
+        ('serialize', serialize),
+    ]
+
+
+def terrain_suite(size, workdir):
+    import generate_terrain_map as terrain
+    from http_cache import chunk_size
+
+    state = {'gwm': synthetic_terrain_gwm()}
+
+    def decode():
+        decoder = terrain.TerrainDecoder()
+        body = memoryview(state['gwm'])
+        for start in range(0, len(body), chunk_size):
+            decoder.feed(body[start:start + chunk_size])
+        state['img'] = decoder.finish()
+
+    def render():
+        side = size['terrain_render']
+        terrain.generate_hex_map(state['img'][:side, :side], os.path.join(workdir, 'terrain.hex.png'))
+
+    return [
+        ('decode', decode),
+        ('render', render),
+    ]
+
+
+def claims_suite(size, workdir):
+    from generate_claims_geojson import ClaimsCache, generate_claims_json, write_claims
+    from generate_marker_clusters import aggregates, cluster_layer, cluster_radius, max_zoom, min_zoom
+    from generate_search_index import build_search_index
+    from marker_columns import write_marker_columns
+
+    claims = synthetic_claims(size['claims'])
+    listed = [{k: v for k, v in claim.items() if k != 'buildings'} for claim in claims]
+    cache_path = os.path.join(workdir, 'claims.sqlite')
+    state = {}
+
+    def sync():
+        cache = ClaimsCache(cache_path)
+        cache.sync_claim_list(listed)
+        for claim, full in zip(listed, claims):
+            cache.store_buildings(claim, full['buildings'], 0.0)
+        cache.close()
+
+    def write():
+        cache = ClaimsCache(cache_path)
+        write_claims(cache.iter_claims(), os.path.join(workdir, 'claims.ndjson'), os.path.join(workdir, 'claims.geojson'))
+        cache.close()
+        with open(os.path.join(workdir, 'claims.geojson'), 'r', encoding='utf-8') as file:
+            state['features'] = json.load(file)['features']
+
+    return [
+        ('sync', sync),
+        ('write', write),
+        ('features', lambda: [generate_claims_json(claim) for claim in claims]),
+        ('columns', lambda: write_marker_columns(state['features'], os.path.join(workdir, 'claims.bin'))),
+        ('clusters', lambda: cluster_layer(state['features'], aggregates['claims'],
+                                           range(min_zoom, max_zoom + 1), cluster_radius)),
+        ('search', lambda: build_search_index({'claims': state['features']})),
+    ]
+
+
+def game_data_suite(size, workdir):
+    from flatten_game_data import iter_json_records, write_table
+
+    path = os.path.join(workdir, 'game_data.json')
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(synthetic_game_data(size['game_data']), file, indent=2)
+
+    return [
+        ('parse', lambda: sum(1 for _ in iter_json_records(path))),
+        ('flatten', lambda: write_table(lambda: iter_json_records(path), ['description', 'rarity'],
+                                        csv_path=os.path.join(workdir, 'game_data.csv'))),
+    ]
+
+
+suites = {
+    'roads': roads_suite,
+    'terrain': terrain_suite,
+    'claims': claims_suite,
+    'game_data': game_data_suite,
+}
+
+
+# ----------------------------------------- #
+# Measuring and comparing
+# ----------------------------------------- #
+def measure(fn, repeat):
+    """(best seconds over `repeat` runs, peak MB allocated by one traced run)."""
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        held = tracemalloc.get_traced_memory()[0]
+        fn()
+        peak = tracemalloc.get_traced_memory()[1] - held
+    finally:
+        tracemalloc.stop()
+    return best, peak / (1 << 20)
+
+
+def run_suites(names, size, repeat):
+    """{'suite.stage': {'seconds', 'peak_mb'}} for every stage of the named suites."""
+    results = {}
+    for name in names:
+        with tempfile.TemporaryDirectory() as workdir:
+            print(name + ': building synthetic input ...')
+            for stage, fn in suites[name](size, workdir):
+                seconds, peak_mb = measure(fn, repeat)
+                results[name + '.' + stage] = {'seconds': round(seconds, 4), 'peak_mb': round(peak_mb, 2)}
+                print('  ' + stage.ljust(10) + f'{seconds:9.3f} s {peak_mb:10.1f} MB')
+    return results
+
+
+def regressions(results, baseline, threshold):
+    """Stages slower or bigger than their baseline by more than the threshold, as messages."""
+    found = []
+    for stage, now in results.items():
+        before = baseline.get(stage)
+        if before is None:
+            continue
+        if now['seconds'] > before['seconds'] * (1 + threshold) + min_seconds:
+            found.append(stage + f": {now['seconds']:.3f} s, baseline {before['seconds']:.3f} s")
+        if now['peak_mb'] > before['peak_mb'] * (1 + threshold) + min_peak_mb:
+            found.append(stage + f": {now['peak_mb']:.1f} MB, baseline {before['peak_mb']:.1f} MB")
+    return found
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data")
+    ap.add_argument("--size", choices=list(sizes), default="small")
+    ap.add_argument("--suite", nargs="+", choices=list(suites), default=list(suites))
+    ap.add_argument("--repeat", type=int, default=3, help="Timed runs per stage, the best one counts")
+    ap.add_argument("--baseline", default=baseline_file, help="JSON baselines, one per size")
+    ap.add_argument("--threshold", type=float, default=regression_threshold,
+                    help="Fail when a stage is slower or bigger than its baseline by more than this fraction")
+    ap.add_argument("--save", action="store_true", help="Store this run as the baseline of its size")
+    ap.add_argument("--report", help="Also write the results of this run to this JSON file")
+    args = ap.parse_args(argv)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            baselines = json.load(file)
+
+    results = run_suites(args.suite, sizes[args.size], args.repeat)
+    run = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'stages': results,
+    }
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as file:
+            json.dump(run, file, indent=2)
+
+    if args.save:
+        # Stages not run this time keep their previous baseline
+        stages = baselines.get(args.size, {}).get('stages', {})
+        stages.update(results)
+        baselines[args.size] = {**run, 'stages': stages}
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(baselines, file, indent=2)
+        print('Saved the ' + args.size + ' baseline to ' + args.baseline)
+        return
+
+    baseline = baselines.get(args.size)
+    if baseline is None:
+        print('No ' + args.size + ' baseline in ' + args.baseline + ', run with --save to record one')
+        return
+    found = regressions(results, baseline['stages'], args.threshold)
+    if found:
+        print(str(len(found)) + ' regression(s) past ' + str(round(args.threshold * 100)) + '%:')
+        for message in found:
+            print('  ' + message)
+        sys.exit(1)
+    print('No regression past ' + str(round(args.threshold * 100)) + '% of the ' + args.size + ' baseline')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+"""
+Incremental build of the map assets, the generators run as a graph of stages.
+
+Each stage declares the files it reads and writes. A stage runs after the
+stages that write its inputs, and stages that do not depend on each other run
+at the same time (terrain, claims, POIs, grids, icons...). A stage is skipped
+when its inputs, its code (the script and the sibling modules it imports),
+its command line and its outputs all hash as they did after its last
+successful run.
+
+Stages that read remote data (claims, jobs, terrain, roads) cannot be hashed
+and run every build. Their scripts revalidate cheaply when nothing changed
+upstream (claims cache TTL, HTTP cache 304s, the terrain map ETag). When their
+outputs come out unchanged, the stages downstream are still skipped.
+
+Every generator writes its outputs with atomic_files.atomic_open, so the site
+never serves a half-written file, even while a build runs.
+
+Usage:
+python scripts/build_pipeline.py                  # every default stage
+python scripts/build_pipeline.py tiles search     # these stages and the stages they need
+python scripts/build_pipeline.py tiles --only     # only these stages
+python scripts/build_pipeline.py --dry-run        # what would run, and why
+python scripts/build_pipeline.py --offline        # remote stages from their caches
+python scripts/build_pipeline.py roads            # roads need the local /paved servers, never built by default
+"""
+
+import argparse
+import ast
+import datetime
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from atomic_files import atomic_open
+from instrumentation import add_arguments, note, start_run
+
+scripts_folder = os.path.dirname(os.path.abspath(__file__))
+root_folder = os.path.dirname(scripts_folder)   # stages run from the repository root
+state_file = 'assets/data/build_state.json'
+logs_folder = 'assets/data/build_logs/'   # full output of each stage's last run
+markers = 'assets/markers/'
+log_lines = 20   # output lines shown for a failed stage
+
+
+class Stage:
+    """
+    One generator run. `inputs` and `outputs` are files, folders (every file
+    under them) or glob patterns, relative to the repository root. `remote`
+    stages read data that cannot be hashed and always run, `default` ones run
+    when no stage is named.
+    """
+
+    def __init__(self, name, module, args=(), inputs=(), outputs=(), exclude=(), remote=False,
+                 offline_args=(), default=True):
+        self.name = name
+        self.module = module
+        self.args = list(args)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.exclude = list(exclude)
+        self.remote = remote
+        self.offline_args = list(offline_args)
+        self.default = default
+
+    def command(self, offline=False):
+        args = self.args + (self.offline_args if offline else [])
+        return [sys.executable, os.path.join(scripts_folder, self.module + '.py')] + args
+
+
+poi_layers = ['caves', 'trees', 'temples', 'ruined']   # written by static_poi_to_geojson
+# dungeons.geojson is committed as is, no stage writes it
+
+stages = [
+    Stage('terrain', 'generate_terrain_map', outputs=['assets/data/TerrainMap.hex.png'],
+          remote=True, offline_args=['--offline']),
+    Stage('claims', 'generate_claims_geojson', outputs=[markers + 'claims.geojson', markers + 'claims.bin'],
+          remote=True, offline_args=['--offline']),
+    Stage('jobs', 'generate_jobs_geojson', outputs=[markers + 'jobs/', 'jobs.geojson'], remote=True),
+    Stage('roads', 'build_roads', ['--mode', 'fixed', '--out-dir', markers],
+          outputs=[markers + 'roads_r*_small*.geojson'], remote=True, default=False),
+    Stage('poi', 'static_poi_to_geojson', inputs=['assets/data/caves.json'],
+          outputs=[markers + layer + '.geojson' for layer in poi_layers] + [markers + 'caves.bin']),
+    Stage('grids', 'generate_grids_geojson', outputs=[markers + 'grids.geojson']),
+    Stage('icons', 'generate_icons_manifest', inputs=['assets/images/'], exclude=['assets/images/manifest.js'],
+          outputs=['assets/images/manifest.js']),
+    Stage('tiles', 'generate_marker_tiles',
+          inputs=[markers + layer + '.geojson' for layer in ['claims'] + poi_layers + ['dungeons']],
+          outputs=[markers + 'tiles/']),
+    Stage('clusters', 'generate_marker_clusters', inputs=[markers + 'claims.geojson', markers + 'caves.geojson'],
+          outputs=[markers + 'clusters/']),
+    Stage('search', 'generate_search_index',
+          inputs=[markers + layer + '.geojson' for layer in ['claims', 'caves', 'temples', 'dungeons']],
+          outputs=[markers + 'search.json']),
+]
+
+
+def writer_of(path, candidates):
+    """The stage among `candidates` whose outputs include `path`, None if none does."""
+    path = os.path.normpath(path)
+    for stage in candidates:
+        for output in stage.outputs:
+            output = os.path.normpath(output)
+            if path == output or fnmatch.fnmatch(path, output) or path.startswith(output + os.sep):
+                return stage
+    return None
+
+
+def expand(patterns, exclude=()):
+    """The files matched by the patterns, sorted, without the excluded ones or temporary files."""
+    excluded = {os.path.normpath(path) for path in exclude}
+    files = set()
+    for pattern in patterns:
+        path = os.path.join(root_folder, pattern)
+        if os.path.isdir(path):
+            for folder, _, names in os.walk(path):
+                files.update(os.path.join(folder, name) for name in names)
+        else:
+            files.update(p for p in glob.glob(path, recursive=True) if os.path.isfile(p))
+    relative = (os.path.normpath(os.path.relpath(path, root_folder)) for path in files)
+    return sorted(path for path in relative
+                  if path not in excluded and not os.path.basename(path).startswith('.'))
+
+
+def code_files(module):
+    """The module's file and the files of the sibling modules it imports, recursively."""
+    seen = set()
+    pending = [module]
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        with open(os.path.join(scripts_folder, name + '.py'), 'r', encoding='utf-8') as file:
+            tree = ast.parse(file.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                imported = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                imported = [node.module]
+            else:
+                continue
+            pending.extend(n for n in imported if os.path.isfile(os.path.join(scripts_folder, n + '.py')))
+    return sorted(os.path.relpath(os.path.join(scripts_folder, name + '.py'), root_folder) for name in seen)
+
+
+class FileHashes:
+    """
+    Content hashes of files, remembered with their size and mtime so an
+    unchanged file is not read again on the next build.
+    """
+
+    def __init__(self, known=None):
+        self.known = dict(known or {})
+        self.lock = threading.Lock()
+
+    def file(self, path):
+        stat = os.stat(os.path.join(root_folder, path))
+        with self.lock:
+            entry = self.known.get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        digest = hashlib.sha256()
+        with open(os.path.join(root_folder, path), 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        with self.lock:
+            self.known[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def files(self, paths):
+        digest = hashlib.sha256()
+        for path in paths:
+            digest.update((path + '\0' + self.file(path) + '\n').encode())
+        return digest.hexdigest()
+
+
+class Build:
+
+    def __init__(self, selected, state_path=state_file, offline=False, force=False, dry_run=False, jobs=None):
+        self.selected = selected
+        self.state_path = os.path.join(root_folder, state_path)
+        self.offline = offline
+        self.force = force
+        self.dry_run = dry_run
+        self.jobs = jobs or len(selected) or 1
+        self.state = {'files': {}, 'stages': {}}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as file:
+                self.state = json.load(file)
+        self.hashes = FileHashes(self.state.get('files'))
+        self.lock = threading.Lock()
+        self.results = {}
+
+        # A stage waits for the selected stages writing one of its inputs
+        self.needs = {}
+        for stage in selected:
+            writers = {writer_of(path, selected) for path in stage.inputs} - {None, stage}
+            self.needs[stage.name] = [writer.name for writer in writers]
+
+    def key(self, stage):
+        """Hash of everything a stage's outputs are made from."""
+        missing = [path for path in stage.inputs if not expand([path])]
+        if missing:
+            raise FileNotFoundError('Missing input ' + ', '.join(missing))
+        digest = hashlib.sha256()
+        digest.update(json.dumps([stage.module] + stage.command(self.offline)[2:]).encode())
+        digest.update(self.hashes.files(code_files(stage.module)).encode())
+        digest.update(self.hashes.files(expand(stage.inputs, stage.exclude)).encode())
+        return digest.hexdigest()
+
+    def outputs_key(self, stage):
+        outputs = expand(stage.outputs)
+        if any(not expand([path]) for path in stage.outputs):
+            return None
+        return self.hashes.files(outputs)
+
+    def reason(self, stage, key):
+        """Why the stage has to run, None when it is up to date."""
+        if self.force:
+            return 'forced'
+        if stage.remote:
+            return 'remote data'
+        last = self.state['stages'].get(stage.name)
+        if not last:
+            return 'never built'
+        if last['key'] != key:
+            return 'inputs or code changed'
+        if last['outputs'] != self.outputs_key(stage):
+            return 'outputs missing or changed'
+        return None
+
+    def run_stage(self, stage):
+        started = time.perf_counter()
+        try:
+            key = self.key(stage)
+        except FileNotFoundError as e:
+            # Source data that is not committed (caves.json): the committed outputs stand
+            if self.outputs_key(stage) is not None:
+                return 'skipped', str(e) + ', keeping its outputs', 0.0
+            return 'failed', str(e), 0.0
+        reason = self.reason(stage, key)
+        if reason is None and self.dry_run:
+            # A stage after one that would run would see new inputs
+            upstream = [need for need in self.needs[stage.name] if self.results[need][0] == 'would run']
+            if upstream:
+                return 'would run', 'after ' + ', '.join(upstream), 0.0
+        if reason is None:
+            return 'skipped', 'up to date', 0.0
+        if self.dry_run:
+            return 'would run', reason, 0.0
+
+        env = dict(os.environ)
+        if self.offline:
+            env['BITCRAFTMAP_OFFLINE'] = '1'
+        process = subprocess.run(stage.command(self.offline), cwd=root_folder, env=env,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        wall = time.perf_counter() - started
+        log_path = os.path.join(root_folder, logs_folder, stage.name + '.log')
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        with atomic_open(log_path, 'w', encoding='utf-8') as file:
+            file.write(process.stdout)
+        if process.returncode:
+            tail = process.stdout.rstrip().splitlines()[-log_lines:]
+            return 'failed', 'exit status ' + str(process.returncode) + ', see ' + logs_folder + stage.name + '.log\n    ' \
+                + '\n    '.join(tail), wall
+
+        outputs = self.outputs_key(stage)
+        with self.lock:
+            self.state['stages'][stage.name] = {
+                'key': key,
+                'outputs': outputs,
+                'finished': datetime.datetime.now().astimezone().isoformat(timespec='seconds'),
+                'wall_s': round(wall, 2),
+            }
+            self.save()
+        return 'built', reason, wall
+
+    def save(self):
+        with self.hashes.lock:
+            self.state['files'] = dict(self.hashes.known)
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        with atomic_open(self.state_path, 'w', encoding='utf-8') as file:
+            json.dump(self.state, file, indent=1, sort_keys=True)
+
+    def run(self):
+        """Run the stages, each once the stages it needs are done. Returns {name: (status, detail, wall)}."""
+        pending = {stage.name: stage for stage in self.selected}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    needs = [self.results.get(need) for need in self.needs[name]]
+                    failed = [need for need, result in zip(self.needs[name], needs) if result and result[0] == 'failed']
+                    if failed:
+                        self.results[name] = ('failed', 'needs ' + ', '.join(failed), 0.0)
+                        print(name + ': not run, ' + self.results[name][1])
+                        del pending[name]
+                    elif all(needs):
+                        print(name + ': starting')
+                        running[pool.submit(self.run_stage, stage)] = name
+                        del pending[name]
+                if not running:
+                    if pending:
+                        raise RuntimeError('Stages waiting on each other: ' + ', '.join(pending))
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    self.results[name] = future.result()
+                    status, detail, wall = self.results[name]
+                    summary, _, output = detail.partition('\n')
+                    print(name + ': ' + status + ' (' + summary + ')' + (' in ' + str(round(wall, 2)) + ' s' if wall else ''))
+                    if output:
+                        print(output)
+
+        if not self.dry_run:
+            # Forget the hashes of files gone since, removed tiles and the like
+            self.hashes.known = {path: entry for path, entry in self.hashes.known.items()
+                                 if os.path.exists(os.path.join(root_folder, path))}
+            self.save()
+        return self.results
+
+
+def select_stages(names, only=False, everything=False):
+    """The named stages, with the stages writing their inputs unless `only`, in declaration order."""
+    by_name = {stage.name: stage for stage in stages}
+    if not names:
+        return [stage for stage in stages if stage.default or everything]
+    unknown = [name for name in names if name not in by_name]
+    if unknown:
+        raise KeyError('Unknown stage ' + ', '.join(unknown) + ', stages are ' + ', '.join(by_name))
+    wanted = set(names)
+    pending = [] if only else list(names)
+    while pending:
+        # Pull in the writers of every input, transitively
+        for path in by_name[pending.pop()].inputs:
+            writer = writer_of(path, stages)
+            if writer and writer.name not in wanted:
+                wanted.add(writer.name)
+                pending.append(writer.name)
+    return [stage for stage in stages if stage.name in wanted]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Rebuild the map assets, skipping the stages whose inputs have not changed")
+    ap.add_argument("stages", nargs="*", help="Stages to build (default: every default stage)")
+    ap.add_argument("--only", action="store_true", help="Build only the named stages, not the stages they need")
+    ap.add_argument("--all", action="store_true", help="Also build the stages left out by default (roads)")
+    ap.add_argument("--force", action="store_true", help="Run the stages even when up to date")
+    ap.add_argument("--dry-run", action="store_true", help="Show what would run and why, run nothing")
+    ap.add_argument("--offline", action="store_true", help="Remote stages use their caches, no network")
+    ap.add_argument("--jobs", type=int, default=None, help="Stages run at once (default: all that are ready)")
+    ap.add_argument("--state", default=state_file, help="Hashes of the last successful runs")
+    ap.add_argument("--list", action="store_true", help="List the stages and what they read and write")
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    if args.list:
+        for stage in stages:
+            flags = [flag for flag, on in (('remote', stage.remote), ('not default', not stage.default)) if on]
+            print(stage.name + ' (' + stage.module + '.py' + (', ' + ', '.join(flags) if flags else '') + ')')
+            print('    reads  ' + (', '.join(stage.inputs) or '-'))
+            print('    writes ' + ', '.join(stage.outputs))
+        return
+
+    try:
+        selected = select_stages(args.stages, args.only, args.all)
+    except KeyError as e:
+        ap.error(e.args[0])
+
+    with start_run('build_pipeline', args):
+        build = Build(selected, args.state, args.offline, args.force, args.dry_run, args.jobs)
+        results = build.run()
+        note('stages', {name: {'status': status, 'detail': detail, 'wall_s': round(wall, 2)}
+                        for name, (status, detail, wall) in results.items()})
+        counts = {}
+        for status, _, _ in results.values():
+            counts[status] = counts.get(status, 0) + 1
+        print(', '.join(str(count) + ' ' + status for status, count in sorted(counts.items())))
+    if any(status == 'failed' for status, _, _ in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Build the road layers of all regions in one go (replaces the curl loop in roads.sh).
+
+- Fetches every region's /paved endpoint concurrently over one pooled HTTP session.
+- Hands each payload to a process pool as soon as it arrives. Workers import the
+  road engine (generate_roads.py) once and reuse it for every region they get.
+- Writes roads_r<N>_small.geojson as each region finishes, with the simplified
+  roads_r<N>_small.z<zoom>.geojson layers map.js loads at low zooms, and reports timings.
+- Lists the levels of every built region in roads_lod.json, the manifest map.js reads.
+
+Usage:
+python scripts/build_roads.py
+python scripts/build_roads.py --regions 1 2 3 --out-dir assets/markers --save-raw
+python scripts/build_roads.py --url-template http://127.0.0.1:{port}/paved --base-port 5001
+"""
+
+import argparse, os, sys, time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import add_arguments, note, stage, start_run
+
+REGIONS = list(range(1, 10))
+URL_TEMPLATE = "http://localhost:{port}/paved"
+BASE_PORT = 4000          # region N is served on BASE_PORT + N
+OUTPUT_NAME = "roads_r{region}_small.geojson"
+RAW_NAME = "region{region}.json"
+LOD_ZOOMS = [-5.0, -3.0, -1.0]  # same as generate_roads.LOD_ZOOMS, importing it here would load numpy
+
+_engine = None
+
+def make_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def fetch_region(session: requests.Session, url: str, timeout: float) -> Tuple[str, float]:
+    start = time.perf_counter()
+    response = session.get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.text, time.perf_counter() - start
+
+def _init_worker():
+    # Import the engine (numpy, shapely) once per worker process
+    global _engine
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import generate_roads
+    _engine = generate_roads
+
+def _build_region(job) -> Tuple[int, int, float]:
+    region, txt, output, mode, apothem, lod_zooms, quantize = job
+    start = time.perf_counter()
+    fc, n_polys = _engine.build_roads(txt, mode, apothem, workers=1)
+    _engine.write_roads(fc, output, lod_zooms, quantize)
+    return region, n_polys, time.perf_counter() - start
+
+def build_all(regions: List[int], url_template: str, base_port: int, out_dir: str, mode: str = "fixed",
+              apothem: Optional[float] = None, workers: Optional[int] = None, save_raw: bool = False,
+              lod_zooms: Optional[List[float]] = None, quantize: bool = False,
+              timeout: float = 300.0) -> Dict[int, Dict[str, float]]:
+    """Fetch and build every region, returns per-region timings."""
+    os.makedirs(out_dir, exist_ok=True)
+    report: Dict[int, Dict[str, float]] = {}
+    failed = []
+    session = make_session(len(regions))
+    with ThreadPoolExecutor(max_workers=len(regions)) as fetchers, \
+         ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as builders:
+        fetches = {}
+        for region in regions:
+            url = url_template.format(port=base_port + region, region=region)
+            print(f"Requesting {url}")
+            fetches[fetchers.submit(fetch_region, session, url, timeout)] = region
+
+        builds = {}
+        for done in as_completed(fetches):
+            region = fetches[done]
+            try:
+                txt, fetch_time = done.result()
+            except requests.RequestException as e:
+                print(f"Region {region}: fetch failed: {e}", file=sys.stderr)
+                failed.append(region)
+                continue
+            report[region] = {"fetch": fetch_time, "bytes": len(txt)}
+            print(f"Region {region}: fetched {len(txt)} bytes in {fetch_time:.2f}s")
+            if save_raw:
+                with open(os.path.join(out_dir, RAW_NAME.format(region=region)), "w", encoding="utf-8") as f:
+                    f.write(txt)
+            output = os.path.join(out_dir, OUTPUT_NAME.format(region=region))
+            builds[builders.submit(_build_region, (region, txt, output, mode, apothem, lod_zooms, quantize))] = region
+
+        for done in as_completed(builds):
+            region = builds[done]
+            try:
+                _, n_polys, build_time = done.result()
+            except Exception as e:
+                print(f"Region {region}: build failed: {e}", file=sys.stderr)
+                failed.append(region)
+                continue
+            report[region].update({"build": build_time, "polygons": n_polys})
+            print(f"Region {region}: wrote {n_polys} polygon(s) in {build_time:.2f}s")
+    session.close()
+
+    if failed:
+        report["failed"] = sorted(failed)
+    return report
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Fetch all regions' paved tiles concurrently and build their road GeoJSON")
+    ap.add_argument("--regions", type=int, nargs="+", default=REGIONS, help="Region ids (default: 1-9)")
+    ap.add_argument("--url-template", default=URL_TEMPLATE,
+                    help="Paved endpoint, {port} and {region} are substituted")
+    ap.add_argument("--base-port", type=int, default=BASE_PORT, help="Region N uses port BASE_PORT + N")
+    ap.add_argument("--out-dir", default=".", help="Folder for roads_r<N>_small.geojson")
+    ap.add_argument("--mode", choices=["per-point","fixed"], default="fixed")
+    ap.add_argument("--apothem", type=float, default=None)
+    ap.add_argument("--workers", type=int, default=None, help="Build processes (default: CPU count)")
+    ap.add_argument("--save-raw", action="store_true", help="Also keep region<N>.json as fetched")
+    ap.add_argument("--lod-zooms", type=float, nargs="*", default=LOD_ZOOMS, metavar="ZOOM",
+                    help="Map zooms that get a simplified layer (default: %(default)s, none if given empty)")
+    ap.add_argument("--quantize", action="store_true", help="Also write every layer as quantized .qjson")
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    with start_run("build_roads", args):
+        # Fetches run in threads and builds in worker processes, the per-region
+        # timings go to the report as they are
+        with stage("build_all", len(args.regions)):
+            report = build_all(args.regions, args.url_template, args.base_port, args.out_dir, args.mode,
+                               args.apothem, args.workers, args.save_raw, args.lod_zooms, args.quantize)
+        failed = report.pop("failed", [])
+        # One process writes the manifest, after every region's levels are on disk
+        from generate_roads import update_lod_manifest
+        update_lod_manifest(args.out_dir, {OUTPUT_NAME.format(region=region).rpartition(".")[0]: args.lod_zooms
+                                           for region, timings in report.items() if "build" in timings})
+        note("regions", {str(region): timings for region, timings in sorted(report.items())})
+        note("failed", failed)
+
+        print("region   fetch s   build s   polygons")
+        for region in sorted(report):
+            r = report[region]
+            print(f"{region:>6} {r['fetch']:>9.2f} {r.get('build', float('nan')):>9.2f} {int(r.get('polygons', 0)):>10}")
+    if failed:
+        print(f"Failed regions: {failed}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Shared streaming flattener for the BitCraft_GameData dumps (enemy_desc.json,
+resource_desc.json, ...), used by generate_csv_desc_file.py and
+generate_resource_csv_desc.py.
+
+Top-level records are parsed one at a time from the file, so memory stays flat
+whatever the size of the dump. Records are pruned and flattened in one step:
+nested objects become dotted columns ("a.b"), lists are kept as JSON strings.
+A first pass learns the columns, a second pass writes the rows, to CSV and/or
+to Parquet (needs pyarrow).
+
+Usage:
+python scripts/flatten_game_data.py resource_desc.json --csv resource_desc.csv --drop description rarity
+python scripts/flatten_game_data.py item_desc.json --parquet item_desc.parquet
+"""
+
+import argparse
+import csv
+import json
+import re
+from contextlib import nullcontext
+
+from atomic_files import atomic_open
+from instrumentation import add_arguments, stage, start_run
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+chunk_size = 1 << 16       # characters read at a time
+parquet_batch = 10000      # rows per Parquet row group
+
+_whitespace = re.compile(r'\s*')
+_number = re.compile(r'[-+0-9.eE]+')
+_decoder = json.JSONDecoder()
+
+
+class _RecordReader:
+    """Buffered reader handing out the JSON values of a text file one by one."""
+
+    def __init__(self, file, chunk):
+        self.file = file
+        self.chunk = chunk
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        # Read at least as much as is buffered, so a value bigger than a chunk
+        # is re-parsed a logarithmic number of times, not once per chunk
+        data = self.file.read(max(self.chunk, len(self.buffer) - self.pos))
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        self.eof = not data
+
+    def peek(self):
+        """Next non-whitespace character, '' at the end of the file."""
+        while True:
+            self.pos = _whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected ' + repr(char) + ' in the JSON document, found ' + repr(self.peek() or 'the end'))
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            # A number running into the end of the buffer may go on in the next chunk
+            number = _number.match(self.buffer, self.pos)
+            if number and number.end() == len(self.buffer) and not self.eof:
+                self._fill()
+                continue
+            try:
+                value, self.pos = _decoder.raw_decode(self.buffer, self.pos)
+                return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def iter_json_records(path, chunk=chunk_size):
+    """
+    Yield the top-level records of a JSON file: the items of an array, or for
+    an object one record per member, {"key": k, **v} (or {"key": k, "value": v}
+    when v is not an object). Any other document is a single record.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        reader = _RecordReader(file, chunk)
+        start = reader.peek()
+        if start not in ('[', '{'):
+            yield reader.value()
+            return
+        reader.pos += 1
+        end = ']' if start == '[' else '}'
+        first = True
+        while reader.peek() != end:
+            if not first:
+                reader.expect(',')
+            first = False
+            if start == '[':
+                yield reader.value()
+            else:
+                key = reader.value()
+                reader.expect(':')
+                value = reader.value()
+                yield {"key": key, **value} if isinstance(value, dict) else {"key": key, "value": value}
+        reader.pos += 1
+
+
+def prune(obj, drop_keys, recursive=True):
+    """Copy of obj without the drop_keys, at any depth or only at the top."""
+    if isinstance(obj, list):
+        return [prune(x, drop_keys, recursive) for x in obj]
+    if isinstance(obj, dict):
+        if recursive:
+            return {k: prune(v, drop_keys, recursive) for k, v in obj.items() if k not in drop_keys}
+        return {k: v for k, v in obj.items() if k not in drop_keys}
+    return obj
+
+
+def flatten_record(record, drop_keys=frozenset(), recursive=True):
+    """Prune and flatten one record into a row, {"a.b": value, "list": "[...]"}."""
+    if not isinstance(record, dict):
+        return {"value": record}
+    row = {}
+
+    def walk(obj, prefix, drop):
+        for k, v in obj.items():
+            if k in drop:
+                continue
+            if isinstance(v, dict):
+                walk(v, prefix + k + '.', drop if recursive else ())
+            elif isinstance(v, list):
+                row[prefix + k] = json.dumps(prune(v, drop_keys, True) if recursive else v, ensure_ascii=False)
+            else:
+                row[prefix + k] = v
+
+    walk(record, '', drop_keys)
+    return row
+
+
+class TableSchema:
+    """Columns seen in the rows, with the kinds of value each one holds."""
+
+    def __init__(self):
+        self.kinds = {}
+
+    def add(self, row):
+        for column, value in row.items():
+            kinds = self.kinds.setdefault(column, set())
+            if value is not None:
+                kinds.add(type(value))
+
+    @property
+    def columns(self):
+        return sorted(self.kinds)
+
+    def _arrow_type(self, kinds):
+        if kinds == {bool}:
+            return pa.bool_()
+        if kinds == {int}:
+            return pa.int64()
+        if kinds and kinds <= {int, float}:
+            return pa.float64()
+        return pa.string()
+
+    def arrow_schema(self):
+        return pa.schema([(column, self._arrow_type(self.kinds[column])) for column in self.columns])
+
+
+def _arrow_value(value, arrow_type):
+    # Mixed columns are stored as text, as they would read in the CSV
+    if value is None or not pa.types.is_string(arrow_type) or isinstance(value, str):
+        return value
+    return str(value)
+
+
+def write_table(records, drop_keys=(), csv_path=None, parquet_path=None, recursive=True, on_record=None):
+    """
+    Flatten the records of `records()`, called once per pass, into csv_path
+    and/or parquet_path. on_record sees every record of the first pass, for
+    outputs that need the records themselves. Returns the schema.
+    """
+    if parquet_path and not HAVE_PYARROW:
+        raise RuntimeError('Parquet output needs pyarrow, pip install pyarrow')
+    drop_keys = frozenset(drop_keys)
+
+    schema = TableSchema()
+    count = 0
+    with stage('schema') as span:
+        for record in records():
+            if on_record:
+                on_record(record)
+            schema.add(flatten_record(record, drop_keys, recursive))
+            count += 1
+        span.items = count
+    if not csv_path and not parquet_path:
+        return schema
+    columns = schema.columns
+
+    with atomic_open(csv_path, 'w', newline='', encoding='utf-8') if csv_path else nullcontext() as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=columns, restval='') if csv_path else None
+        if writer:
+            writer.writeheader()
+        arrow_schema = schema.arrow_schema() if parquet_path else None
+        parquet = pq.ParquetWriter(parquet_path, arrow_schema) if parquet_path else None
+        try:
+            batch = []
+            with stage('rows', count):
+                for record in records():
+                    row = flatten_record(record, drop_keys, recursive)
+                    if writer:
+                        writer.writerow(row)
+                    if parquet:
+                        batch.append(row)
+                        if len(batch) == parquet_batch:
+                            _write_batch(parquet, arrow_schema, batch)
+                            batch = []
+                if parquet and batch:
+                    _write_batch(parquet, arrow_schema, batch)
+        finally:
+            if parquet:
+                parquet.close()
+    return schema
+
+
+def _write_batch(parquet, arrow_schema, rows):
+    columns = {
+        field.name: [_arrow_value(row.get(field.name), field.type) for row in rows]
+        for field in arrow_schema
+    }
+    parquet.write_table(pa.Table.from_pydict(columns, schema=arrow_schema))
+
+
+class JsonArrayWriter:
+    """Write records one at a time as a JSON array, laid out like json.dump(list, indent=indent)."""
+
+    def __init__(self, file, indent=None):
+        self.file = file
+        self.indent = indent
+        self.count = 0
+
+    def write(self, record):
+        text = json.dumps(record, ensure_ascii=False, indent=self.indent)
+        if self.indent is None:
+            self.file.write(('[' if not self.count else ', ') + text)
+        else:
+            pad = ' ' * self.indent
+            self.file.write(('[\n' if not self.count else ',\n') + pad + text.replace('\n', '\n' + pad))
+        self.count += 1
+
+    def close(self):
+        if not self.count:
+            self.file.write('[]')
+        else:
+            self.file.write(']' if self.indent is None else '\n]')
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Flatten a BitCraft_GameData JSON dump into CSV and/or Parquet")
+    ap.add_argument("input")
+    ap.add_argument("--csv", help="CSV output")
+    ap.add_argument("--parquet", help="Parquet output, needs pyarrow")
+    ap.add_argument("--drop", nargs="*", default=[], help="Keys to drop")
+    ap.add_argument("--top-level-only", action="store_true", help="Drop the keys only at the top of each record")
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+    if not args.csv and not args.parquet:
+        ap.error('Nothing to write, give --csv and/or --parquet')
+
+    with start_run('flatten_game_data', args):
+        schema = write_table(lambda: iter_json_records(args.input), args.drop, args.csv, args.parquet,
+                             recursive=not args.top_level_only)
+        print('Wrote ' + str(len(schema.columns)) + ' columns to ' + ', '.join(p for p in (args.csv, args.parquet) if p))
+
+
+if __name__ == "__main__":
+    main()
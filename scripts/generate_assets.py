@@ -1,6 +1,13 @@
+import argparse
 import os
 import shutil
 
+from instrumentation import add_arguments, stage, start_run
+
+source = "C:/Users/Manserk/repos/bitcraftassets"
+destination = "C:/Users/Manserk/repos/bitcraftassets_flat"
+extensions_to_delete = ['.asset', '.glb', '.cs', '.dll', '.csproj', '.bytes', '.json']
+
 def flatten_folder(src_dir, dst_dir):
     os.makedirs(dst_dir, exist_ok=True)
 
@@ -27,11 +34,20 @@ def empty_folder(folder):
         shutil.rmtree(folder)
     os.makedirs(folder, exist_ok=True)
 
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Flatten the extracted game assets into one folder")
+    ap.add_argument("--source", default=source)
+    ap.add_argument("--destination", default=destination)
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    with start_run("generate_assets", args):
+        with stage("empty"):
+            empty_folder(args.destination)
+        with stage("flatten"):
+            flatten_folder(args.source, args.destination)
+        with stage("delete"):
+            delete_by_extension(args.destination, extensions_to_delete)
+
 if __name__ == "__main__":
-    source = "C:/Users/Manserk/repos/bitcraftassets"
-    destination = "C:/Users/Manserk/repos/bitcraftassets_flat"
-    extensions_to_delete = ['.asset', '.glb', '.cs', '.dll', '.csproj', '.bytes', '.json']
-    
-    empty_folder(destination)
-    flatten_folder(source, destination)
-    delete_by_extension(destination, extensions_to_delete)
\ No newline at end of file
+    main()
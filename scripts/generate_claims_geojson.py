@@ -1,61 +1,215 @@
-import requests
+import argparse
+import asyncio
 import json
 import math
+import os
+import random
+import sqlite3
 import time
 
-start_time = time.time()
+from atomic_files import atomic_open
+from instrumentation import add_arguments, stage, start_run
+from marker_columns import columns_path, write_marker_columns
 
 limit = 100
-all_claims = []
-all_claims_with_buildings = []
-current_page = 1
-sleep_time = 0.5
+requests_per_second = 2.0   # upstream budget, the old script slept 0.5s between requests
+burst = 4                   # requests allowed back to back before the rate applies
+concurrency = 8             # requests in flight at once
+retries = 5
 claims_url = 'https://bitjita.com/api/claims/'
 user_agent = {'User-agent': 'Manserk For bitcraftmap.com'}
-raw_claims_file = 'assets/data/claims.json' # This file will be too big we need to gitignore it
+raw_claims_file = 'assets/data/claims.ndjson' # One claim with its buildings per line, too big to commit
+cache_file = 'assets/data/claims.sqlite' # Building lists of every claim, lets a refresh skip unchanged claims
+cache_ttl = 24 * 3600      # seconds before a cached building list is due for a refetch
 geojson_claims_file = 'assets/markers/claims.geojson'
 
-# Requesting the first page of the claim list
-full_url = claims_url + '?limit=' + str(limit) + '&page=' + str(current_page)
-print('Requesting ' + full_url)
-data = requests.get(full_url, user_agent).json()
-total_claims = int(data['count'])
-total_pages = math.ceil(total_claims / limit)
 
-print('There are ' + data['count'] + ' claims to request in a total of ' + str(total_pages) + ' pages')
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, at most `capacity` saved up."""
 
-# Collecting list of claim entityId from bitjita
-for page in range(total_pages) :
-    time.sleep(sleep_time)
-    full_url = claims_url + '?limit=' + str(limit) + '&page=' + str(page+1)
-    print('Requesting ' + full_url)
-    data = requests.get(full_url, user_agent).json()
-    all_claims.extend(data['claims'])
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
 
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
 
-print(all_claims)
-print(str(total_claims))
-print(str(len(all_claims)))
 
-# Checking if we got the right number of claims
-if total_claims - len(all_claims) > 0:
-    print('Total claims from initial count and requested count is not the same, terminating')
-    exit(1)
+class RetryableError(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__('HTTP ' + str(status))
+        self.retry_after = retry_after
 
-# For each entityId, requesting the list of buildings
-counter = total_claims
-for claim in all_claims:
-    time.sleep(sleep_time)
-    counter -= 1
-    buildings_endpoint = claims_url + str(claim['entityId']) + '/buildings'
-    print('Requesting ' + buildings_endpoint + ' ' + str(counter) + ' left to do')
-    claim['buildings'] = requests.get(buildings_endpoint, user_agent).json()
-    all_claims_with_buildings.append(claim)
 
-print('Counted ' + str(total_claims) + ' claims and there are ' + str(len(all_claims_with_buildings)) + ' total claims in the json file')
+class Crawler:
+    """Pooled keep-alive session with a shared rate limit, bounded concurrency and retries."""
+
+    def __init__(self, session, bucket, max_in_flight, max_retries):
+        self.session = session
+        self.bucket = bucket
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.max_retries = max_retries
+
+    async def get_json(self, url):
+        import aiohttp
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                async with self.in_flight:
+                    async with self.session.get(url) as response:
+                        if response.status == 429 or response.status >= 500:
+                            retry_after = response.headers.get('Retry-After')
+                            raise RetryableError(response.status, float(retry_after) if retry_after and retry_after.isdigit() else None)
+                        response.raise_for_status()
+                        return await response.json(content_type=None)
+            except (RetryableError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise
+                # Exponential backoff with full jitter, unless the server said how long to wait
+                delay = getattr(e, 'retry_after', None) or random.uniform(0, min(60, 2 ** attempt))
+                print('Retrying ' + url + ' in ' + str(round(delay, 2)) + 's (' + str(e) + ')')
+                await asyncio.sleep(delay)
+
+
+class ClaimsCache:
+    """SQLite cache of claim building lists keyed by entityId.
+
+    `claim` is the latest claim list entry, `tier` is the tier the buildings were
+    fetched at and `fetched_at` when they were fetched, so a refresh can tell which
+    building lists are worth requesting again.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS claims ('
+            ' entity_id TEXT PRIMARY KEY,'
+            ' position INTEGER NOT NULL,'
+            ' claim TEXT NOT NULL,'
+            ' tier INTEGER,'
+            ' buildings TEXT,'
+            ' fetched_at REAL)')
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def sync_claim_list(self, all_claims):
+        """Store the current claim list and drop the claims that are gone."""
+        self.db.execute('CREATE TEMP TABLE IF NOT EXISTS listed (entity_id TEXT PRIMARY KEY)')
+        self.db.execute('DELETE FROM listed')
+        self.db.executemany('INSERT OR IGNORE INTO listed VALUES (?)',
+                            [(str(claim['entityId']),) for claim in all_claims])
+        removed = self.db.execute('DELETE FROM claims WHERE entity_id NOT IN (SELECT entity_id FROM listed)').rowcount
+        self.db.executemany(
+            'INSERT INTO claims (entity_id, position, claim) VALUES (?, ?, ?) '
+            'ON CONFLICT(entity_id) DO UPDATE SET position = excluded.position, claim = excluded.claim',
+            [(str(claim['entityId']), position, json.dumps(claim)) for position, claim in enumerate(all_claims)])
+        self.db.commit()
+        return removed
+
+    def refresh_plan(self, now, ttl):
+        """Claims whose buildings should be requested, most likely changed first.
+
+        New claims come first, then claims whose tier changed since their buildings
+        were fetched, then the entries older than `ttl` seconds, stalest first.
+        """
+        rows = self.db.execute('SELECT claim, tier, fetched_at FROM claims ORDER BY position').fetchall()
+        new, tier_changed, expired = [], [], []
+        for claim_json, tier, fetched_at in rows:
+            claim = json.loads(claim_json)
+            if fetched_at is None:
+                new.append(claim)
+            elif tier != claim['tier']:
+                tier_changed.append(claim)
+            elif now - fetched_at >= ttl:
+                expired.append((fetched_at, claim))
+        expired.sort(key=lambda entry: entry[0])
+        return new, tier_changed, [claim for _, claim in expired]
+
+    def store_buildings(self, claim, buildings, now):
+        self.db.execute('UPDATE claims SET tier = ?, buildings = ?, fetched_at = ? WHERE entity_id = ?',
+                        (claim['tier'], json.dumps(buildings), now, str(claim['entityId'])))
+
+    def commit(self):
+        self.db.commit()
+
+    def iter_claims(self):
+        """Yield every cached claim with its buildings, in claim list order.
+
+        Claims never fetched so far (a refresh cut short by its budget) get an empty
+        building list rather than being left off the map.
+        """
+        for claim_json, buildings in self.db.execute('SELECT claim, buildings FROM claims ORDER BY position'):
+            claim = json.loads(claim_json)
+            claim['buildings'] = json.loads(buildings) if buildings is not None else []
+            yield claim
+
+
+async def crawl_claims(base_url, cache, ttl, budget, rate, capacity, max_in_flight, max_retries):
+    """Sync the claim list into `cache` and refetch the building lists worth refreshing."""
+    import aiohttp  # only the crawl needs it, --offline runs without
+    timeout = aiohttp.ClientTimeout(total=120)
+    connector = aiohttp.TCPConnector(limit=max_in_flight, keepalive_timeout=60)
+    async with aiohttp.ClientSession(headers=user_agent, connector=connector, timeout=timeout) as session:
+        crawler = Crawler(session, TokenBucket(rate, capacity), max_in_flight, max_retries)
+
+        # Requesting the first page of the claim list
+        full_url = base_url + '?limit=' + str(limit) + '&page=1'
+        print('Requesting ' + full_url)
+        data = await crawler.get_json(full_url)
+        total_claims = int(data['count'])
+        total_pages = math.ceil(total_claims / limit)
+        print('There are ' + str(total_claims) + ' claims to request in a total of ' + str(total_pages) + ' pages')
+
+        # Collecting list of claim entityId from bitjita, page 1 is already here
+        pages = [data] + await asyncio.gather(*[
+            crawler.get_json(base_url + '?limit=' + str(limit) + '&page=' + str(page))
+            for page in range(2, total_pages + 1)
+        ])
+        all_claims = [claim for page in pages for claim in page['claims']]
+
+        # Checking if we got the right number of claims
+        if total_claims - len(all_claims) > 0:
+            raise RuntimeError('Total claims from initial count and requested count is not the same')
+
+        removed = cache.sync_claim_list(all_claims)
+        new, tier_changed, expired = cache.refresh_plan(time.time(), ttl)
+        todo = new + tier_changed + expired
+        if budget is not None:
+            todo = todo[:budget]
+        print(str(len(new)) + ' new, ' + str(len(tier_changed)) + ' tier changes, ' + str(len(expired))
+              + ' expired, ' + str(removed) + ' removed, requesting ' + str(len(todo)) + ' building lists')
+
+        # For each claim to refresh, requesting the list of buildings. Each result goes
+        # straight into the cache, so an interrupted run only loses what was in flight
+        left = len(todo)
+
+        async def fetch_buildings(claim):
+            nonlocal left
+            buildings_endpoint = base_url + str(claim['entityId']) + '/buildings'
+            cache.store_buildings(claim, await crawler.get_json(buildings_endpoint), time.time())
+            left -= 1
+            if left % 100 == 0:
+                cache.commit()
+                print(str(left) + ' left to do')
+
+        try:
+            await asyncio.gather(*[fetch_buildings(claim) for claim in todo])
+        finally:
+            cache.commit()
 
-with open(raw_claims_file, "w") as file:
-    json.dump(all_claims_with_buildings, file)
 
 def generate_claims_json(json_key):
 
@@ -90,15 +244,63 @@ def generate_claims_json(json_key):
         }
     }
 
-with open(raw_claims_file, 'r', encoding='utf-8') as file:
-    data = json.load(file)
 
-claims_geojson = {
-    "type": "FeatureCollection",
-    "features": [generate_claims_json(key) for key in data]
-}
+def write_claims(claims, raw_path, geojson_path):
+    """Stream claims to the NDJSON dump and their features to the FeatureCollection.
+
+    One claim is held at a time, so memory does not grow with the claim count.
+    """
+    count = 0
+    with atomic_open(raw_path, 'w', encoding='utf-8') as raw, atomic_open(geojson_path, 'w', encoding='utf-8') as out:
+        out.write('{"type":"FeatureCollection","features":[')
+        for claim in claims:
+            raw.write(json.dumps(claim, separators=(',', ':')) + '\n')
+            if count:
+                out.write(',')
+            out.write(json.dumps(generate_claims_json(claim), separators=(',', ':')))
+            count += 1
+        out.write(']}')
+    return count
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Crawl bitjita claims and their buildings into claims.geojson")
+    ap.add_argument("--base-url", default=claims_url, help="Claims API root, e.g. a local stub")
+    ap.add_argument("--rate", type=float, default=requests_per_second, help="Requests per second")
+    ap.add_argument("--burst", type=int, default=burst, help="Token bucket capacity")
+    ap.add_argument("--concurrency", type=int, default=concurrency, help="Requests in flight")
+    ap.add_argument("--retries", type=int, default=retries, help="Retries per request")
+    ap.add_argument("--cache", default=cache_file, help="SQLite building cache")
+    ap.add_argument("--ttl", type=float, default=cache_ttl, help="Seconds before a cached building list is refetched")
+    ap.add_argument("--budget", type=int, default=None, help="At most this many building requests per run")
+    ap.add_argument("--offline", action="store_true", help="Rebuild the outputs from the cache without any request")
+    ap.add_argument("--raw-output", default=raw_claims_file)
+    ap.add_argument("--output", default=geojson_claims_file)
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    if args.offline and not os.path.exists(args.cache):
+        raise SystemExit('No claims cache at ' + args.cache + ', run once online first')
+
+    with start_run('generate_claims_geojson', args):
+        cache = ClaimsCache(args.cache)
+        try:
+            if not args.offline:
+                with stage('crawl'):
+                    asyncio.run(crawl_claims(
+                        args.base_url, cache, args.ttl, args.budget,
+                        args.rate, args.burst, args.concurrency, args.retries))
+            with stage('write') as span:
+                count = write_claims(cache.iter_claims(), args.raw_output, args.output)
+                span.items = count
+            # Compact columnar copy for map.js, second cheap pass over the cache
+            with stage('columns', count):
+                write_marker_columns(map(generate_claims_json, cache.iter_claims()), columns_path(args.output))
+        finally:
+            cache.close()
+
+        print('Counted ' + str(count) + ' claims in the json file')
 
-with open(geojson_claims_file, 'w') as file:
-    json.dump(claims_geojson, file)
 
-print('Finished after ' + str(time.time() - start_time) + ' seconds')
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
-import json
-import requests
-import csv
+import argparse
+
+from atomic_files import atomic_open
+from flatten_game_data import JsonArrayWriter, iter_json_records, prune, write_table
+from http_cache import HttpCache
+from instrumentation import add_arguments, stage, start_run
 
 URL = "https://raw.githubusercontent.com/BitCraftToolBox/BitCraft_GameData/refs/heads/main/server/region/enemy_desc.json"
 OUTPUT_JSON = "enemy_cleaned.json"
 OUTPUT_CSV  = "enemy_cleaned.csv"
 EXPORT_CSV  = True
+OUTPUT_PARQUET = None  # e.g. "enemy_cleaned.parquet", needs pyarrow
 
 DROP_KEYS = [
     "description",
@@ -46,38 +50,25 @@ DROP_KEYS = [
 ]
 
 
-def remove_keys(obj):
-    if isinstance(obj, dict):
-        return {k: remove_keys(v) for k, v in obj.items() if k not in DROP_KEYS}
-    if isinstance(obj, list):
-        return [remove_keys(v) for v in obj]
-    return obj
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Clean enemy_desc.json into " + OUTPUT_JSON + " and " + OUTPUT_CSV)
+    add_arguments(ap)
+    args = ap.parse_args(argv)
 
-# fetch
-resp = requests.get(URL)
-resp.raise_for_status()
-data = resp.json()
+    with start_run("generate_csv_desc_file", args):
+        # fetch, a 304 when the dump has not changed (BITCRAFTMAP_OFFLINE=1 to use the cached copy)
+        with stage("fetch"), HttpCache() as cache:
+            input_json = cache.fetch(URL).path
 
-# clean
-cleaned = remove_keys(data)
+        # clean, save JSON and the optional CSV, one record in memory at a time
+        with atomic_open(OUTPUT_JSON, "w", encoding="utf-8") as f:
+            cleaned = JsonArrayWriter(f, indent=2)
+            write_table(lambda: iter_json_records(input_json), DROP_KEYS,
+                        csv_path=OUTPUT_CSV if EXPORT_CSV else None,
+                        parquet_path=OUTPUT_PARQUET,
+                        on_record=lambda record: cleaned.write(prune(record, DROP_KEYS)))
+            cleaned.close()
 
-# save JSON
-with open(OUTPUT_JSON, "w", encoding="utf-8") as f:
-    json.dump(cleaned, f, ensure_ascii=False, indent=2)
 
-# optional CSV
-if EXPORT_CSV:
-    # assume top-level is a dict of objects or a list of dicts
-    rows = None
-    if isinstance(cleaned, list) and cleaned and isinstance(cleaned[0], dict):
-        rows = cleaned
-    elif isinstance(cleaned, dict):
-        # turn dict into list of rows: key becomes a column "key"
-        rows = [{"key": k, **v} if isinstance(v, dict) else {"key": k, "value": v}
-                for k, v in cleaned.items()]
-    if rows:
-        fieldnames = sorted({col for row in rows for col in row.keys()})
-        with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(rows)
+if __name__ == "__main__":
+    main()
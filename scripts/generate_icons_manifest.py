@@ -1,18 +1,35 @@
 from pathlib import Path
+import argparse
 import json
 
+from atomic_files import atomic_open
+from instrumentation import add_arguments, stage, start_run
+
 url_prefix = 'assets/images/'
 icons_directory = Path(url_prefix)
 manifest_file = 'assets/images/manifest.js'
 
 extensions = {'.png', '.svg', '.jpg', '.jpeg', '.webp'}
-manifest = {}
 
-for file in sorted(icons_directory.rglob("*")):
-    if file.suffix.lower() in extensions and file.is_file():
-        manifest[file.stem] = url_prefix + file.relative_to(icons_directory).as_posix()
 
-js_content = 'const iconsManifest = ' + json.dumps(manifest, indent=2) + ';'
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Icon name to URL manifest of " + url_prefix)
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    with start_run('generate_icons_manifest', args):
+        manifest = {}
+        with stage('scan') as span:
+            for file in sorted(icons_directory.rglob("*")):
+                if file.suffix.lower() in extensions and file.is_file():
+                    manifest[file.stem] = url_prefix + file.relative_to(icons_directory).as_posix()
+            span.items = len(manifest)
+
+        js_content = 'const iconsManifest = ' + json.dumps(manifest, indent=2) + ';'
+
+        with atomic_open(manifest_file, 'w') as file:
+            file.write(js_content)
+
 
-with open(manifest_file, 'w') as file:
-    file.write(js_content)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
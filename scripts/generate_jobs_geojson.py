@@ -1,12 +1,49 @@
-import requests
+"""
+Open crafting jobs from bitjita, one layer per skill, published as versioned
+deltas so clients only fetch what changed since their last poll.
+
+Every pass fetches /crafts once and splits the jobs by skill in one loop. The
+features of each skill are compared by entityId with the previous pass, kept
+in jobs_state.json: jobs that appeared, jobs whose feature changed (mostly
+progress) and jobs that are gone make up one delta, written as
+<skill>/<version>.json. Versions count up by one per delta, a pass where a
+skill did not change publishes nothing for it. Every snapshot_every versions,
+or when a delta is as big as the layer, the full layer is written again as
+<skill>.geojson. index.json gives, per skill, the current version, the version
+of the snapshot and the deltas still on disk.
+
+A client that is at version v applies the deltas v + 1 ... version in order,
+or, when one of them is no longer listed, loads the snapshot and applies the
+deltas after it. The deltas after the current snapshot are always kept.
+
+The single jobs.geojson of the earlier script, the skill_id 4 jobs, is still
+written on every pass for the pages that load it.
+
+Usage:
+python scripts/generate_jobs_geojson.py                   # one pass
+python scripts/generate_jobs_geojson.py --poll 60         # a pass every minute until interrupted
+python scripts/generate_jobs_geojson.py --skills mining forestry
+"""
+
+import argparse
 import json
+import os
 import time
 
-start_time = time.time()
+from atomic_files import atomic_open, remove_stale
+from http_cache import HttpCache
+from instrumentation import add_arguments, note, stage, start_run
+from map_coords import display_point
 
 jobs_url = 'https://bitjita.com/api/crafts'
 user_agent = {'User-agent': 'Java'}
-geojson_file = 'jobs.geojson'
+jobs_folder = 'assets/markers/jobs/'
+index_file = 'index.json'
+geojson_file = 'jobs.geojson'   # legacy layer, one FeatureCollection of the legacy_skill_id jobs
+legacy_skill_id = 4
+state_file = 'assets/data/jobs_state.json'  # features last published per skill, keyed by entityId
+snapshot_every = 20   # versions between two full snapshots of a skill
+keep_deltas = 40      # versions of deltas kept for clients that are behind
 
 jobs_metadata = [
     {"Name": "Any", "IconName": "Any"},
@@ -25,19 +62,23 @@ jobs_metadata = [
     {"Name": "Any", "IconName": "Any"},
     {"Name": "Foraging", "IconName": "iconForaging"}
 ]
+# Output name of each skill, jobs of the "Any" ids share one layer
+skills = sorted({metadata['Name'].lower() for metadata in jobs_metadata})
+
+
+def skill_metadata(skill_id):
+    """jobs_metadata entry of a skill id, "Any" for ids it does not know."""
+    return jobs_metadata[skill_id] if 0 <= skill_id < len(jobs_metadata) else jobs_metadata[0]
 
-print('Requesting ' + jobs_url)
-jobs_json = requests.get(jobs_url, user_agent).json()
 
 def generate_jobs_geojson(json_key):
 
-    n_coord = round(json_key['claimLocationZ'] / 3)
-    e_coord = round(json_key['claimLocationX'] / 3)
+    n_coord, e_coord = display_point(json_key['claimLocationX'], json_key['claimLocationZ'])
     skill_id = json_key['levelRequirements'][0]['skill_id']
     level_requirement = json_key['levelRequirements'][0]['level']
     text_location_name = json_key['claimName']
     text_location = "N " + str(e_coord) + "E " + str(n_coord)
-    text_profession = "Type: " + jobs_metadata[skill_id]['Name']
+    text_profession = "Type: " + skill_metadata(skill_id)['Name']
     text_effort = "Effort: " + str(json_key['progress']) + " / " +  str(json_key['totalActionsRequired'])
     text_requirement = "Level : " + str(level_requirement)
     return {
@@ -45,7 +86,7 @@ def generate_jobs_geojson(json_key):
         "id": json_key['entityId'],
         "properties": {
             "popupText": [text_location_name, text_location, text_profession, text_effort, text_requirement],
-            "iconName": jobs_metadata[skill_id]['IconName'],
+            "iconName": skill_metadata(skill_id)['IconName'],
             "iconSize": [30,30],
             "turnLayerOff": ["ruinedLayer", "treesLayer", "templesLayer"]
         },
@@ -55,12 +96,171 @@ def generate_jobs_geojson(json_key):
         }
     }
 
-jobs_geojson = {
-    "type": "FeatureCollection",
-    "features": [generate_jobs_geojson(job) for job in jobs_json['craftResults'] if job['levelRequirements'][0]['skill_id'] == 4]
-}
 
-with open(geojson_file, 'w') as file:
-    json.dump(jobs_geojson, file)
+def split_by_skill(craft_results, selected):
+    """One pass over the jobs: {skill: {entityId: feature}} for each selected skill."""
+    layers = {skill: {} for skill in selected}
+    for job in craft_results:
+        skill = skill_metadata(job['levelRequirements'][0]['skill_id'])['Name'].lower()
+        if skill in layers:
+            layers[skill][str(job['entityId'])] = generate_jobs_geojson(job)
+    return layers
+
+
+def diff_features(previous, current):
+    """Features added, features changed and ids removed from `previous` to `current`, both keyed by entityId."""
+    added = [feature for key, feature in current.items() if key not in previous]
+    updated = [feature for key, feature in current.items() if key in previous and previous[key] != feature]
+    removed = [feature['id'] for key, feature in previous.items() if key not in current]
+    return added, updated, removed
+
+
+def delta_file(folder, skill, version):
+    return os.path.join(folder, skill, str(version) + '.json')
+
+
+def feature_collection(features, **members):
+    return dict({"type": "FeatureCollection"}, **members, features=features)
+
+
+def publish_skill(skill, previous, features, folder, every, keep):
+    """
+    Write the delta of one skill from its previous state and, when due, its
+    snapshot. Returns the new state, {version, snapshot, deltas, features},
+    and the (added, updated, removed) counts.
+    """
+    added, updated, removed = diff_features(previous['features'], features)
+    counts = (len(added), len(updated), len(removed))
+    snapshot_path = os.path.join(folder, skill + '.geojson')
+    if not any(counts) and previous['snapshot'] and os.path.exists(snapshot_path):
+        return previous, counts
+
+    version = previous['version'] + 1
+    deltas = list(previous['deltas'])
+    # Without a published base (first pass, lost state) there is nothing to apply a delta to
+    if previous['snapshot']:
+        os.makedirs(os.path.join(folder, skill), exist_ok=True)
+        with atomic_open(delta_file(folder, skill, version), 'w') as file:
+            json.dump({"skill": skill, "base": previous['version'], "version": version,
+                       "added": added, "updated": updated, "removed": removed}, file, separators=(',', ':'))
+        deltas.append(version)
+
+    snapshot = previous['snapshot']
+    if not snapshot or version - snapshot >= every or sum(counts) >= len(features) or not os.path.exists(snapshot_path):
+        with atomic_open(snapshot_path, 'w') as file:
+            json.dump(feature_collection(list(features.values()), version=version), file, separators=(',', ':'))
+        snapshot = version
+
+    deltas = [d for d in deltas if d > min(snapshot, version - keep)]
+    return {"version": version, "snapshot": snapshot, "deltas": deltas, "features": features}, counts
+
+
+def write_legacy_layer(craft_results, path):
+    """The layer the script wrote before the per-skill layers: the legacy_skill_id jobs, in response order."""
+    features = [generate_jobs_geojson(job) for job in craft_results
+                if job['levelRequirements'][0]['skill_id'] == legacy_skill_id]
+    with atomic_open(path, 'w') as file:
+        json.dump(feature_collection(features), file)
+    return len(features)
+
+
+def load_state(path, folder):
+    """
+    State of the previous pass. Without it the versions go on from the
+    published index, and every skill starts again from a snapshot.
+    """
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    published = {}
+    index_path = os.path.join(folder, index_file)
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as file:
+            published = json.load(file)['skills']
+    return {"source": None, "skills": {skill: {"version": entry['version'], "snapshot": 0, "deltas": [], "features": {}}
+                                       for skill, entry in published.items()}}
+
+
+def publish_jobs(craft_results, state, selected, folder, every, keep):
+    """One pass: publish every selected skill and return the new state and {skill: counts}."""
+    empty = {"version": 0, "snapshot": 0, "deltas": [], "features": {}}
+    layers = split_by_skill(craft_results, selected)
+    changes = {}
+    for skill, features in layers.items():
+        state['skills'][skill], changes[skill] = publish_skill(
+            skill, state['skills'].get(skill, empty), features, folder, every, keep)
+
+    with atomic_open(os.path.join(folder, index_file), 'w') as file:
+        json.dump({"skills": {skill: {key: entry[key] for key in ('version', 'snapshot', 'deltas')}
+                              for skill, entry in sorted(state['skills'].items())}}, file, separators=(',', ':'))
+    # Deltas too old to be listed go once the index no longer points at them
+    for skill in layers:
+        entry = state['skills'][skill]
+        if os.path.isdir(os.path.join(folder, skill)):
+            remove_stale(os.path.join(folder, skill), [delta_file(folder, skill, d) for d in entry['deltas']])
+    return state, changes
+
+
+def run_pass(cache, args, state):
+    """Fetch the jobs and publish them unless the response is the one already published."""
+    with start_run('generate_jobs_geojson', args):
+        print('Requesting ' + jobs_url)
+        with stage('fetch'):
+            response = cache.fetch(jobs_url, headers=user_agent)
+        published = all(skill in state['skills'] for skill in args.skills)
+        written = [os.path.join(args.out_dir, index_file)] + ([args.legacy_file] if args.legacy_file else [])
+        if response.sha256 == state['source'] and published and all(os.path.exists(path) for path in written):
+            print('Jobs unchanged since the last pass')
+            return state
+
+        with stage('publish') as span:
+            craft_results = response.json()['craftResults']
+            span.items = len(craft_results)
+            state, changes = publish_jobs(craft_results, state, args.skills, args.out_dir,
+                                          args.snapshot_every, args.keep_deltas)
+            if args.legacy_file:
+                write_legacy_layer(craft_results, args.legacy_file)
+        state['source'] = response.sha256
+
+        with stage('state'), atomic_open(args.state, 'w') as file:
+            json.dump(state, file, separators=(',', ':'))
+
+        note('changes', {skill: dict(zip(('added', 'updated', 'removed'), counts)) for skill, counts in changes.items()})
+        for skill, (added, updated, removed) in changes.items():
+            if added or updated or removed:
+                entry = state['skills'][skill]
+                print(skill + ' v' + str(entry['version']) + ': +' + str(added) + ' ~' + str(updated) + ' -' + str(removed)
+                      + ', ' + str(len(entry['features'])) + ' jobs')
+    return state
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Open crafting jobs from bitjita into per-skill layers and deltas under " + jobs_folder)
+    ap.add_argument("--skills", nargs="+", default=skills, choices=skills, help="Skills to publish (default: all)")
+    ap.add_argument("--out-dir", default=jobs_folder)
+    ap.add_argument("--legacy-file", default=geojson_file,
+                    help="Where to write the skill_id " + str(legacy_skill_id) + " jobs as one layer, '' to skip it")
+    ap.add_argument("--state", default=state_file, help="Features of the last pass, the base of the next delta")
+    ap.add_argument("--snapshot-every", type=int, default=snapshot_every, help="Versions between full snapshots")
+    ap.add_argument("--keep-deltas", type=int, default=keep_deltas, help="Versions of deltas kept on disk")
+    ap.add_argument("--poll", type=float, default=None, metavar="SECONDS",
+                    help="Run a pass every SECONDS until interrupted instead of once")
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    state = load_state(args.state, args.out_dir)
+    with HttpCache() as cache:
+        while True:
+            started = time.monotonic()
+            state = run_pass(cache, args, state)
+            if args.poll is None:
+                break
+            try:
+                time.sleep(max(0.0, args.poll - (time.monotonic() - started)))
+            except KeyboardInterrupt:
+                break
+
 
-print('Finished after ' + str(time.time() - start_time) + ' seconds')
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from atomic_files import atomic_open, remove_stale
+from instrumentation import add_arguments, stage, start_run
+from map_coords import from_pixels, to_pixels
+
+# Same map space as assets/js/config.js and generate_marker_tiles.py: a point
+# [x, y] sits at pixel (x, -y / apothem) * 2^zoom, map_coords.to_pixels().
+min_zoom = -5
+max_zoom = 5
+cluster_radius = 40      # pixels on screen, markers closer than this are merged
+markers_folder = 'assets/markers/'
+clusters_folder = 'assets/markers/clusters/'
+index_file = 'index.json'
+
+# Cluster property -> (marker property, value a lone marker starts with, how to combine)
+aggregates = {
+    'claims': {
+        'max_tier': ('tier', None, 'max'),
+        'has_bank': ('has_bank', None, 'sum'),
+        'has_market': ('has_market', None, 'sum'),
+        'has_waystone': ('has_waystone', None, 'sum'),
+    },
+    'caves': {
+        'max_tier': ('tier', None, 'max'),
+        'large': ('size', lambda size: int(size == 2), 'sum'),
+    },
+}
+
+combine = {
+    'max': max,
+    'sum': lambda a, b: a + b,
+}
+
+
+def cluster_zoom(xy, counts, values, ops, radius):
+    """
+    One greedy pass: the biggest item not taken yet absorbs every free item
+    within `radius` (zoom 0 pixels) of it. Returns the new items as
+    (xy, counts, values, members) where members are the indices merged.
+    """
+    cells = {}
+    keys = np.floor(xy / radius).astype(np.int64)
+    for k, (cx, cy) in enumerate(keys.tolist()):
+        cells.setdefault((cx, cy), []).append(k)
+
+    taken = np.zeros(len(xy), dtype=bool)
+    out_xy, out_counts, out_values, members = [], [], [], []
+    r2 = radius * radius
+    # Biggest clusters first, then input order, so runs are deterministic
+    for i in np.lexsort((np.arange(len(xy)), -counts)).tolist():
+        if taken[i]:
+            continue
+        taken[i] = True
+        cx, cy = keys[i]
+        group = [i]
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for j in cells.get((cx + dx, cy + dy), ()):
+                    if not taken[j] and (xy[j, 0] - xy[i, 0])**2 + (xy[j, 1] - xy[i, 1])**2 <= r2:
+                        taken[j] = True
+                        group.append(j)
+        weights = counts[group]
+        out_xy.append((xy[group] * weights[:, None]).sum(axis=0) / weights.sum())
+        out_counts.append(int(weights.sum()))
+        merged = list(values[group[0]])
+        for j in group[1:]:
+            merged = [combine[op](a, b) for a, b, op in zip(merged, values[j], ops)]
+        out_values.append(merged)
+        members.append(group)
+    return np.array(out_xy).reshape(-1, 2), np.array(out_counts, dtype=np.int64), out_values, members
+
+
+def cluster_layer(features, layer_aggregates, zooms, radius):
+    """
+    {zoom: FeatureCollection} for every zoom, each clustering the items of the
+    zoom above it, so clusters nest. Lone markers stay the original feature.
+    """
+    names = list(layer_aggregates)
+    ops = [op for _, _, op in layer_aggregates.values()]
+    coordinates = np.array([f['geometry']['coordinates'][:2] for f in features], dtype=np.float64).reshape(-1, 2)
+    xy = np.stack(to_pixels(coordinates[:, 0], coordinates[:, 1]), axis=1)
+    counts = np.ones(len(features), dtype=np.int64)
+    values = [[start(f['properties'][prop]) if start else f['properties'][prop]
+               for prop, start, _ in layer_aggregates.values()] for f in features]
+    sources = [[k] for k in range(len(features))]  # original features under each item
+
+    levels = {}
+    for zoom in sorted(zooms, reverse=True):
+        xy, counts, values, members = cluster_zoom(xy, counts, values, ops, radius / 2.0 ** zoom)
+        sources = [[k for m in group for k in sources[m]] for group in members]
+        out = []
+        cx, cy = from_pixels(xy[:, 0], xy[:, 1])
+        for x, y, count, merged, under in zip(cx.tolist(), cy.tolist(), counts.tolist(), values, sources):
+            if count == 1:
+                out.append(features[under[0]])
+                continue
+            properties = {'cluster': True, 'count': count}
+            properties.update(zip(names, merged))
+            out.append({
+                "type": "Feature",
+                "properties": properties,
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [round(x, 2), round(y, 2)]
+                }
+            })
+        levels[zoom] = {"type": "FeatureCollection", "features": out}
+    return levels
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Precompute per-zoom marker clusters for claims and caves")
+    ap.add_argument("--layers", nargs="+", default=list(aggregates), choices=list(aggregates))
+    ap.add_argument("--markers-dir", default=markers_folder)
+    ap.add_argument("--clusters-dir", default=clusters_folder, help="Clusters go to <clusters-dir>/<layer>/<zoom>.geojson")
+    ap.add_argument("--min-zoom", type=int, default=min_zoom)
+    ap.add_argument("--max-zoom", type=int, default=max_zoom)
+    ap.add_argument("--radius", type=float, default=cluster_radius, help="Cluster radius in screen pixels")
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    with start_run('generate_marker_clusters', args):
+        for layer in args.layers:
+            with open(os.path.join(args.markers_dir, layer + '.geojson'), 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            features = data['features'] if isinstance(data, dict) else data
+            with stage(layer + '/cluster', len(features)):
+                levels = cluster_layer(features, aggregates[layer], range(args.min_zoom, args.max_zoom + 1), args.radius)
+
+            # Zooms past the first one without any cluster would only repeat the whole
+            # layer, the map keeps showing that one when zoomed in further
+            written = []
+            for zoom in sorted(levels):
+                written.append(zoom)
+                if not any(f['properties'].get('cluster') for f in levels[zoom]['features']):
+                    break
+
+            with stage(layer + '/write', len(written)):
+                folder = os.path.join(args.clusters_dir, layer)
+                os.makedirs(folder, exist_ok=True)
+                paths = [os.path.join(folder, str(zoom) + '.geojson') for zoom in written]
+                for zoom, path in zip(written, paths):
+                    with atomic_open(path, 'w', encoding='utf-8') as file:
+                        file.write(json.dumps(levels[zoom], separators=(',', ':')))
+                with atomic_open(os.path.join(folder, index_file), 'w', encoding='utf-8') as file:
+                    json.dump({"zooms": written}, file, separators=(',', ':'))
+                # Zooms no longer written go after the new index is in place
+                remove_stale(folder, paths + [os.path.join(folder, index_file)])
+            sizes = ', '.join('z' + str(z) + ': ' + str(len(levels[z]['features'])) for z in written)
+            print(layer + ': ' + str(len(features)) + ' markers, ' + sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from atomic_files import atomic_open, remove_stale
+from instrumentation import add_arguments, stage, start_run
+from map_coords import partition, tile_coords, tile_size
+
+# Same map space as assets/js/config.js: the CRS projects [x, y] GeoJSON
+# coordinates (lng, lat) to pixels (x, -y / apothem) * 2^zoom, the layout the
+# terrain tiles of generate_terrain_map.py use too (tile y is negative).
+# Tiles are numbered by map_coords.tile_coords(), tile_size pixels square.
+slice_zooms = [-3]       # tiles of 2048 x 2048 map pixels, 12 x 12 of them cover the map
+markers_folder = 'assets/markers/'
+tiles_folder = 'assets/markers/tiles/'
+index_file = 'index.json'
+layers = ['claims', 'caves', 'trees', 'temples', 'ruined', 'dungeons']
+
+
+def load_features(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    return data['features'] if isinstance(data, dict) else data
+
+
+def tile_file(folder, zoom, x, y):
+    return os.path.join(folder, str(zoom), str(x), str(y) + '.geojson')
+
+
+def slice_layer(features, folder, zooms):
+    """
+    Write features to folder/{z}/{x}/{y}.geojson for each zoom and return the
+    index, {zoom: [[x, y, count], ...]}. Each feature is serialised once and
+    reused by every zoom; points are grouped with one sort per zoom.
+    """
+    points = [f for f in features if f['geometry']['type'] == 'Point']
+    if len(points) != len(features):
+        print('Skipping ' + str(len(features) - len(points)) + ' features that are not points')
+    coordinates = np.array([f['geometry']['coordinates'][:2] for f in points], dtype=np.float64).reshape(-1, 2)
+    encoded = [json.dumps(f, separators=(',', ':')) for f in points]
+
+    index = {}
+    for zoom in zooms:
+        zoom_folder = os.path.join(folder, str(zoom))
+        tiles = []
+        for (x, y), group in partition(*tile_coords(coordinates[:, 0], coordinates[:, 1], zoom)):
+            os.makedirs(os.path.join(zoom_folder, str(x)), exist_ok=True)
+            with atomic_open(tile_file(folder, zoom, x, y), 'w', encoding='utf-8') as file:
+                file.write('{"type":"FeatureCollection","features":[')
+                file.write(','.join(encoded[k] for k in group.tolist()))
+                file.write(']}')
+            tiles.append([x, y, len(group)])
+        index[str(zoom)] = tiles
+    return index
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Slice marker GeoJSON layers into z/x/y tiles with a tile index")
+    ap.add_argument("--layers", nargs="+", default=layers,
+                    help="Layer names, read from <markers-dir>/<layer>.geojson")
+    ap.add_argument("--markers-dir", default=markers_folder)
+    ap.add_argument("--tiles-dir", default=tiles_folder, help="Tiles go to <tiles-dir>/<layer>/{z}/{x}/{y}.geojson")
+    ap.add_argument("--zooms", type=int, nargs="+", default=slice_zooms, help="Map zooms to slice at")
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    with start_run('generate_marker_tiles', args):
+        for layer in args.layers:
+            source = os.path.join(args.markers_dir, layer + '.geojson')
+            folder = os.path.join(args.tiles_dir, layer)
+            features = load_features(source)
+            os.makedirs(folder, exist_ok=True)
+            with stage(layer + '/slice', len(features)):
+                tiles = slice_layer(features, folder, args.zooms)
+                with atomic_open(os.path.join(folder, index_file), 'w', encoding='utf-8') as file:
+                    json.dump({"tileSize": tile_size, "zooms": tiles}, file, separators=(',', ':'))
+                # Markers move and disappear between runs, no tile may outlive its points.
+                # Stale tiles go once the new index is in place, the folder is never emptied
+                for zoom, zoom_tiles in tiles.items():
+                    remove_stale(os.path.join(folder, zoom), [tile_file(folder, zoom, x, y) for x, y, count in zoom_tiles])
+            counts = ', '.join('z' + z + ': ' + str(len(t)) + ' tiles' for z, t in tiles.items())
+            print(layer + ': ' + str(len(features)) + ' features, ' + counts)
+
+
+if __name__ == "__main__":
+    main()
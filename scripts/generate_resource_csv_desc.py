@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
-import json, csv
+import argparse
+import json
 from pathlib import Path
 
+from atomic_files import atomic_open
+from flatten_game_data import iter_json_records, write_table
+from instrumentation import add_arguments, stage, start_run
+
 # ===== configuration =====
 INPUT_PATH      = Path("resource_desc.json")
 OUTPUT_PATH     = Path("resource_desc.csv")
+PARQUET_PATH    = None  # e.g. Path("resource_desc.parquet"), needs pyarrow
 NAMES_JSON_PATH = Path("names.json")
 
 DROP_KEYS   = [
@@ -29,56 +35,23 @@ DROP_RECURSIVE = True  # True = remove at any depth
 ENCODING = "utf-8"
 # =========================
 
-def prune(obj, keys, recursive=True):
-    if isinstance(obj, list):
-        return [prune(x, keys, recursive) for x in obj]
-    if isinstance(obj, dict):
-        if recursive:
-            return {k: prune(v, keys, recursive) for k, v in obj.items() if k not in keys}
-        for k in keys:
-            obj.pop(k, None)
-        return obj
-    return obj
-
-def flatten(obj, prefix=""):
-    out = {}
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            nk = f"{prefix}.{k}" if prefix else k
-            if isinstance(v, dict):
-                out.update(flatten(v, nk))
-            elif isinstance(v, list):
-                out[nk] = json.dumps(v, ensure_ascii=False)
-            else:
-                out[nk] = v
-    else:
-        out[prefix or "value"] = obj
-    return out
-
-def to_rows(data):
-    if isinstance(data, list):
-        return [x if isinstance(x, dict) else {"value": x} for x in data]
-    return [data if isinstance(data, dict) else {"value": data}]
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Flatten " + str(INPUT_PATH) + " into " + str(OUTPUT_PATH) + " and " + str(NAMES_JSON_PATH))
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+    names = []
 
-def headers(rows):
-    ks = set()
-    for r in rows:
-        ks.update(r.keys())
-    return sorted(ks)
+    def keep_name(record):
+        row = record if isinstance(record, dict) else {}
+        names.append({"id": row.get("id"), "name": row.get("name")})
 
-def main():
-    data = json.loads(INPUT_PATH.read_text(ENCODING))
-    data = prune(data, DROP_KEYS, DROP_RECURSIVE)
-    rows = [flatten(r) for r in to_rows(data)]
-    cols = headers(rows)
-    with OUTPUT_PATH.open("w", newline="", encoding=ENCODING) as f:
-        w = csv.DictWriter(f, fieldnames=cols, extrasaction="ignore")
-        w.writeheader()
-        for r in rows:
-            w.writerow({k: r.get(k, "") for k in cols})
-    base_rows = to_rows(data)
-    names = [{"id": r.get("id"), "name": r.get("name")} for r in base_rows if isinstance(r, dict)]
-    NAMES_JSON_PATH.write_text(json.dumps(names, ensure_ascii=False, separators=(',', ':')), ENCODING)
+    with start_run("generate_resource_csv_desc", args):
+        # Two streaming passes over the input, one record in memory at a time
+        write_table(lambda: iter_json_records(INPUT_PATH), DROP_KEYS, csv_path=OUTPUT_PATH,
+                    parquet_path=PARQUET_PATH, recursive=DROP_RECURSIVE, on_record=keep_name)
+        with stage("names", len(names)):
+            with atomic_open(NAMES_JSON_PATH, 'w', encoding=ENCODING) as file:
+                file.write(json.dumps(names, ensure_ascii=False, separators=(',', ':')))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
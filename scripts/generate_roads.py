@@ -13,11 +13,12 @@ Hexagon merge (pointy-top) around points → MultiPolygon GeoJSON
 - Builds a regular hex around each point.
 - Size so each hex reaches its nearest neighbor (per-point mode) OR fixed size.
 - Merges touching/overlapping hexes.
-- Outputs GeoJSON with ALL coordinates rounded to 2 decimals.
+- Outputs GeoJSON with ALL coordinates rounded to 2 decimals, without collinear vertices.
+- Optionally adds topology-safe simplified layers per map zoom and a quantized form.
 - Uses pointy-top orientation by default.
 
-Requires: shapely  (pip install shapely)
-Optional: scipy (KDTree for fast nearest neighbor). If missing, falls back.
+Requires: numpy
+Optional: shapely (pip install shapely), only needed for variable per-point apothems.
 
 Usage:
 python hex_merge_pointy.py input.json output.geojson
@@ -28,21 +29,35 @@ python hex_merge_pointy.py input.json output.geojson
 Fixed size:
 python hex_merge_pointy.py input.json output.geojson --mode fixed --apothem 0.6
 
-Tune union batch size:
-python hex_merge_pointy.py input.json output.geojson --batch 5000
+Tune union partition size and worker processes:
+python hex_merge_pointy.py input.json output.geojson --batch 5000 --workers 8
+
+Add simplified layers for low map zooms (output.z-5.geojson, ...) and the
+quantized form of every layer (output.qjson, ...):
+python hex_merge_pointy.py input.json output.geojson --lod-zooms -5 -3 -1 --quantize
+
+When every hex has the same apothem (fixed mode, or per-point on a regular grid)
+and the points sit on the staggered lattice, hexes are merged by the lattice
+engine below and shapely is not needed. Shapely is only used for variable
+per-point apothems or points off the lattice.
 """
 
-import argparse, json, math, re, sys
-from typing import List, Tuple, Dict, Any
+import argparse, importlib.util, json, math, os, re, sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Dict, Any, Optional
 
-try:
-    from shapely.geometry import Polygon, MultiPolygon
-    from shapely.ops import unary_union
-except ImportError:
-    print("ERROR: shapely is required. Install with: pip install shapely", file=sys.stderr)
-    sys.exit(1)
+import numpy as np
+
+import map_coords
+from atomic_files import atomic_open
+from instrumentation import add_arguments, stage, start_run
+
+# shapely is imported by the functions of the general merge path, the lattice
+# path never loads it
+HAVE_SHAPELY = importlib.util.find_spec("shapely") is not None
 
 Point = Tuple[float, float]
+Ring = List[Point]
 
 # ---------- I/O: read points ----------
 def load_points_from_text(txt: str) -> List[Point]:
@@ -104,73 +119,508 @@ def hex_vertices_pointy(center: Point, apothem: float) -> List[Point]:
     return verts
 
 # ---------- Nearest-neighbor distances ----------
+class GridIndex:
+    """
+    Uniform-grid spatial hash over a point array, for batched k-nearest queries.
+    Points are sorted by cell id and each occupied cell is a [start, start + count)
+    slice of that order, so a query only looks at the rings of cells around it.
+    Only occupied cells are stored, so the grid can be fine over a sparse area.
+    Tuned for roughly even densities such as paved tiles; very clustered data
+    still works but large cells make their queries quadratic.
+    """
+
+    def __init__(self, points: np.ndarray, per_cell: float = 2.0):
+        self.xy = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        n = len(self.xy)
+        self.lo = self.xy.min(axis=0) if n else np.zeros(2)
+        span = float((self.xy.max(axis=0) - self.lo).max()) if n else 1.0
+        # Start from the bounding box density, then shrink cells until the
+        # occupied ones hold about `per_cell` points (roads fill little of their box)
+        self.h = max(span*math.sqrt(per_cell/max(1, n)), 1e-9)
+        for _ in range(4):
+            occupied = len(np.unique(self._cell_ids(self.xy)))
+            if occupied == 0 or n/occupied <= 2*per_cell:
+                break
+            self.h = max(self.h*math.sqrt(per_cell*occupied/n), span/2**20, 1e-9)
+        cell = self._cell_ids(self.xy)
+        self.order = np.argsort(cell, kind="stable")
+        self.cells, self.start, self.count = np.unique(cell[self.order], return_index=True, return_counts=True)
+
+    def _cell_ids(self, xy: np.ndarray) -> np.ndarray:
+        c = np.floor((xy - self.lo)/self.h).astype(np.int64)
+        return (c[:, 1] << 32) + c[:, 0]
+
+    def _lookup(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        pos = np.clip(np.searchsorted(self.cells, ids), 0, max(0, len(self.cells) - 1))
+        found = self.cells[pos] == ids
+        return np.where(found, self.start[pos], 0), np.where(found, self.count[pos], 0)
+
+    def query(self, xy: np.ndarray, k: int = 1, max_ring: int = 6, max_pairs: int = 1 << 22) -> Tuple[np.ndarray, np.ndarray]:
+        """Distances and indices of the k nearest points to each row of `xy`, nearest first."""
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        best_d = np.full((len(xy), k), np.inf)
+        best_i = np.full((len(xy), k), -1, dtype=np.int64)
+        if len(self.xy) == 0:
+            return best_d, best_i
+        c = np.floor((xy - self.lo)/self.h).astype(np.int64)
+        todo = np.arange(len(xy))
+        for r in range(1, max_ring + 1):
+            if len(todo) == 0:
+                break
+            # The first pass takes the whole 3x3 block, later passes one ring each
+            inner = 0 if r == 1 else r
+            ring = np.array([(dx, dy) for dy in range(-r, r + 1) for dx in range(-r, r + 1) if max(abs(dx), abs(dy)) >= inner])
+            chunks = [todo]
+            while chunks:
+                qs = chunks.pop()
+                ids = ((c[qs, 1:2] + ring[:, 1]) << 32) + c[qs, 0:1] + ring[:, 0]
+                first, cnt = self._lookup(ids.ravel())
+                per_query = cnt.reshape(len(qs), -1).sum(axis=1)
+                width = int(per_query.max())
+                if width == 0:
+                    continue
+                if len(qs)*width > max_pairs and len(qs) > 1:
+                    chunks.extend([qs[:len(qs)//2], qs[len(qs)//2:]])
+                    continue
+                # Candidates as a (queries, width) matrix, padded with -1
+                total = int(cnt.sum())
+                within = np.arange(total) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+                rows = np.repeat(np.arange(len(qs)), per_query)
+                cols = np.arange(total) - np.repeat(np.cumsum(per_query) - per_query, per_query)
+                cand = np.full((len(qs), width), -1, dtype=np.int64)
+                cand[rows, cols] = self.order[np.repeat(first, cnt) + within]
+                self._merge(xy, best_d, best_i, qs, cand)
+            # Cells not visited yet are at least r cells away from the query's own cell
+            todo = todo[best_d[todo, k - 1] > r*self.h]
+        if len(todo):
+            self._brute(xy, best_d, best_i, todo)
+        return best_d, best_i
+
+    def _merge(self, xy, best_d, best_i, qs, cand):
+        """Fold a padded candidate matrix into the per-query k best, keeping them sorted."""
+        k = best_d.shape[1]
+        pts = self.xy[np.maximum(cand, 0)]
+        d = np.hypot(pts[..., 0] - xy[qs, 0:1], pts[..., 1] - xy[qs, 1:2])
+        d[cand < 0] = np.inf
+        all_d = np.concatenate([best_d[qs], d], axis=1)
+        all_i = np.concatenate([best_i[qs], cand], axis=1)
+        keep = np.argsort(all_d, axis=1, kind="stable")[:, :k]
+        best_d[qs] = np.take_along_axis(all_d, keep, axis=1)
+        best_i[qs] = np.take_along_axis(all_i, keep, axis=1)
+
+    def _brute(self, xy, best_d, best_i, todo, chunk: int = 1 << 22):
+        k = best_d.shape[1]
+        step = max(1, chunk//len(self.xy))
+        for s in range(0, len(todo), step):
+            qs = todo[s:s + step]
+            d = np.hypot(xy[qs, 0:1] - self.xy[None, :, 0], xy[qs, 1:2] - self.xy[None, :, 1])
+            kk = min(k, d.shape[1])
+            near = np.argsort(d, axis=1, kind="stable")[:, :kk]
+            best_d[qs, :kk] = np.take_along_axis(d, near, axis=1)
+            best_i[qs, :kk] = near
+
 def nearest_dist_per_point(points: List[Point]) -> List[float]:
-    # Try scipy KDTree
-    try:
-        from scipy.spatial import cKDTree as KDTree  # type: ignore
-        tree = KDTree(points)
-        dists, _ = tree.query(points, k=2)
-        return [float(d[1]) for d in dists]
-    except Exception:
-        pass
+    """Distance from each point to its nearest other point (inf when there is none)."""
+    index = GridIndex(np.asarray(points, dtype=np.float64))
+    dists, _ = index.query(index.xy, k=2)
+    return dists[:, 1].tolist()
+
+# ---------- Lattice merge (fixed apothem) ----------
+# Points live on the staggered lattice of map_coords.py: row j at y = j, column i at
+# x = i - 0.25 (even rows) or x = i + 0.25 (odd rows). Every hex is the same
+# translate of one pointy-top hexagon, so a hex can only overlap the few
+# lattice neighbours closer than two circumradii, always at the same offsets.
+#
+# The union boundary is every piece of a hex edge that lies outside all
+# neighbouring hexes (edges shared by two hexes lie inside the other one and
+# cancel). Which pieces survive only depends on the row parity and on which
+# neighbours are present, so the pieces are computed once per (parity, mask)
+# and stamped onto every hex with that neighbourhood. The remaining boundary
+# edges are then chained into rings through canonical vertex keys.
+
+LATTICE_EPS = 1e-9
+VERTEX_KEY_SCALE = 1e5
+
+def _row_shift(j: int) -> float:
+    return float(map_coords.row_shift(j))
 
-    # Grid-int heuristic (fast)
-    is_intish = all(abs(px - round(px)) < 1e-9 and abs(py - round(py)) < 1e-9 for px,py in points[:min(2000,len(points))])
-    if is_intish:
-        S = {(int(px), int(py)) for px,py in points}
+def lattice_coords(points: List[Point]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """(i, j) lattice indices of staggered points, or None if any point is off the lattice."""
+    arr = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return map_coords.lattice_coords(arr[:, 0], arr[:, 1], LATTICE_EPS)
+
+class HexLattice:
+    """Per-apothem tables for merging lattice hexes without a polygon union."""
+
+    def __init__(self, apothem: float):
+        self.a = float(apothem)
+        self.verts = hex_vertices_pointy((0.0, 0.0), self.a)[:6]
+        # Outward normal of edge m (verts[m] -> verts[m+1]) points at 120 + 60*m degrees
+        self.normals = [(math.cos(math.radians(120 + 60*m)), math.sin(math.radians(120 + 60*m))) for m in range(6)]
+        R = 2*self.a/math.sqrt(3.0)
+        reach = int(math.ceil(2*R)) + 1
+        # offsets[parity] = [(di, dj, dx, dy), ...] of lattice neighbours whose hex can overlap
+        self.offsets: Dict[int, List[Tuple[int, int, float, float]]] = {}
+        for parity in (0, 1):
+            offs = []
+            for dj in range(-reach, reach + 1):
+                for di in range(-reach, reach + 1):
+                    if di == 0 and dj == 0:
+                        continue
+                    dx = di + _row_shift(parity + dj) - _row_shift(parity)
+                    if math.hypot(dx, dj) < 2*R - LATTICE_EPS:
+                        offs.append((di, dj, dx, float(dj)))
+            self.offsets[parity] = offs
+        self._pieces: Dict[Tuple[int, int], List[Tuple[Tuple[float, float, float, float], Tuple[float, float, float, float]]]] = {}
+
+    def supported(self) -> bool:
+        # Two translates only share a collinear edge on the same side when they
+        # are two rows apart in the same column, i.e. circumradius >= 2.
+        return 0 < self.a < math.sqrt(3.0)
+
+    def _hit(self, e: int, f: int, dx: float, dy: float) -> Tuple[float, float]:
+        """Intersection of edge line e of the hex at the origin with edge line f of the hex at (dx, dy)."""
+        (n1x, n1y), (n2x, n2y) = self.normals[e], self.normals[f]
+        c1 = self.a
+        c2 = self.a + n2x*dx + n2y*dy
+        det = n1x*n2y - n1y*n2x
+        return ((c1*n2y - c2*n1y)/det, (n1x*c2 - n2x*c1)/det)
+
+    def _inside_interval(self, e: int, dx: float, dy: float):
+        """Parameter interval of edge e (own hex at origin) inside the closed hex at (dx, dy)."""
+        (p0x, p0y), (p1x, p1y) = self.verts[e], self.verts[(e + 1) % 6]
+        Dx, Dy = p1x - p0x, p1y - p0y
+        t0, t1, f0, f1 = 0.0, 1.0, None, None
+        for f, (nx, ny) in enumerate(self.normals):
+            denom = nx*Dx + ny*Dy
+            num = self.a + nx*dx + ny*dy - (nx*p0x + ny*p0y)
+            if abs(denom) < LATTICE_EPS:
+                if num < -LATTICE_EPS:
+                    return None
+                continue
+            t = num/denom
+            if denom < 0 and t > t0:
+                t0, f0 = t, f
+            elif denom > 0 and t < t1:
+                t1, f1 = t, f
+        if t1 - t0 <= LATTICE_EPS:
+            return None
+        return t0, t1, f0, f1
+
+    def _endpoint(self, e: int, f: Optional[int], k: Optional[Tuple[int, int, float, float]], own_vertex: int):
+        """
+        Endpoint as (shift_x, shift_y, local_x, local_y), absolute = (centre + shift) + local.
+        Intersections are always computed from the hex that comes first in (j, i)
+        order, so both hexes meeting at a point produce bit-identical coordinates.
+        """
+        if f is None:
+            vx, vy = self.verts[own_vertex]
+            return (0.0, 0.0, vx, vy)
+        di, dj, dx, dy = k
+        if (dj, di) > (0, 0):
+            hx, hy = self._hit(e, f, dx, dy)
+            return (0.0, 0.0, hx, hy)
+        hx, hy = self._hit(f, e, -dx, -dy)
+        return (dx, dy, hx, hy)
+
+    def pieces(self, parity: int, mask: int):
+        """Surviving boundary pieces of a hex with the given neighbour mask, as (start, end) endpoints."""
+        key = (parity, mask)
+        if key in self._pieces:
+            return self._pieces[key]
+        present = [k for b, k in enumerate(self.offsets[parity]) if mask >> b & 1]
         out = []
-        OFFS = [(1,0),(-1,0),(0,1),(0,-1),(1,1),(1,-1),(-1,1),(-1,-1)]
-        for px,py in points:
-            ipx, ipy = int(px), int(py)
-            md = float("inf")
-            for dx,dy in OFFS:
-                if (ipx+dx, ipy+dy) in S:
-                    md = min(md, 1.0 if dx==0 or dy==0 else math.sqrt(2.0))
-                    if md == 1.0:
-                        break
-            if math.isinf(md):
-                # small ring search up to r=4
-                found = False
-                for r in range(2,5):
-                    for dx in range(-r, r+1):
-                        for dy in (-r, r) if abs(dx) in (0,r) else (-r, r):
-                            if (ipx+dx, ipy+dy) in S:
-                                md = math.hypot(dx,dy); found=True; break
-                        if found: break
-                    if found: break
-                if math.isinf(md):
-                    md = 1e9
-            out.append(md)
+        for e in range(6):
+            covered = []
+            for k in present:
+                hit = self._inside_interval(e, k[2], k[3])
+                if hit is not None:
+                    covered.append((hit, k))
+            covered.sort(key=lambda c: c[0][0])
+            t, f_start, k_start = 0.0, None, None
+            for (t0, t1, f0, f1), k in covered:
+                if t0 > t + LATTICE_EPS:
+                    out.append((self._endpoint(e, f_start, k_start, e),
+                                self._endpoint(e, f0, k, (e + 1) % 6)))
+                if t1 > t:
+                    t, f_start, k_start = t1, f1, k
+                if t >= 1.0 - LATTICE_EPS:
+                    break
+            else:
+                if t < 1.0 - LATTICE_EPS:
+                    out.append((self._endpoint(e, f_start, k_start, e),
+                                self._endpoint(e, None, None, (e + 1) % 6)))
+        self._pieces[key] = out
         return out
 
-    # Last-resort: coarse sample
-    sample = points[::max(1, len(points)//5000)]
-    try:
-        from scipy.spatial import cKDTree as KDTree  # type: ignore
-        tree = KDTree(sample)
-        dmins = []
-        for p in points:
-            d,_ = tree.query([p], k=1)
-            dmins.append(float(d[0]) if hasattr(d, "__len__") else float(d))
-        return dmins
-    except Exception:
-        return [1.0 for _ in points]
-
-# ---------- Batch unary union ----------
-def batch_union(polys: List[Polygon], batch: int):
-    chunks = []
-    total = len(polys)
-    for i in range(0, total, batch):
-        part = unary_union(polys[i:i+batch])
-        chunks.append(part)
-        print(f"Unioned batch {i//batch+1}/{math.ceil(total/batch)} (batch size {len(polys[i:i+batch])})")
-    return unary_union(chunks)
+    def boundary_edges(self, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+        """Directed boundary edges (x0, y0, x1, y1) of the union, interior on the left."""
+        keys = np.unique(np.stack([j, i], axis=1), axis=0)
+        j, i = keys[:, 0], keys[:, 1]
+        base_i, base_j = i.min() - 64, j.min() - 64
+        width = int(i.max() - base_i) + 128
+        code = (j - base_j)*width + (i - base_i)  # sorted, since keys are sorted by (j, i)
+
+        segments = []
+        for parity in (0, 1):
+            sel = (j % 2) == parity
+            if not sel.any():
+                continue
+            pi, pj, pcode = i[sel], j[sel], code[sel]
+            mask = np.zeros(len(pi), dtype=np.int64)
+            for b, (di, dj, _, _) in enumerate(self.offsets[parity]):
+                ncode = pcode + dj*width + di
+                pos = np.clip(np.searchsorted(code, ncode), 0, len(code) - 1)
+                mask |= (code[pos] == ncode).astype(np.int64) << b
+
+            cx = pi + np.where(parity == 1, 0.25, -0.25)
+            cy = pj.astype(np.float64)
+            uniq, inverse = np.unique(mask, return_inverse=True)
+            order = np.argsort(inverse, kind="stable")
+            bounds = np.searchsorted(inverse[order], np.arange(len(uniq) + 1))
+            for u, m in enumerate(uniq):
+                idx = order[bounds[u]:bounds[u + 1]]
+                gx, gy = cx[idx], cy[idx]
+                for (sdx, sdy, sx, sy), (edx, edy, ex, ey) in self.pieces(parity, int(m)):
+                    segments.append(np.stack([(gx + sdx) + sx, (gy + sdy) + sy,
+                                              (gx + edx) + ex, (gy + edy) + ey], axis=1))
+        if not segments:
+            return np.empty((0, 4))
+        return np.concatenate(segments)
+
+def chain_rings(edges: np.ndarray) -> List[Ring]:
+    """
+    Chain directed boundary edges into closed rings. Where several rings touch at
+    a vertex the sharpest left turn is taken, and rings that still revisit a
+    vertex are split there, so shells and holes come out as simple rings.
+    """
+    if len(edges) == 0:
+        return []
+    ends = np.concatenate([edges[:, 0:2], edges[:, 2:4]])
+    keys = np.rint(ends*VERTEX_KEY_SCALE).astype(np.int64)
+    keys -= keys.min(axis=0)
+    span_y = int(keys[:, 1].max()) + 1
+    if (int(keys[:, 0].max()) + 1) * span_y < 2**62:
+        # One int64 per vertex sorts much faster than unique(axis=0)
+        _, first, vid = np.unique(keys[:, 0]*span_y + keys[:, 1], return_index=True, return_inverse=True)
+        vxy = ends[first]
+    else:
+        _, first, vid = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        vxy = ends[first]
+    vid = vid.reshape(-1)
+    n = len(edges)
+    start, end = vid[:n], vid[n:]
+
+    outdeg = np.bincount(start, minlength=len(vxy))
+    out_edge = np.full(len(vxy), -1, dtype=np.int64)
+    out_edge[start] = np.arange(n)
+    nxt = out_edge[end]
+
+    multi = np.nonzero(outdeg[end] > 1)[0]
+    if len(multi):
+        outs: Dict[int, List[int]] = {}
+        for e in np.nonzero(outdeg[start] > 1)[0]:
+            outs.setdefault(int(start[e]), []).append(int(e))
+        for e in multi:
+            v = int(end[e])
+            ax, ay = vxy[v] - vxy[start[e]]
+            best, best_turn = -1, -math.inf
+            for o in outs[v]:
+                bx, by = vxy[end[o]] - vxy[v]
+                turn = math.atan2(ax*by - ay*bx, ax*bx + ay*by)
+                if turn > best_turn:
+                    best, best_turn = o, turn
+            nxt[e] = best
+
+    rings: List[Ring] = []
+    seen = np.zeros(n, dtype=bool)
+    nxt_list = nxt.tolist()
+    start_list = start.tolist()
+    for e0 in range(n):
+        if seen[e0]:
+            continue
+        loop = []
+        e = e0
+        while not seen[e]:
+            seen[e] = True
+            loop.append(start_list[e])
+            e = nxt_list[e]
+        for part in _split_at_repeats(loop):
+            ring = _drop_collinear([(float(vxy[v][0]), float(vxy[v][1])) for v in part])
+            if len(ring) >= 3:
+                rings.append(ring)
+    return rings
+
+def _split_at_repeats(loop: List[int]) -> List[List[int]]:
+    parts, stack, pos = [], [], {}
+    for v in loop:
+        if v in pos:
+            k = pos[v]
+            parts.append(stack[k:])
+            for w in stack[k + 1:]:
+                del pos[w]
+            del stack[k + 1:]
+        else:
+            pos[v] = len(stack)
+            stack.append(v)
+    if stack:
+        parts.append(stack)
+    return parts
+
+def _drop_collinear(ring: Ring) -> Ring:
+    out = []
+    n = len(ring)
+    for k in range(n):
+        (ax, ay), (bx, by), (cx, cy) = ring[k - 1], ring[k], ring[(k + 1) % n]
+        if abs((bx - ax)*(cy - by) - (by - ay)*(cx - bx)) > LATTICE_EPS:
+            out.append(ring[k])
+    return out
+
+def _signed_area(ring: Ring) -> float:
+    xy = np.asarray(ring)
+    x, y = xy[:, 0], xy[:, 1]
+    return 0.5*float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+def _point_in_ring(x: float, y: float, ring: Ring) -> bool:
+    inside = False
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+        if (y0 > y) != (y1 > y) and x < x0 + (y - y0)*(x1 - x0)/(y1 - y0):
+            inside = not inside
+    return inside
+
+def assemble_polygons(rings: List[Ring]) -> List[List[Ring]]:
+    """
+    Group rings into polygons [shell, hole, ...]. Shells are CCW and holes CW
+    here; each hole goes to the smallest shell around a point just inside its
+    covered side.
+    """
+    shells, holes, areas = [], [], []
+    for r in rings:
+        area = _signed_area(r)
+        if area > 0:
+            shells.append(r)
+            areas.append(area)
+        else:
+            holes.append(r)
+    polys = [[r] for r in shells]
+    if not holes:
+        return polys
+    bboxes = np.array([np.concatenate([np.min(r, axis=0), np.max(r, axis=0)]) for r in shells])
+    by_area = np.argsort(areas)
+    bboxes = bboxes[by_area]
+    for h in holes:
+        (x0, y0), (x1, y1) = h[0], h[1]
+        # Nudge off the edge midpoint to its left, where the hole's shell is covered
+        length = math.hypot(x1 - x0, y1 - y0)
+        px = (x0 + x1)/2 - (y1 - y0)/length*1e-6
+        py = (y0 + y1)/2 + (x1 - x0)/length*1e-6
+        hits = np.nonzero((bboxes[:, 0] <= px) & (bboxes[:, 1] <= py) & (bboxes[:, 2] >= px) & (bboxes[:, 3] >= py))[0]
+        for k in by_area[hits]:  # smallest shell first
+            if _point_in_ring(px, py, shells[k]):
+                polys[k].append(h)
+                break
+    return polys
+
+def lattice_union(points: List[Point], apothem: float) -> Optional[List[List[Ring]]]:
+    """
+    Merge equal-apothem hexes on the staggered lattice. Returns polygons as
+    [shell, hole, ...] rings, or None when the points or apothem do not fit
+    the lattice engine.
+    """
+    lattice = HexLattice(apothem)
+    ij = lattice_coords(points)
+    if ij is None or not lattice.supported():
+        return None
+    edges = lattice.boundary_edges(*ij)
+    print(f"Lattice merge: {len(edges)} boundary edges")
+    return assemble_polygons(chain_rings(edges))
+
+def round_rings_2(polys: List[List[Ring]]) -> Any:
+    """
+    Lattice polygons to GeoJSON-like coords rounded to 2 decimals, closed and
+    oriented like shapely's union output (shells CW, holes CCW).
+    """
+    def round_ring(ring: Ring):
+        pts = [[round(x, 2), round(y, 2)] for x, y in reversed(ring)]
+        return pts + pts[:1]
+    return [[round_ring(r) for r in poly] for poly in polys]
+
+# ---------- Partitioned parallel union ----------
+# Points are split into spatially compact cells by recursive median cuts along
+# the longer axis. Each cell is unioned in its own process. Polygons that stay
+# clear of their cell's edges cannot touch another cell and are final as they
+# are; only polygons near a seam are unioned again, together.
+
+Cell = Tuple[float, float, float, float]  # min x, min y, max x, max y
+
+def kd_partitions(xy: np.ndarray, size: int) -> List[Tuple[np.ndarray, Cell]]:
+    """Split point indices into cells of at most `size` points, with each cell's bounds."""
+    inf = math.inf
+    parts = [(np.arange(len(xy)), (-inf, -inf, inf, inf))]
+    done = []
+    while parts:
+        idx, cell = parts.pop()
+        sub = xy[idx]
+        if len(idx) <= max(1, size):
+            done.append((idx, cell))
+            continue
+        axis = 0 if np.ptp(sub[:, 0]) >= np.ptp(sub[:, 1]) else 1
+        order = np.argsort(sub[:, axis], kind="stable")
+        half = len(order) // 2
+        cut = (sub[order[half - 1], axis] + sub[order[half], axis]) / 2
+        lo, hi = list(cell), list(cell)
+        lo[axis + 2] = cut
+        hi[axis] = cut
+        parts.append((idx[order[:half]], tuple(lo)))
+        parts.append((idx[order[half:]], tuple(hi)))
+    return done
+
+def _union_partition(job):
+    from shapely.geometry import Polygon
+    from shapely.ops import unary_union
+    pts, apothems, cell, margin = job
+    merged = unary_union([Polygon(hex_vertices_pointy((x, y), a)) for (x, y), a in zip(pts, apothems)])
+    inner, seam = [], []
+    for g in getattr(merged, "geoms", [merged]):
+        if g.geom_type != "Polygon":
+            continue
+        minx, miny, maxx, maxy = g.bounds
+        if minx > cell[0] + margin and miny > cell[1] + margin and maxx < cell[2] - margin and maxy < cell[3] - margin:
+            inner.append(g)
+        else:
+            seam.append(g)
+    return inner, seam
+
+def partition_union(pts: List[Point], apothems: List[float], size: int, workers: Optional[int] = None):
+    from shapely.geometry import MultiPolygon
+    from shapely.ops import unary_union
+    xy = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+    ap = np.asarray(apothems, dtype=np.float64)
+    # A hex reaches one circumradius past its cell, a neighbour's hex one circumradius into it
+    margin = 2 * (2*float(ap.max())/math.sqrt(3.0)) if len(ap) else 0.0
+    parts = kd_partitions(xy, size)
+    jobs = [(xy[idx].tolist(), ap[idx].tolist(), cell, margin) for idx, cell in parts]
+    print(f"Unioning {len(jobs)} partitions of up to {size} points")
+    polys, seam = [], []
+    if workers == 1:
+        results = list(map(_union_partition, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_union_partition, jobs))
+    for inner, edge in results:
+        polys.extend(inner)
+        seam.extend(edge)
+    print(f"Stitching {len(seam)} polygon(s) along partition seams")
+    stitched = unary_union(seam)
+    polys.extend(g for g in getattr(stitched, "geoms", [stitched]) if g.geom_type == "Polygon" and not g.is_empty)
+    return MultiPolygon(polys)
 
 # ---------- Round coordinates ----------
 def round_coords_2(obj: Any) -> Any:
     """
     Convert a shapely Polygon/MultiPolygon to GeoJSON-like coords with all numbers rounded to 2 decimals.
     """
+    from shapely.geometry import Polygon, MultiPolygon
     def round_pt(pt): return [round(pt[0], 2), round(pt[1], 2)]
     def round_ring(ring): return [round_pt(p) for p in ring]
     def poly_coords(poly: Polygon):
@@ -188,101 +638,425 @@ def round_coords_2(obj: Any) -> Any:
         polys = [g for g in geoms if isinstance(g, Polygon)]
         return [poly_coords(g) for g in polys]
 
+def shapely_union(pts: List[Point], apothems: List[float], batch: int, workers: Optional[int] = None):
+    """General path: one shapely Polygon per point, partition unioned, as a MultiPolygon."""
+    from shapely.geometry import MultiPolygon
+    from shapely.ops import unary_union
+    print("Merging hexagons ...")
+    merged = partition_union(pts, apothems, batch, workers)
+
+    # Normalize to MultiPolygon
+    if merged.geom_type == "Polygon":
+        mpoly = MultiPolygon([merged])
+    elif merged.geom_type == "MultiPolygon":
+        mpoly = merged
+    else:
+        parts = [g for g in getattr(merged, "geoms", []) if g.geom_type in ("Polygon","MultiPolygon")]
+        mpoly = unary_union(parts)
+        if mpoly.geom_type == "Polygon":
+            mpoly = MultiPolygon([mpoly])
+    return mpoly
+
 def stagger_points(points: List[Point]) -> List[Point]:
     """
     Shift every odd 'row' by +0.5 in x.
     Assumes y is integer-like (row index).
     """
-    out = []
-    for x, y in points:
-        # If row (y) is odd
-        if int(round(y)) % 2 == 1:
-            out.append((x + 0.25, y))
+    arr = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    x, y = map_coords.stagger(arr[:, 0], arr[:, 1])
+    return list(zip(x.tolist(), y.tolist()))
+
+# ---------- Simplification, quantization, levels of detail ----------
+# Output stage on the rounded MultiPolygon coordinates, shared by both merge
+# paths. Simplification is Douglas-Peucker per ring with Saalfeld's check: a
+# run of vertices is only replaced by its chord when no live vertex of any
+# ring lies in the area swept between the two, so rings can neither cross nor
+# touch in new places. Vertices are removed as chords are accepted, and later
+# chords are checked against what is left.
+
+def zoom_tolerance(zoom: float) -> float:
+    """Half a screen pixel at a map zoom, in map units (the CRS scale is 2**zoom)."""
+    return 0.5 / 2**zoom
+
+class _VertexGrid:
+    """Live vertices of every ring, bucketed in square cells for box queries."""
+
+    def __init__(self, xy: np.ndarray, cell: float):
+        self.xy = xy
+        self.cell = cell
+        self.alive = np.ones(len(xy), dtype=bool)
+        self.mark = np.zeros(len(xy), dtype=bool)  # scratch for excluding a run
+        cxy = np.floor(xy / cell).astype(np.int64)
+        keys = cxy[:, 0] * (1 << 32) + cxy[:, 1]
+        order = np.argsort(keys, kind="stable")
+        uniq, starts = np.unique(keys[order], return_index=True)
+        self.cells = dict(zip(uniq.tolist(), np.split(order, starts[1:])))
+
+    def query(self, x0: float, y0: float, x1: float, y1: float) -> np.ndarray:
+        c = self.cell
+        i0, i1 = int(math.floor(x0 / c)), int(math.floor(x1 / c))
+        j0, j1 = int(math.floor(y0 / c)), int(math.floor(y1 / c))
+        hits = [self.cells.get(i * (1 << 32) + j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+        hits = [h for h in hits if h is not None]
+        if not hits:
+            return np.empty(0, dtype=np.int64)
+        ids = np.concatenate(hits)
+        return ids[self.alive[ids]]
+
+def _segment_distances(pts: np.ndarray, p: np.ndarray, r: np.ndarray) -> np.ndarray:
+    d = r - p
+    t = np.minimum(np.maximum(((pts - p) @ d) / max(float(d @ d), 1e-18), 0.0), 1.0)
+    return np.hypot(*(pts - (p + t[:, None] * d)).T)
+
+def _chord_is_safe(grid: _VertexGrid, run_xy: np.ndarray, run_ids: np.ndarray, reach: float) -> bool:
+    """
+    True if no other live vertex is inside or on the polygon run + closing chord.
+    The run is within `reach` of its chord, and so is that polygon (the capsule
+    around the chord is convex), which rules out most candidates cheaply.
+    """
+    p, r = run_xy[0], run_xy[-1]
+    x0, y0 = np.minimum(p, r) - reach
+    x1, y1 = np.maximum(p, r) + reach
+    ids = grid.query(x0, y0, x1, y1)
+    if len(ids) == 0:
+        return True
+    q = grid.xy[ids]
+    near = _segment_distances(q, p, r) <= reach + LATTICE_EPS
+    # Vertices on the chord's ends already touch the ring there, the chord keeps them
+    near &= (np.abs(q - p).max(axis=1) > LATTICE_EPS) & (np.abs(q - r).max(axis=1) > LATTICE_EPS)
+    grid.mark[run_ids] = True
+    near &= ~grid.mark[ids]
+    grid.mark[run_ids] = False
+    q = q[near]
+    if len(q) == 0:
+        return True
+    # Anything left on the chord, or on a run vertex (rings touching at a point)
+    if (_segment_distances(q, p, r) <= LATTICE_EPS).any():
+        return False
+    if (np.abs(q[:, None, :] - run_xy[None, :, :]).max(axis=2) <= LATTICE_EPS).any():
+        return False
+    # Inside the polygon closed by the chord (even-odd rule)
+    a = run_xy
+    b = np.concatenate([run_xy[1:], run_xy[:1]])
+    qy = q[:, 1:2]
+    crosses = (a[None, :, 1] > qy) != (b[None, :, 1] > qy)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xcut = a[None, :, 0] + (qy - a[None, :, 1]) * (b[None, :, 0] - a[None, :, 0]) / (b[None, :, 1] - a[None, :, 1])
+    inside = np.count_nonzero(crosses & (q[:, 0:1] < xcut), axis=1) % 2 == 1
+    return not inside.any()
+
+def _simplify_ring(grid: _VertexGrid, ids: np.ndarray, tolerance: float) -> np.ndarray:
+    """Ids of the vertices kept on one open ring; removed ones are retired from the grid."""
+    m = len(ids)
+    if m <= 4:
+        return ids
+    xy = grid.xy[ids]
+    # Four anchors keep every ring a proper polygon: the first vertex, the one
+    # farthest from it, and the farthest from the chords in between
+    far = int(np.argmax(np.hypot(*(xy - xy[0]).T)))
+    anchors = [0]
+    for s, e in ((0, far), (far, m)):
+        inner = np.arange(s + 1, e)
+        if len(inner):
+            anchors.append(int(inner[np.argmax(_segment_distances(xy[inner], xy[s], xy[e % m]))]))
+        if e < m:
+            anchors.append(e)
+    anchors = sorted(set(anchors)) + [m]
+    keep = np.zeros(m, dtype=bool)
+    keep[anchors[:-1]] = True
+    stack = list(zip(anchors[:-1], anchors[1:]))
+    while stack:
+        s, e = stack.pop()
+        if e - s < 2:
+            continue
+        run = np.arange(s, e + 1) % m
+        dist = _segment_distances(xy[run[1:-1]], xy[s], xy[e % m])
+        split = s + 1 + int(np.argmax(dist))
+        reach = float(dist.max())
+        if reach <= tolerance + LATTICE_EPS and _chord_is_safe(grid, xy[run], ids[run], reach):
+            grid.alive[ids[run[1:-1]]] = False
         else:
-            out.append((x - 0.25, y))
+            keep[split] = True
+            stack.append((s, split))
+            stack.append((split, e))
+    return ids[keep]
+
+def _drop_collinear_coords(coords: Any) -> Any:
+    """
+    Closed rings without repeated vertices and without the vertices in the
+    middle of a straight run. A ring left with fewer than 3 distinct points is
+    not emitted, and a shell takes its holes with it.
+    """
+    def ring_out(ring):
+        xy = np.asarray(ring[:-1], dtype=np.float64).reshape(-1, 2)
+        while True:
+            # Rounding to 2 decimals repeats points, and a repeat has a zero cross
+            # product, which would drop the real corner it sits on
+            xy = xy[np.abs(xy - np.roll(xy, 1, axis=0)).max(axis=1) > LATTICE_EPS] if len(xy) > 1 else xy
+            if len(xy) < 3:
+                return None
+            prev, nxt = np.roll(xy, 1, axis=0), np.roll(xy, -1, axis=0)
+            cross = (xy[:, 0] - prev[:, 0])*(nxt[:, 1] - xy[:, 1]) - (xy[:, 1] - prev[:, 1])*(nxt[:, 0] - xy[:, 0])
+            straight = np.abs(cross) <= LATTICE_EPS
+            if not straight.any():
+                break
+            # Dropping a spike's tip repeats its base, go around again
+            xy = xy[~straight]
+        kept = xy.tolist()
+        return kept + kept[:1]
+
+    out = []
+    for poly in coords:
+        shell = ring_out(poly[0]) if poly else None
+        if shell is None:
+            continue
+        out.append([shell] + [r for r in (ring_out(h) for h in poly[1:]) if r is not None])
     return out
 
-# ---------- Main ----------
-def main():
-    ap = argparse.ArgumentParser(description="Pointy-top hex merge around points → rounded MultiPolygon GeoJSON")
-    ap.add_argument("input", help="Input file (GeoJSON or text with [x,y] pairs)")
-    ap.add_argument("output", help="Output GeoJSON file")
-    ap.add_argument("--mode", choices=["per-point","fixed"], default="per-point",
-                    help="Size mode: per-point nearest-neighbor (default) or fixed")
-    ap.add_argument("--apothem", type=float, default=None,
-                    help="Apothem if --mode fixed. If omitted, defaults to 0.6")
-    ap.add_argument("--batch", type=int, default=5000,
-                    help="Union batch size for performance")
-    ap.add_argument("--prop", action="append", default=[], metavar="KEY=VALUE",
-                    help="Add property to output Feature (repeatable)")
-    args = ap.parse_args()
+def simplify_coords(coords: Any, tolerance: float) -> Any:
+    """
+    Simplify MultiPolygon coordinates without changing their topology. With a
+    tolerance of 0 only repeated and collinear vertices go. Rings less than two tolerances
+    (a pixel, at a level's zoom) across are dropped, and a shell takes its holes.
+    """
+    coords = _drop_collinear_coords(coords)
+    if tolerance <= 0:
+        return coords
+    rings = [(pi, ri, ring[:-1]) for pi, poly in enumerate(coords) for ri, ring in enumerate(poly)]
+    if not rings:
+        return []
+    sizes = [len(r) for _, _, r in rings]
+    xy = np.array([pt for _, _, r in rings for pt in r], dtype=np.float64)
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    grid = _VertexGrid(xy, max(2.0 * tolerance, 1.0))
 
-    txt = open(args.input, "r", encoding="utf-8").read()
-    pts = load_points_from_text(txt)
-    
-    pts = stagger_points(pts)
-    print("[Preprocess] Staggered odd rows")
-    
+    # Drop the rings too small to see first, so they do not hold others back
+    dropped_polys, skip = set(), set()
+    for k, (pi, ri, _) in enumerate(rings):
+        ring = xy[offsets[k]:offsets[k + 1]]
+        if pi in dropped_polys or (ring.max(axis=0) - ring.min(axis=0)).max() < 2*tolerance:
+            if ri == 0:
+                dropped_polys.add(pi)
+            skip.add(k)
+            grid.alive[offsets[k]:offsets[k + 1]] = False
+
+    out: List[List[Any]] = [[] for _ in coords]
+    for k, (pi, ri, _) in enumerate(rings):
+        if k in skip:
+            continue
+        kept = _simplify_ring(grid, np.arange(offsets[k], offsets[k + 1]), tolerance)
+        ring = xy[kept].tolist()
+        out[pi].append(ring + ring[:1])
+    return [poly for poly in out if poly]
+
+def simplify_roads(fc: Dict[str, Any], tolerance: float) -> Dict[str, Any]:
+    """A copy of a road FeatureCollection with every MultiPolygon simplified."""
+    features = []
+    for f in fc["features"]:
+        geom = f["geometry"]
+        features.append({**f, "geometry": {**geom, "coordinates": simplify_coords(geom["coordinates"], tolerance)}})
+    return {**fc, "features": features}
+
+LOD_ZOOMS = [-5.0, -3.0, -1.0]  # default levels of build_roads.py
+# {layer: [zoom, ...]} of the levels written next to each layer, map.js only
+# requests those and loads the full file once for the others
+LOD_MANIFEST = "roads_lod.json"
+
+def road_levels(fc: Dict[str, Any], zooms: List[float]) -> Dict[float, Dict[str, Any]]:
+    """One simplified FeatureCollection per zoom, each to half a screen pixel at that zoom."""
+    return {z: simplify_roads(fc, zoom_tolerance(z)) for z in zooms}
+
+def layer_name(path: str) -> str:
+    """assets/markers/roads_r1_small.geojson → roads_r1_small, the key of the layer in the LOD manifest"""
+    return os.path.basename(path).rpartition(".")[0] or os.path.basename(path)
+
+def level_path(path: str, zoom: float) -> str:
+    """roads_r1_small.geojson → roads_r1_small.z-3.geojson"""
+    stem, dot, ext = path.rpartition(".")
+    return f"{stem}.z{zoom:g}.{ext}" if dot else f"{path}.z{zoom:g}"
+
+# Quantized form: integer coordinates on the 1/100 grid the output is already
+# rounded to (so it is lossless), relative to a "transform" like TopoJSON's.
+# Each ring is a flat [x0, y0, dx1, dy1, ...] list without the closing point.
+QUANTIZE_SCALE = 0.01
+
+def encode_quantized(fc: Dict[str, Any]) -> Dict[str, Any]:
+    """Road FeatureCollection → quantized, delta encoded form."""
+    rings = [np.rint(np.asarray(ring[:-1], dtype=np.float64) / QUANTIZE_SCALE).astype(np.int64)
+             for f in fc["features"] for poly in f["geometry"]["coordinates"] for ring in poly]
+    origin = np.min([r.min(axis=0) for r in rings], axis=0) if rings else np.zeros(2, dtype=np.int64)
+    it = iter(rings)
+    features = []
+    for f in fc["features"]:
+        polys = []
+        for poly in f["geometry"]["coordinates"]:
+            polys.append([np.diff(next(it) - origin, axis=0, prepend=[[0, 0]]).ravel().tolist() for _ in poly])
+        features.append({**f, "geometry": {**f["geometry"], "coordinates": polys}})
+    return {**fc, "transform": {"scale": [QUANTIZE_SCALE, QUANTIZE_SCALE],
+                                "translate": (origin * QUANTIZE_SCALE).round(2).tolist()}, "features": features}
+
+def decode_quantized(qfc: Dict[str, Any]) -> Dict[str, Any]:
+    """Inverse of encode_quantized: plain GeoJSON with closed rings rounded to 2 decimals."""
+    (sx, sy), (tx, ty) = qfc["transform"]["scale"], qfc["transform"]["translate"]
+    digits = max(0, -int(math.floor(math.log10(min(sx, sy)))))
+    def decode_ring(flat):
+        q = np.cumsum(np.asarray(flat, dtype=np.int64).reshape(-1, 2), axis=0)
+        pts = np.column_stack([q[:, 0] * sx + tx, q[:, 1] * sy + ty]).round(digits).tolist()
+        return pts + pts[:1]
+    features = []
+    for f in qfc["features"]:
+        coords = [[decode_ring(r) for r in poly] for poly in f["geometry"]["coordinates"]]
+        features.append({**f, "geometry": {**f["geometry"], "coordinates": coords}})
+    fc = {k: v for k, v in qfc.items() if k != "transform"}
+    fc["features"] = features
+    return fc
+
+def update_lod_manifest(folder: str, levels: Dict[str, List[float]]):
+    """Record the simplified levels written for some layers in folder/roads_lod.json, keeping the other layers'."""
+    path = os.path.join(folder or ".", LOD_MANIFEST)
+    manifest = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    for layer, zooms in levels.items():
+        manifest[layer] = sorted(int(z) if float(z).is_integer() else z for z in zooms)
+    with atomic_open(path, "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(manifest.items())), f, separators=(",", ":"))
+
+def quantized_path(path: str) -> str:
+    """roads_r1_small.geojson → roads_r1_small.qjson"""
+    stem, dot, _ = path.rpartition(".")
+    return f"{stem}.qjson" if dot else f"{path}.qjson"
+
+# ---------- Build ----------
+def merge_points(pts: List[Point], mode: str = "per-point", apothem: Optional[float] = None,
+                 batch: int = 5000, workers: Optional[int] = None) -> Tuple[Any, int]:
+    """
+    Staggered points → MultiPolygon coordinates rounded to 2 decimals, and the polygon count.
+    Uses the lattice engine when all apothems are equal, shapely otherwise.
+    """
     n = len(pts)
     print(f"Loaded {n} points")
 
     # Decide apothem(s)
-    if args.mode == "fixed":
-        a = args.apothem if args.apothem is not None else 0.6
+    if mode == "fixed":
+        a = apothem if apothem is not None else 0.6
         apothems = [float(a)] * n
         print(f"Using fixed apothem={a}")
     else:
         print("Computing nearest-neighbor distances ...")
-        d_nn = nearest_dist_per_point(pts)
+        with stage("nearest", n):
+            d_nn = nearest_dist_per_point(pts)
         # Ensure hexes touch nearest neighbor: set apothem = d/2 (inscribed circle radius)
         apothems = [ (d/2.0 if d < 1e8 else 0.6) for d in d_nn ]
         print("Done computing per-point apothems.")
 
-    # Build pointy-top hexagons
-    hexes: List[Polygon] = []
-    step = max(1, n // 100)
-    for i, (p, a) in enumerate(zip(pts, apothems), 1):
-        verts = hex_vertices_pointy(p, a)
-        hexes.append(Polygon(verts))
-        if i % (step*10) == 0 or i == n:
-            print(f"Built {i}/{n} hexagons")
+    if len(set(apothems)) == 1:
+        with stage("lattice_union", n):
+            polys = lattice_union(pts, apothems[0])
+            coords = round_rings_2(polys) if polys is not None else None
+        if polys is not None:
+            return coords, len(polys)
+        print("Points are not on the staggered lattice, using shapely union")
 
-    # Merge them
-    print("Merging hexagons ...")
-    merged = batch_union(hexes, args.batch)
+    if not HAVE_SHAPELY:
+        raise RuntimeError("shapely is required for variable apothems. Install with: pip install shapely")
+    with stage("shapely_union", n):
+        mpoly = shapely_union(pts, apothems, batch, workers)
+        coords = round_coords_2(mpoly)  # [[ [ [x,y],... ], [hole...], ... ], ...]
+    return coords, (len(mpoly.geoms) if hasattr(mpoly,'geoms') else 1)
 
-    # Normalize to MultiPolygon
-    if merged.geom_type == "Polygon":
-        mpoly = MultiPolygon([merged])
-    elif merged.geom_type == "MultiPolygon":
-        mpoly = merged
-    else:
-        parts = [g for g in getattr(merged, "geoms", []) if g.geom_type in ("Polygon","MultiPolygon")]
-        mpoly = unary_union(parts)
-        if mpoly.geom_type == "Polygon":
-            mpoly = MultiPolygon([mpoly])
+def build_roads(txt: str, mode: str = "per-point", apothem: Optional[float] = None, batch: int = 5000,
+                workers: Optional[int] = None, props: Optional[Dict[str,str]] = None) -> Tuple[Dict[str, Any], int]:
+    """Input text (GeoJSON or [x,y] pairs) → road FeatureCollection and its polygon count."""
+    with stage("load") as span:
+        pts = load_points_from_text(txt)
+        span.items = len(pts)
 
-    # Properties
-    props: Dict[str,str] = {}
-    for kv in args.prop:
-        if "=" in kv:
-            k,v = kv.split("=",1)
-            props[k] = v
+    with stage("stagger", len(pts)):
+        pts = stagger_points(pts)
+    print("[Preprocess] Staggered odd rows")
 
-    # Round to 2 decimals and write GeoJSON
-    coords = round_coords_2(mpoly)  # [[ [ [x,y],... ], [hole...], ... ], ...]
+    coords, n_polys = merge_points(pts, mode, apothem, batch, workers)
+    with stage("drop_collinear", n_polys):
+        coords = simplify_coords(coords, 0.0)
     feature = {
         "type": "Feature",
-        "properties": props,
+        "properties": props or {},
         "geometry": {
             "type": "MultiPolygon",
             "coordinates": coords
         }
     }
-    fc = {"type": "FeatureCollection", "features": [feature]}
-    with open(args.output, "w", encoding="utf-8") as f:
-        json.dump(fc, f, ensure_ascii=False,separators=(',', ':'))
-    print(f"Wrote {len(mpoly.geoms) if hasattr(mpoly,'geoms') else 1} polygon(s) → {args.output}")
+    return {"type": "FeatureCollection", "features": [feature]}, n_polys
+
+def write_geojson(fc: Dict[str, Any], path: str):
+    with atomic_open(path, "w", encoding="utf-8") as f:
+        # dumps() uses the C encoder, dump() would stream through the pure-Python one
+        f.write(json.dumps(fc, ensure_ascii=False,separators=(',', ':')))
+
+def write_roads(fc: Dict[str, Any], path: str, lod_zooms: Optional[List[float]] = None,
+                quantize: bool = False) -> List[str]:
+    """
+    Write the full detail layer, one simplified layer per zoom in `lod_zooms`
+    next to it, and the quantized form of each if asked. Returns the paths.
+    """
+    layers = [(path, fc)]
+    with stage("simplify", len(lod_zooms or [])):
+        for zoom, level in road_levels(fc, lod_zooms or []).items():
+            layers.append((level_path(path, zoom), level))
+    written = []
+    with stage("write") as span:
+        for out, layer in layers:
+            write_geojson(layer, out)
+            written.append(out)
+            if quantize:
+                write_geojson(encode_quantized(layer), quantized_path(out))
+                written.append(quantized_path(out))
+        span.items = len(written)
+    return written
+
+# ---------- Main ----------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Pointy-top hex merge around points → rounded MultiPolygon GeoJSON")
+    ap.add_argument("input", help="Input file (GeoJSON or text with [x,y] pairs)")
+    ap.add_argument("output", help="Output GeoJSON file")
+    ap.add_argument("--mode", choices=["per-point","fixed"], default="per-point",
+                    help="Size mode: per-point nearest-neighbor (default) or fixed")
+    ap.add_argument("--apothem", type=float, default=None,
+                    help="Apothem if --mode fixed. If omitted, defaults to 0.6")
+    ap.add_argument("--batch", type=int, default=5000,
+                    help="Points per spatial partition for the shapely union")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="Processes for the shapely union (default: CPU count)")
+    ap.add_argument("--prop", action="append", default=[], metavar="KEY=VALUE",
+                    help="Add property to output Feature (repeatable)")
+    ap.add_argument("--lod-zooms", type=float, nargs="*", default=[], metavar="ZOOM",
+                    help=f"Also write a simplified layer per map zoom, e.g. {' '.join(f'{z:g}' for z in LOD_ZOOMS)}")
+    ap.add_argument("--quantize", action="store_true",
+                    help="Also write each layer as quantized, delta encoded .qjson")
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    # Properties
+    props: Dict[str,str] = {}
+    for kv in args.prop:
+        if "=" in kv:
+            k,v = kv.split("=",1)
+            props[k] = v
+
+    with start_run("generate_roads", args):
+        txt = open(args.input, "r", encoding="utf-8").read()
+        try:
+            fc, n_polys = build_roads(txt, args.mode, args.apothem, args.batch, args.workers, props)
+        except RuntimeError as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            sys.exit(1)
+
+        # Coordinates are already rounded to 2 decimals
+        written = write_roads(fc, args.output, args.lod_zooms, args.quantize)
+        update_lod_manifest(os.path.dirname(args.output), {layer_name(args.output): args.lod_zooms})
+        print(f"Wrote {n_polys} polygon(s) → {', '.join(written)}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
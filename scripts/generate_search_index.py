@@ -0,0 +1,211 @@
+"""
+Search index over the names of claims, caves, temples and dungeons, so the map
+can look names up without scanning markers, before their layers are loaded.
+
+Entries are (name, layer) groups sorted by lowercased name, each with the
+coordinates of every marker of that name in that layer. Two structures point
+into them:
+
+- a radix trie of the lowercased names. Entries under a node share its prefix
+  and, being sorted, form one range [lo, hi), so a prefix lookup walks the
+  query once and slices the range
+- a trigram inverted index ("  ab", " ab", "abc", ...) for fuzzy matches.
+  Candidates are ranked by the Jaccard similarity of their trigram sets with
+  the query's. It is not written: it would be the biggest part of the file,
+  and the readers build it from the names when they load the index
+
+library.js reads the same file (loadSearchIndex) and mirrors the lookups below.
+
+Usage:
+python scripts/generate_search_index.py
+python scripts/generate_search_index.py --query "ferr" --query "farmvile"
+"""
+
+import argparse
+import json
+import os
+
+from atomic_files import atomic_open
+from instrumentation import add_arguments, stage, start_run
+
+markers_folder = 'assets/markers/'
+search_index_file = 'assets/markers/search.json'
+# Layer -> property holding the searchable name
+sources = {
+    'claims': 'name',
+    'caves': 'name',
+    'temples': 'name',
+    'dungeons': 'popupText',
+}
+min_similarity = 0.3
+
+
+def search_key(name):
+    # Plain lower(), the same as toLowerCase() in library.js
+    return ' '.join(name.lower().split())
+
+
+def trigrams(key):
+    padded = '  ' + key + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def build_postings(keys):
+    """Trigram -> ids of the keys holding it, in id order."""
+    postings = {}
+    for entry_id, key in enumerate(keys):
+        for trigram in trigrams(key):
+            postings.setdefault(trigram, []).append(entry_id)
+    return postings
+
+
+def _build_trie(keys):
+    """Radix trie over sorted keys as [label, lo, hi, child, ...] nodes, the root first."""
+    nodes = []
+
+    def build(label, lo, hi, depth):
+        node = [label, lo, hi]
+        nodes.append(node)
+        # Keys ending here sort first in their range
+        start = lo
+        while start < hi and len(keys[start]) == depth:
+            start += 1
+        while start < hi:
+            char = keys[start][depth]
+            end = start
+            while end < hi and keys[end][depth] == char:
+                end += 1
+            # Extend the edge while every key of the range agrees
+            stop = depth + 1
+            while all(len(keys[k]) > stop for k in range(start, end)) and \
+                    len({keys[k][stop] for k in range(start, end)}) == 1:
+                stop += 1
+            node.append(len(nodes))
+            build(keys[start][depth:stop], start, end, stop)
+            start = end
+
+    build('', 0, len(keys), 0)
+    return nodes
+
+
+def build_search_index(layer_features):
+    """{layer: features} -> the index as a JSON-ready dict."""
+    layers = list(layer_features)
+    groups = {}
+    for layer_id, layer in enumerate(layers):
+        for feature in layer_features[layer]:
+            name = feature['properties'].get(sources[layer])
+            if not name:
+                continue
+            x, y = feature['geometry']['coordinates'][:2]
+            groups.setdefault((search_key(name), name, layer_id), []).append((x, y))
+
+    entries = sorted(groups)
+    keys = [key for key, _, _ in entries]
+    offsets = [0]
+    xy = []
+    for entry in entries:
+        for x, y in groups[entry]:
+            xy.extend([x, y])
+        offsets.append(len(xy) // 2)
+
+    return {
+        "layers": layers,
+        "names": [name for _, name, _ in entries],
+        "layer": [layer_id for _, _, layer_id in entries],
+        "offsets": offsets,
+        "xy": xy,
+        "trie": _build_trie(keys),
+    }
+
+
+class SearchIndex:
+    """Lookups over a loaded index, the same as library.js does them."""
+
+    def __init__(self, data):
+        self.data = data
+        self.keys = [search_key(name) for name in data['names']]
+        self.postings = build_postings(self.keys)
+
+    def points(self, entry_id):
+        lo, hi = self.data['offsets'][entry_id], self.data['offsets'][entry_id + 1]
+        xy = self.data['xy']
+        return [(xy[2 * k], xy[2 * k + 1]) for k in range(lo, hi)]
+
+    def prefix(self, query, limit=10):
+        """Entry ids whose name starts with the query, in name order."""
+        query = search_key(query)
+        trie = self.data['trie']
+        node = trie[0]
+        while query:
+            for child in node[3:]:
+                label = trie[child][0]
+                if label.startswith(query) or query.startswith(label):
+                    node = trie[child]
+                    query = query[len(label):]
+                    break
+            else:
+                return []
+        return list(range(node[1], min(node[2], node[1] + limit)))
+
+    def fuzzy(self, query, limit=10):
+        """Entry ids sharing trigrams with the query, most similar first."""
+        wanted = trigrams(search_key(query))
+        shared = {}
+        for trigram in wanted:
+            for entry_id in self.postings.get(trigram, ()):
+                shared[entry_id] = shared.get(entry_id, 0) + 1
+        scored = []
+        for entry_id, count in shared.items():
+            similarity = count / (len(wanted) + len(trigrams(self.keys[entry_id])) - count)
+            if similarity >= min_similarity:
+                scored.append((-similarity, entry_id))
+        return [entry_id for _, entry_id in sorted(scored)[:limit]]
+
+    def search(self, query, limit=10):
+        """Prefix matches first, then fuzzy ones up to `limit`."""
+        found = self.prefix(query, limit)
+        for entry_id in self.fuzzy(query, limit):
+            if len(found) >= limit:
+                break
+            if entry_id not in found:
+                found.append(entry_id)
+        return found
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Build the name search index of the map")
+    ap.add_argument("--layers", nargs="+", default=list(sources), choices=list(sources))
+    ap.add_argument("--markers-dir", default=markers_folder)
+    ap.add_argument("--output", default=search_index_file)
+    ap.add_argument("--query", action="append", default=[], help="Look this up in the written index")
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    with start_run('generate_search_index', args):
+        layer_features = {}
+        with stage('load') as span:
+            for layer in args.layers:
+                with open(os.path.join(args.markers_dir, layer + '.geojson'), 'r', encoding='utf-8') as file:
+                    data = json.load(file)
+                layer_features[layer] = data['features'] if isinstance(data, dict) else data
+                span.add(len(layer_features[layer]))
+
+        with stage('index') as span:
+            index = build_search_index(layer_features)
+            span.items = len(index['names'])
+        with stage('write'):
+            with atomic_open(args.output, 'w', encoding='utf-8') as file:
+                json.dump(index, file, separators=(',', ':'), ensure_ascii=False)
+        print('Wrote ' + str(len(index['names'])) + ' names and ' + str(len(index['trie'])) + ' trie nodes to ' + args.output + ' (' + str(os.path.getsize(args.output)) + ' bytes)')
+
+        lookup = SearchIndex(index)
+        for query in args.query:
+            print(query + ':')
+            for entry_id in lookup.search(query):
+                print('  ' + index['names'][entry_id] + ' (' + index['layers'][index['layer'][entry_id]] + ', '
+                      + str(len(lookup.points(entry_id))) + ')')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,19 @@
-from PIL import Image, ImageOps
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import requests
-import gzip
+import argparse
+import hashlib
+import json
 import shutil
 import math
-import cv2
+import os
+import struct
+import zlib
+
+from atomic_files import atomic_open
+from http_cache import HttpCache, chunk_size
+from instrumentation import add_arguments, stage, start_run
+import map_coords
+from map_coords import axial_to_offset, hex_axial
 
 width = 2400
 height = 2400
@@ -21,81 +30,471 @@ terrain_map_file_png = 'TerrainMap.gwm.png'
 terrain_map_file_hexagon = 'TerrainMap.hex.png'
 data_folder = 'assets/data/'
 
+# Tile pyramid, see createMapOptions() in assets/js/config.js
+map_width = map_coords.map_width    # map units
+map_height = map_coords.map_height  # map units
+tile_size = map_coords.tile_size    # tile edge in pixels
+min_zoom = -5
+max_native_zoom = 0 # hex image resolution, Leaflet upscales beyond this
+tiles_folder = 'assets/maps/tiles/'
+tiles_manifest_file = 'manifest.json'
+source_suffix = '.source'   # sidecar of TerrainMap.hex.png: sha256 of the TerrainMap.gwm it was rendered from
+
 expected_size = width * height * pixel_size
 
+
 # ----------------------------------------- #
-# Download and unzip the terrain map file
+# Download, unzip and decode in one stream
 # ----------------------------------------- #
-response = requests.get(maps_url + terrain_map_file_raw, stream=True)
-response.raise_for_status()
+class TerrainDecoder:
+    """
+    Incremental gunzip of TerrainMap.gwm straight into a preallocated buffer
+    of the uncompressed file. Fed with the chunks of the download as they
+    arrive, so neither the compressed nor the uncompressed file has to be on
+    disk. The uncompressed bytes are also written to unzip_path if given.
+    """
+
+    def __init__(self, unzip_path=None):
+        self.buffer = np.empty(header_size + expected_size, dtype=np.uint8)
+        self.size = 0
+        self.inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)  # gzip header
+        self.unzip_file = open(unzip_path, 'wb') if unzip_path else None
+
+    def _write(self, data):
+        if self.unzip_file:
+            self.unzip_file.write(data)
+        # Anything past the pixels is not part of the image
+        n = min(len(data), len(self.buffer) - self.size)
+        self.buffer[self.size:self.size + n] = np.frombuffer(data, dtype=np.uint8, count=n)
+        self.size += n
+
+    def feed(self, chunk):
+        # At most 1 MB inflated per step, whatever the compression ratio
+        while chunk and not self.inflate.eof:
+            self._write(self.inflate.decompress(chunk, 1 << 20))
+            chunk = self.inflate.unconsumed_tail
+
+    def close(self):
+        if self.unzip_file:
+            self.unzip_file.close()
+            self.unzip_file = None
+
+    def finish(self):
+        """The RGB array of the fed file."""
+        self._write(self.inflate.flush())
+        self.close()
+        if not self.inflate.eof:
+            raise ValueError("Truncated gzip stream.")
+        if self.size < len(self.buffer):
+            raise ValueError("File too small for expected image size.")
+        return decode_terrain_bytes(self.buffer)
+
 
-with open(data_folder + terrain_map_file_raw, "wb") as file:
-    for chunk in response.iter_content(chunk_size=8192):
-        if chunk:
-            file.write(chunk)
+def load_terrain_map(url, offline=None, rendered=None, force=False, raw_path=None, unzip_path=None):
+    """
+    Fetch the map through the shared HTTP cache and decode it while it
+    downloads. Returns (img_array, sha256) of the map. When its sha256 is
+    `rendered`, the one the output was rendered from, and force is not set,
+    nothing is decoded and img_array is None. raw_path and unzip_path keep the
+    compressed and uncompressed files.
+    """
+    decoder = TerrainDecoder(unzip_path)
+    try:
+        with HttpCache(offline=offline) as cache:
+            response = cache.fetch(url, on_chunk=decoder.feed)
+        # Not response.changed: the cache holds the new body before the render
+        # that uses it, so a failed render or another --mode would be skipped
+        if response.sha256 == rendered and not force:
+            return None, response.sha256
+        if response.status != 'downloaded':
+            # A 304 or an offline run, the body comes from the cache
+            with response.open() as file:
+                for chunk in iter(lambda: file.read(chunk_size), b''):
+                    decoder.feed(chunk)
+        if raw_path:
+            shutil.copyfile(response.path, raw_path)
+        return decoder.finish(), response.sha256
+    finally:
+        decoder.close()
 
-with gzip.open(data_folder + terrain_map_file_raw, "rb") as f_in:
-    with open(data_folder + terrain_map_file_unzip, "wb") as f_out:
-        shutil.copyfileobj(f_in, f_out)
 
 # ----------------------------------------- #
-# Uncompressed file to PNG file
+# Uncompressed file to RGB array
 # ----------------------------------------- #
-with open(data_folder + terrain_map_file_unzip, "rb") as f:
-    data = f.read()
+def pixels_to_rgb(pixel_data):
+    """
+    Turn the raw .gwm payload (header already stripped) into an (H, W, 3) RGB view.
+    Each pixel is 8 bytes with B, G, R at offsets 1, 2, 3. No copy is made:
+    the channels are a strided view and the mirror + 180° rotation of the old
+    PIL pipeline is a single vertical flip.
+    """
+    if pixel_data.size < expected_size:
+        raise ValueError("File too small for expected image size.")
 
-pixel_data = data[header_size:]
+    pixels = pixel_data[:expected_size].reshape((height, width, pixel_size))
+    rgb = pixels[:, :, 3:0:-1]  # R, G, B
+    return rgb[::-1]
 
-if len(pixel_data) < expected_size:
-    raise ValueError("File too small for expected image size.")
-elif len(pixel_data) > expected_size:
-    pixel_data = pixel_data[:expected_size]  # Trim padding if any
 
-rgb_data = bytearray()
-for i in range(0, len(pixel_data), pixel_size):
-    b, g, r = pixel_data[i+1], pixel_data[i+2], pixel_data[i+3]
-    rgb_data.extend([r, g, b]) 
+def decode_terrain_bytes(data):
+    """Decode an in-memory uncompressed .gwm file (bytes, bytearray or memoryview)."""
+    pixel_data = np.frombuffer(data, dtype=np.uint8, offset=header_size)
+    return pixels_to_rgb(pixel_data)
 
-img_array = np.frombuffer(rgb_data, dtype=np.uint8).reshape((height, width, 3))
 
-img = Image.fromarray(img_array)
-img = ImageOps.mirror(img)
-img = img.rotate(180)
-img = img.resize((2400 * scale_factor, 2400 * scale_factor), resample=Image.NEAREST)
+def decode_terrain_file(path):
+    """Decode an uncompressed .gwm file on disk through a read-only memory map."""
+    payload_size = os.path.getsize(path) - header_size
+    if payload_size < expected_size:
+        raise ValueError("File too small for expected image size.")
+    pixel_data = np.memmap(path, dtype=np.uint8, mode='r', offset=header_size, shape=(payload_size,))
+    return pixels_to_rgb(pixel_data)
+
+
+def upscale_nearest(img_array, factor):
+    if factor == 1:
+        return img_array
+    return img_array.repeat(factor, axis=0).repeat(factor, axis=1)
+
+
+def save_terrain_png(img_array, png_path):
+    from PIL import Image  # only the PNG and tile writers need PIL
+    with atomic_open(png_path, 'wb') as file:
+        Image.fromarray(np.ascontiguousarray(img_array)).save(file, format='PNG')
 
-img.save(data_folder + terrain_map_file_png)
 
 # ----------------------------------------- #
 # Hex Map Generation
 # ----------------------------------------- #
-img = cv2.imread(data_folder + terrain_map_file_png)
-h, w = img.shape[:2]
-
-# Output image
-out_h = int(h * scale)
-out_w = int(w * scale)
-result = np.zeros((out_h, out_w, 3), dtype=np.uint8)
-
-dx = math.sqrt(3) * hex_size
-dy = 1.5 * hex_size
-
-for y in np.arange(0, out_h + dy, dy):
-    for x in np.arange(0, out_w + dx, dx):
-        offset = dx / 2 if int(y // dy) % 2 else 0
-        cx = x + offset
-        cy = y
-        orig_x = int(cx / scale)
-        orig_y = int(cy / scale)
-        if 0 <= orig_x < w and 0 <= orig_y < h:
-            color = tuple(int(c) for c in img[orig_y, orig_x])
-            pts = []
-            for i in range(6):
-                angle = math.pi / 6 + math.pi / 3 * i  # pointy top
-                px = int(cx + hex_size * math.cos(angle))
-                py = int(cy + hex_size * math.sin(angle))
-                pts.append([px, py])
-            pts = np.array([pts], dtype=np.int32)
-            cv2.fillPoly(result, pts, color)
-
-# Save output
-cv2.imwrite(data_folder + terrain_map_file_hexagon, result)
\ No newline at end of file
+def hex_cells(xs, ys):
+    """
+    Offset (row, col) of the pointy-top hex whose area contains each pixel.
+    Rows are `1.5 * hex_size` apart and odd rows are shifted by half a hex,
+    the same layout the old per-hex fillPoly loop drew.
+    """
+    return axial_to_offset(*hex_axial(xs, ys, hex_size))
+
+
+def hex_template(out_w, src_w):
+    """
+    Hex-cell labels for one vertical period of the lattice.
+    Two hex rows span `3 * hex_size` output pixels, so every later band reuses
+    this tile with the row index shifted by 2 per period. Returns the tile's
+    hex rows and, per pixel, the source column to sample (-1 outside the map).
+    """
+    period = 3 * hex_size
+    if period != int(period):
+        raise ValueError("3 * hex_size must be a whole number of pixels.")
+    period = int(period)
+
+    # Sample at pixel centres
+    xs = np.arange(out_w, dtype=np.float64)[np.newaxis, :] + 0.5
+    ys = np.arange(period, dtype=np.float64)[:, np.newaxis] + 0.5
+    row, col = hex_cells(xs, ys)
+
+    dx = math.sqrt(3) * hex_size
+    cx = col * dx + (row & 1) * (dx / 2)
+    orig_x = (cx / scale).astype(np.int64)
+    orig_x[(col < 0) | (orig_x < 0) | (orig_x >= src_w)] = -1
+    return row, orig_x
+
+
+def render_hex_band(img, template, y0, y1):
+    """Render output rows [y0, y1) of the hex map by sampling `img` at each hex centre."""
+    h, w = img.shape[:2]
+    row_t, orig_x_t = template
+    period = row_t.shape[0]
+    dy = 1.5 * hex_size
+
+    ys = np.arange(y0, y1)
+    phase = ys % period
+    row = row_t[phase] + 2 * (ys // period)[:, np.newaxis]
+    orig_x = orig_x_t[phase]
+
+    # Source row of every hex row touched by this band, -1 outside the map
+    first = int(row.min())
+    rows = np.arange(first, int(row.max()) + 1)
+    lut = (rows * dy / scale).astype(np.int64)
+    lut[(rows < 0) | (lut < 0) | (lut >= h)] = -1
+    orig_y = lut[row - first]
+
+    valid = (orig_x >= 0) & (orig_y >= 0)
+    flat = np.where(valid, orig_y * w + orig_x, 0)
+    band = img.reshape(-1, img.shape[2])[flat]
+    band[~valid] = 0
+    return band
+
+
+def iter_hex_bands(img, band_pixels=1 << 22):
+    """
+    Yield the hex map as horizontal bands of about `band_pixels` pixels,
+    so memory use depends on the band size and not on the output size.
+    """
+    h, w = img.shape[:2]
+    out_h = int(h * scale)
+    out_w = int(w * scale)
+    template = hex_template(out_w, w)
+    period = template[0].shape[0]
+    band_rows = max(1, band_pixels // out_w // period) * period
+    for y0 in range(0, out_h, band_rows):
+        yield render_hex_band(img, template, y0, min(out_h, y0 + band_rows))
+
+
+def _png_chunk(tag, payload):
+    return (struct.pack(">I", len(payload)) + tag + payload
+            + struct.pack(">I", zlib.crc32(tag + payload) & 0xffffffff))
+
+
+def write_png_bands(path, out_w, out_h, bands, level=6):
+    """Stream RGB bands into a PNG file without holding the whole image."""
+    compressor = zlib.compressobj(level)
+    with atomic_open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", out_w, out_h, 8, 2, 0, 0, 0)))
+        for band in bands:
+            rows = np.empty((band.shape[0], out_w * 3 + 1), dtype=np.uint8)
+            rows[:, 0] = 0  # filter type None
+            rows[:, 1:] = band.reshape(band.shape[0], -1)
+            data = compressor.compress(rows.tobytes())
+            if data:
+                f.write(_png_chunk(b"IDAT", data))
+        f.write(_png_chunk(b"IDAT", compressor.flush()))
+        f.write(_png_chunk(b"IEND", b""))
+
+
+def generate_hex_map(img, hex_path):
+    """Render the RGB terrain array `img` as a hexagon map PNG, band by band."""
+    img = np.ascontiguousarray(img)
+    h, w = img.shape[:2]
+    write_png_bands(hex_path, int(w * scale), int(h * scale), iter_hex_bands(img))
+
+
+# ----------------------------------------- #
+# Tile pyramid generation
+# ----------------------------------------- #
+# The custom CRS projects lat by dividing by the apothem, so the image overlay
+# bounds [[0, 0], [mapHeight * apothem, mapWidth]] become a square world of
+# map_width x map_height pixels at zoom 0, with y running from -map_height to 0.
+# Tile (z, x, y) covers pixels [x * 256, (x + 1) * 256) x [y * 256, (y + 1) * 256)
+# at scale 2^z, which is also what L.tileLayer requests.
+
+_worker_img = None
+
+
+def tile_range(zoom):
+    """Tile x and y index ranges covering the map at `zoom`."""
+    world_w = map_width * 2.0 ** zoom
+    world_h = map_height * 2.0 ** zoom
+    xs = range(0, math.ceil(world_w / tile_size))
+    ys = range(math.floor(-world_h / tile_size), 0)
+    return xs, ys
+
+
+def tile_path(folder, zoom, x, y):
+    return os.path.join(folder, str(zoom), str(x), str(y) + '.png')
+
+
+def sample_hex_map(img, us, vs):
+    """Colour of the hex map at hex-image pixel coordinates (us, vs), black outside the map."""
+    h, w = img.shape[:2]
+    dx = math.sqrt(3) * hex_size
+    dy = 1.5 * hex_size
+    row, col = hex_cells(us, vs)
+
+    orig_x = ((col * dx + (row & 1) * (dx / 2)) / scale).astype(np.int64)
+    orig_y = (row * dy / scale).astype(np.int64)
+    valid = (row >= 0) & (col >= 0) & (orig_x >= 0) & (orig_x < w) & (orig_y >= 0) & (orig_y < h)
+
+    flat = np.where(valid, orig_y * w + orig_x, 0)
+    out = img.reshape(-1, img.shape[2])[flat]
+    out[~valid] = 0
+    return out
+
+
+def tile_hex_coords(img, zoom, x, y):
+    """Hex-image pixel coordinates of the centres of tile (zoom, x, y)."""
+    h, w = img.shape[:2]
+    px_per_unit_x = w * scale / map_width
+    px_per_unit_y = h * scale / map_height
+    zoom_scale = 2.0 ** zoom
+
+    map_x = (x * tile_size + np.arange(tile_size) + 0.5) / zoom_scale
+    map_y = -(y * tile_size + np.arange(tile_size) + 0.5) / zoom_scale  # up from the bottom edge
+    us = (map_x * px_per_unit_x)[np.newaxis, :]
+    vs = ((map_height - map_y) * px_per_unit_y)[:, np.newaxis]
+    return us, vs
+
+
+def tile_source_hash(img, zoom, x, y):
+    """
+    Hash of the terrain pixels a tile at the render zoom can sample. A tile whose
+    hash is unchanged renders to the same image, so it does not need rewriting.
+    """
+    h, w = img.shape[:2]
+    us, vs = tile_hex_coords(img, zoom, x, y)
+    margin = 2 * hex_size  # hex centres lie within one hex of the pixel
+    c0 = max(0, int((us.min() - margin) / scale))
+    c1 = min(w, int((us.max() + margin) / scale) + 1)
+    r0 = max(0, int((vs.min() - margin) / scale))
+    r1 = min(h, int((vs.max() + margin) / scale) + 1)
+
+    digest = hashlib.sha1()
+    digest.update(json.dumps([hex_size, scale, tile_size, zoom, x, y, w, h]).encode())
+    if c0 < c1 and r0 < r1:
+        digest.update(np.ascontiguousarray(img[r0:r1, c0:c1]).tobytes())
+    return digest.hexdigest()
+
+
+def _init_tile_worker(img):
+    global _worker_img
+    _worker_img = img
+
+
+def _render_tile(job):
+    from PIL import Image
+    folder, zoom, x, y = job
+    us, vs = tile_hex_coords(_worker_img, zoom, x, y)
+    tile = sample_hex_map(_worker_img, us, vs)
+    path = tile_path(folder, zoom, x, y)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_open(path, 'wb') as file:
+        Image.fromarray(tile).save(file, format='PNG')
+
+
+def _downsample_tile(job):
+    from PIL import Image
+    folder, zoom, x, y = job
+    canvas = np.zeros((tile_size * 2, tile_size * 2, 3), dtype=np.uint16)
+    for i in range(2):
+        for j in range(2):
+            child = tile_path(folder, zoom + 1, 2 * x + j, 2 * y + i)
+            if os.path.exists(child):
+                canvas[i * tile_size:(i + 1) * tile_size, j * tile_size:(j + 1) * tile_size] = np.asarray(Image.open(child))
+    tile = (canvas.reshape(tile_size, 2, tile_size, 2, 3).sum(axis=(1, 3)) // 4).astype(np.uint8)
+    path = tile_path(folder, zoom, x, y)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_open(path, 'wb') as file:
+        Image.fromarray(tile).save(file, format='PNG')
+
+
+def generate_tiles(img, folder, zooms=(min_zoom, max_native_zoom), workers=None, source=None):
+    """
+    Write the hex map as a z/x/y tile pyramid. The highest zoom is rendered from
+    the terrain array, each lower zoom averages the four tiles below it.
+    Tile hashes are kept in a manifest and only tiles whose hash changed since
+    the previous run are rewritten. `source`, the sha256 of the terrain map, is
+    kept in the manifest too, written once every tile is.
+    """
+    img = np.ascontiguousarray(img)
+    low, high = zooms
+    manifest_path = os.path.join(folder, tiles_manifest_file)
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            previous = json.load(file).get('tiles', {})
+
+    hashes = {}
+    stale = {}
+    for zoom in range(high, low - 1, -1):
+        xs, ys = tile_range(zoom)
+        stale[zoom] = []
+        for x in xs:
+            for y in ys:
+                if zoom == high:
+                    tile_hash = tile_source_hash(img, zoom, x, y)
+                else:
+                    children = [hashes.get(f"{zoom + 1}/{2 * x + j}/{2 * y + i}", '') for i in range(2) for j in range(2)]
+                    tile_hash = hashlib.sha1('/'.join(children).encode()).hexdigest()
+                key = f"{zoom}/{x}/{y}"
+                hashes[key] = tile_hash
+                if previous.get(key) != tile_hash or not os.path.exists(tile_path(folder, zoom, x, y)):
+                    stale[zoom].append((folder, zoom, x, y))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_tile_worker, initargs=(img,)) as pool:
+        for zoom in range(high, low - 1, -1):
+            xs, ys = tile_range(zoom)
+            print(f"Zoom {zoom}: {len(stale[zoom])}/{len(xs) * len(ys)} tiles to write")
+            worker = _render_tile if zoom == high else _downsample_tile
+            with stage("z" + str(zoom), len(stale[zoom])):
+                list(pool.map(worker, stale[zoom], chunksize=16))
+
+    manifest = {
+        "tileSize": tile_size,
+        "minZoom": low,
+        "maxNativeZoom": high,
+        "mapWidth": map_width,
+        "mapHeight": map_height,
+        "source": source,
+        "tiles": hashes
+    }
+    os.makedirs(folder, exist_ok=True)
+    with atomic_open(manifest_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, separators=(',', ':'))
+
+
+def rendered_source(args):
+    """sha256 of the terrain map the current output was rendered from, None if unknown."""
+    if args.mode == "tiles":
+        path = os.path.join(args.tiles_dir, tiles_manifest_file)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+        # Other zooms are another output
+        if (manifest.get('minZoom'), manifest.get('maxNativeZoom')) != (args.min_zoom, args.max_zoom):
+            return None
+        return manifest.get('source')
+    path = data_folder + terrain_map_file_hexagon
+    if not os.path.exists(path) or not os.path.exists(path + source_suffix):
+        return None
+    with open(path + source_suffix, 'r', encoding='utf-8') as file:
+        return file.read().strip()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Download the terrain map and render it as PNG images or a tile pyramid")
+    ap.add_argument("--mode", choices=["png", "tiles"], default="png",
+                    help="Write one hex PNG (default) or a z/x/y tile pyramid")
+    ap.add_argument("--tiles-dir", default=tiles_folder, help="Output folder for --mode tiles")
+    ap.add_argument("--min-zoom", type=int, default=min_zoom)
+    ap.add_argument("--max-zoom", type=int, default=max_native_zoom,
+                    help="Highest zoom rendered from the terrain, lower zooms are downsampled")
+    ap.add_argument("--workers", type=int, default=None, help="Tile render processes (default: CPU count)")
+    ap.add_argument("--offline", action="store_true", help="Use the cached TerrainMap.gwm, no network")
+    ap.add_argument("--force", action="store_true", help="Render even if TerrainMap.gwm has not changed")
+    ap.add_argument("--keep-intermediate", action="store_true",
+                    help="Also write TerrainMap.gwm, TerrainMap.gwm.unc and TerrainMap.gwm.png to " + data_folder)
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    keep = args.keep_intermediate
+
+    with start_run("generate_terrain_map", args):
+        with stage("load"):
+            img_array, source = load_terrain_map(maps_url + terrain_map_file_raw, args.offline or None,
+                                                 rendered_source(args), force=args.force or keep,
+                                                 raw_path=data_folder + terrain_map_file_raw if keep else None,
+                                                 unzip_path=data_folder + terrain_map_file_unzip if keep else None)
+        if img_array is None:
+            print(terrain_map_file_raw + " has not changed since the output was rendered, nothing to do (--force to render anyway)")
+            return
+
+        img_array = upscale_nearest(img_array, scale_factor)
+        if keep:
+            with stage("png"):
+                save_terrain_png(img_array, data_folder + terrain_map_file_png)
+
+        if args.mode == "tiles":
+            with stage("tiles"):
+                generate_tiles(img_array, args.tiles_dir, (args.min_zoom, args.max_zoom), args.workers, source)
+        else:
+            output = data_folder + terrain_map_file_hexagon
+            with stage("hex"):
+                generate_hex_map(img_array, output)
+            # Written after the image, so a render that fails leaves the old sidecar
+            with atomic_open(output + source_suffix, 'w', encoding='utf-8') as file:
+                file.write(source + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Content-addressed HTTP cache shared by the fetch scripts (enemy_desc.json,
+bitjita crafts, TerrainMap.gwm, ...).
+
+Bodies are stored once per content under objects/<sha256[:2]>/<sha256>, and an
+SQLite index maps each URL to its body and to the ETag / Last-Modified the
+server sent with it. A later fetch of the URL revalidates with If-None-Match /
+If-Modified-Since, so unchanged upstream data costs one 304 instead of a full
+download. The least recently used entries are evicted once the bodies take
+more than max_bytes.
+
+Offline mode (offline=True, or BITCRAFTMAP_OFFLINE=1 in the environment) never
+touches the network and serves the cached bodies, so pipelines can be rerun and
+tested without access to the upstream servers.
+
+Usage:
+python scripts/http_cache.py --list
+python scripts/http_cache.py --max-bytes 500000000   # evict down to 500 MB
+python scripts/http_cache.py --clear
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from instrumentation import add_arguments, stage, start_run
+
+cache_folder = 'assets/data/http_cache/'
+cache_max_bytes = 1 << 30   # bodies kept on disk before the least recently used go
+offline_variable = 'BITCRAFTMAP_OFFLINE'
+chunk_size = 1 << 16
+
+
+class CacheMiss(LookupError):
+    """Offline fetch of a URL that is not in the cache."""
+
+
+def make_session(pool_size=8):
+    # Same pooling as build_roads.make_session. requests is only loaded once
+    # something is fetched, offline runs never import it
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class CachedResponse:
+    """
+    A cached body. `status` is 'downloaded', 'revalidated' (304) or 'cached'
+    (offline, or still fresh), `changed` tells whether the body differs from
+    the one cached before this fetch.
+    """
+
+    def __init__(self, url, path, sha256, size, status, changed):
+        self.url = url
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.status = status
+        self.changed = changed
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def content(self):
+        with self.open() as file:
+            return file.read()
+
+    def json(self):
+        with open(self.path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+
+class HttpCache:
+
+    def __init__(self, folder=cache_folder, max_bytes=cache_max_bytes, offline=None, session=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.offline = os.environ.get(offline_variable) == '1' if offline is None else offline
+        self.session = session
+        os.makedirs(os.path.join(folder, 'objects'), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(folder, 'index.sqlite'))
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            ' url TEXT PRIMARY KEY,'
+            ' sha256 TEXT NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' etag TEXT,'
+            ' last_modified TEXT,'
+            ' fetched_at REAL NOT NULL,'
+            ' used_at REAL NOT NULL)')
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+        if self.session is not None:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _blob_path(self, sha256):
+        return os.path.join(self.folder, 'objects', sha256[:2], sha256)
+
+    def _entry(self, url):
+        row = self.db.execute('SELECT sha256, size, etag, last_modified, fetched_at FROM entries WHERE url = ?',
+                              (url,)).fetchone()
+        # A body deleted by hand is as good as no entry
+        if row and not os.path.exists(self._blob_path(row[0])):
+            self.db.execute('DELETE FROM entries WHERE url = ?', (url,))
+            return None
+        return row
+
+    def _touch(self, url, fetched=False):
+        now = time.time()
+        if fetched:
+            self.db.execute('UPDATE entries SET fetched_at = ?, used_at = ? WHERE url = ?', (now, now, url))
+        else:
+            self.db.execute('UPDATE entries SET used_at = ? WHERE url = ?', (now, url))
+        self.db.commit()
+
+    def fetch(self, url, headers=None, timeout=120, max_age=0, on_chunk=None):
+        """
+        Body of `url`, from the cache when the server says it has not changed.
+        Within `max_age` seconds of the last check the server is not asked at all.
+        When the body is downloaded, on_chunk sees each chunk as it arrives, so
+        it can be processed while the download runs.
+        """
+        entry = self._entry(url)
+        if entry:
+            sha256, size, etag, last_modified, fetched_at = entry
+            if self.offline or time.time() - fetched_at < max_age:
+                self._touch(url)
+                return CachedResponse(url, self._blob_path(sha256), sha256, size, 'cached', False)
+        elif self.offline:
+            raise CacheMiss(url + ' is not cached and the cache is offline')
+
+        request_headers = dict(headers or {})
+        if entry and etag:
+            request_headers['If-None-Match'] = etag
+        if entry and last_modified:
+            request_headers['If-Modified-Since'] = last_modified
+
+        if self.session is None:
+            self.session = make_session()
+        with self.session.get(url, headers=request_headers, stream=True, timeout=timeout) as response:
+            if response.status_code == 304 and entry:
+                self._touch(url, fetched=True)
+                return CachedResponse(url, self._blob_path(sha256), sha256, size, 'revalidated', False)
+            response.raise_for_status()
+
+            # Stream to a temporary file next to the bodies, hashing on the way
+            digest = hashlib.sha256()
+            new_size = 0
+            fd, temp_path = tempfile.mkstemp(dir=os.path.join(self.folder, 'objects'))
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        digest.update(chunk)
+                        file.write(chunk)
+                        if on_chunk:
+                            on_chunk(chunk)
+                        new_size += len(chunk)
+                new_sha256 = digest.hexdigest()
+                path = self._blob_path(new_sha256)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+            now = time.time()
+            self.db.execute(
+                'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(url) DO UPDATE SET '
+                'sha256 = excluded.sha256, size = excluded.size, etag = excluded.etag, '
+                'last_modified = excluded.last_modified, fetched_at = excluded.fetched_at, used_at = excluded.used_at',
+                (url, new_sha256, new_size, response.headers.get('ETag'), response.headers.get('Last-Modified'), now, now))
+            if entry and entry[0] != new_sha256:
+                self._drop_unused_blob(entry[0])
+            self.db.commit()
+
+        self.evict(keep=url)
+        return CachedResponse(url, path, new_sha256, new_size, 'downloaded', not entry or entry[0] != new_sha256)
+
+    def _drop_unused_blob(self, sha256):
+        if not self.db.execute('SELECT 1 FROM entries WHERE sha256 = ?', (sha256,)).fetchone():
+            path = self._blob_path(sha256)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def total_bytes(self):
+        """Size of the distinct bodies on disk, shared bodies count once."""
+        return self.db.execute('SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT sha256, size FROM entries)').fetchone()[0]
+
+    def evict(self, keep=None, max_bytes=None):
+        """Drop the least recently used entries until the bodies fit in max_bytes."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        total = self.total_bytes()
+        evicted = 0
+        for url, sha256, size in self.db.execute('SELECT url, sha256, size FROM entries ORDER BY used_at').fetchall():
+            if total <= max_bytes:
+                break
+            if url == keep:
+                continue
+            self.db.execute('DELETE FROM entries WHERE url = ?', (url,))
+            if not self.db.execute('SELECT 1 FROM entries WHERE sha256 = ?', (sha256,)).fetchone():
+                total -= size
+                self._drop_unused_blob(sha256)
+            evicted += 1
+        self.db.commit()
+        return evicted
+
+    def entries(self):
+        return self.db.execute('SELECT url, sha256, size, etag, last_modified, fetched_at, used_at '
+                               'FROM entries ORDER BY used_at DESC').fetchall()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Inspect or trim the shared HTTP cache")
+    ap.add_argument("--folder", default=cache_folder)
+    ap.add_argument("--list", action="store_true", help="List the cached URLs, most recently used first")
+    ap.add_argument("--max-bytes", type=int, default=None, help="Evict least recently used entries down to this size")
+    ap.add_argument("--clear", action="store_true", help="Remove the whole cache")
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    if args.clear:
+        shutil.rmtree(args.folder, ignore_errors=True)
+        print('Removed ' + args.folder)
+        return
+
+    with start_run('http_cache', args), HttpCache(args.folder, offline=True) as cache:
+        if args.max_bytes is not None:
+            with stage('evict') as span:
+                span.items = cache.evict(max_bytes=args.max_bytes)
+            print('Evicted ' + str(span.items) + ' entries')
+        if args.list:
+            for url, sha256, size, etag, last_modified, fetched_at, used_at in cache.entries():
+                print(sha256[:12] + ' ' + str(size).rjust(12) + ' ' + time.strftime('%Y-%m-%d %H:%M', time.localtime(used_at)) + ' ' + url)
+        print(str(len(cache.entries())) + ' entries, ' + str(cache.total_bytes()) + ' bytes')
+
+
+if __name__ == "__main__":
+    main()
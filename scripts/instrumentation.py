@@ -0,0 +1,261 @@
+"""
+Stage timing and memory instrumentation shared by the pipeline scripts.
+
+A script starts a run and wraps its steps in stage spans:
+
+    with start_run('generate_claims_geojson', args):
+        with stage('crawl') as span:
+            ...
+            span.items = count
+
+Each span records wall and CPU time (child processes included once they have
+exited), the number of items it handled, the process RSS peak and, with memory
+tracing on, the tracemalloc peak inside the span. Spans nest, a span opened in
+another is named "outer/inner". stage() does nothing outside a run, so library
+functions (generate_roads.build_roads, ...) declare their stages whether their
+caller is instrumented or not.
+
+At the end of the run one line per stage is printed and, if asked, a JSON
+report is written. The options are the same for every script, as command line
+flags (add_arguments) or as environment variables:
+
+--report PATH / BITCRAFTMAP_REPORT=PATH     JSON report, a .jsonl file gets one run appended per line
+--trace-memory / BITCRAFTMAP_TRACE_MEMORY=1 tracemalloc peaks per stage, slows Python-heavy stages
+--profile STAGE / BITCRAFTMAP_PROFILE=STAGE cProfile that stage into <report or script>.<stage>.prof
+"""
+
+import cProfile
+import datetime
+import io
+import json
+import os
+import platform
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+    HAVE_RESOURCE = True
+except ImportError:  # Windows
+    HAVE_RESOURCE = False
+
+report_variable = 'BITCRAFTMAP_REPORT'
+trace_memory_variable = 'BITCRAFTMAP_TRACE_MEMORY'
+profile_variable = 'BITCRAFTMAP_PROFILE'
+profile_lines = 15   # functions printed from a stage profile
+
+_active = None
+
+
+def add_arguments(ap):
+    """Add --report, --trace-memory and --profile to a script's parser."""
+    group = ap.add_argument_group('instrumentation')
+    group.add_argument("--report", default=None, help="Write a JSON run report here (.jsonl appends)")
+    group.add_argument("--trace-memory", action="store_true", default=None, help="Record tracemalloc peaks per stage")
+    group.add_argument("--profile", default=None, metavar="STAGE", help="cProfile this stage")
+
+
+def _rss_peak_mb():
+    if not HAVE_RESOURCE:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def _child_cpu():
+    if not HAVE_RESOURCE:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Span:
+    """One stage of a run. Set `items` (or call add()) to record what it handled."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = None
+        self.traced_base = None
+        self.traced_peak = 0
+
+    def add(self, count=1):
+        self.items = (self.items or 0) + count
+
+
+class _NullSpan(Span):
+    """What stage() yields outside a run, takes counts and records nothing."""
+
+
+class Run:
+
+    def __init__(self, script, report=None, trace_memory=False, profile=None):
+        self.script = script
+        self.report_path = report
+        self.trace_memory = trace_memory
+        self.profile_stage = profile
+        self.profiler = cProfile.Profile() if profile else None
+        self.stages = []
+        self.extra = {}
+        self._open = []
+        self._finished = False
+        self.started = datetime.datetime.now().astimezone()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._child_cpu = _child_cpu()
+        if trace_memory:
+            tracemalloc.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(None if exc is None else exc_type.__name__ + ': ' + str(exc))
+        return False
+
+    def _fold_traced_peak(self):
+        # The tracemalloc peak is global, hand it to every open span before it is reset
+        peak = tracemalloc.get_traced_memory()[1]
+        for span in self._open:
+            span.traced_peak = max(span.traced_peak, peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name, items=None):
+        span = Span('/'.join([s.name for s in self._open] + [name]))
+        span.items = items
+        if self.trace_memory:
+            self._fold_traced_peak()
+            span.traced_base = tracemalloc.get_traced_memory()[0]
+        self._open.append(span)
+        profiled = self.profiler is not None and self.profile_stage in (name, span.name)
+        wall, cpu, child_cpu = time.perf_counter(), time.process_time(), _child_cpu()
+        if profiled:
+            self.profiler.enable()
+        try:
+            yield span
+        finally:
+            if profiled:
+                self.profiler.disable()
+            record = {
+                'name': span.name,
+                'wall_s': round(time.perf_counter() - wall, 4),
+                'cpu_s': round(time.process_time() - cpu, 4),
+                'child_cpu_s': round(_child_cpu() - child_cpu, 4),
+                'items': span.items,
+                'rss_peak_mb': _rss_peak_mb(),
+            }
+            if self.trace_memory:
+                self._fold_traced_peak()
+                record['traced_peak_mb'] = round((span.traced_peak - span.traced_base) / (1 << 20), 2)
+            self._open.pop()
+            self.stages.append(record)
+
+    def report(self, error=None):
+        return {
+            'script': self.script,
+            'argv': sys.argv[1:],
+            'started': self.started.isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'wall_s': round(time.perf_counter() - self._wall, 4),
+            'cpu_s': round(time.process_time() - self._cpu, 4),
+            'child_cpu_s': round(_child_cpu() - self._child_cpu, 4),
+            'rss_peak_mb': _rss_peak_mb(),
+            'trace_memory': self.trace_memory,
+            'error': error,
+            'stages': self.stages,
+            'extra': self.extra,
+        }
+
+    def summary(self):
+        peak = 'traced_peak_mb' if self.trace_memory else 'rss_peak_mb'
+        lines = ['stage'.ljust(28) + '  wall s'.rjust(10) + '  cpu s'.rjust(10) + '  items'.rjust(10)
+                 + ('  traced MB' if self.trace_memory else '  RSS MB').rjust(12)]
+        for record in self.stages:
+            lines.append(record['name'][:28].ljust(28)
+                         + f"{record['wall_s']:10.2f}"
+                         + f"{record['cpu_s'] + record['child_cpu_s']:10.2f}"
+                         + ('' if record['items'] is None else str(record['items'])).rjust(10)
+                         + ('' if record[peak] is None else f"{record[peak]:.1f}").rjust(12))
+        return '\n'.join(lines)
+
+    def finish(self, error=None):
+        """Print the stages, write the report and the profile. Only the first call counts."""
+        global _active
+        if self._finished:
+            return
+        self._finished = True
+        report = self.report(error)
+        if self.trace_memory:
+            tracemalloc.stop()
+        if _active is self:
+            _active = None
+
+        if self.stages:
+            print(self.summary())
+        if self.profiler is not None:
+            self._write_profile()
+        if self.report_path:
+            folder = os.path.dirname(self.report_path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            if self.report_path.endswith('.jsonl'):
+                with open(self.report_path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(report, separators=(',', ':')) + '\n')
+            else:
+                with open(self.report_path, 'w', encoding='utf-8') as file:
+                    json.dump(report, file, indent=2)
+            print('Wrote the run report to ' + self.report_path)
+        print('Finished after ' + str(report['wall_s']) + ' seconds')
+
+    def _write_profile(self):
+        stem = os.path.splitext(self.report_path)[0] if self.report_path else self.script
+        path = stem + '.' + self.profile_stage.replace('/', '_') + '.prof'
+        try:
+            stats = pstats.Stats(self.profiler)
+        except TypeError:
+            print('Stage ' + self.profile_stage + ' never ran, no profile written')
+            return
+        stats.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(profile_lines)
+        print(out.getvalue().rstrip())
+        print('Wrote the ' + self.profile_stage + ' profile to ' + path)
+
+
+def start_run(script, args=None):
+    """
+    Start the run of `script` and make it the one stage() records into. Options
+    come from the add_arguments() flags in `args`, else from the environment.
+    """
+    global _active
+
+    def option(name, variable):
+        value = getattr(args, name, None)
+        return value if value is not None else os.environ.get(variable) or None
+
+    _active = Run(script,
+                  report=option('report', report_variable),
+                  trace_memory=bool(option('trace_memory', trace_memory_variable) not in (None, False, '0')),
+                  profile=option('profile', profile_variable))
+    return _active
+
+
+@contextmanager
+def stage(name, items=None):
+    """A stage span of the active run, or a span that records nothing outside a run."""
+    if _active is None:
+        yield _NullSpan(name)
+        return
+    with _active.stage(name, items) as span:
+        yield span
+
+
+def note(key, value):
+    """Attach extra data (per-region timings, counts, ...) to the active run's report."""
+    if _active is not None:
+        _active.extra[key] = value
@@ -0,0 +1,217 @@
+"""
+The map's coordinate systems in one place, batched with numpy.
+
+World coordinates are the [x, z] of the game, stored as GeoJSON [x, y]. From
+them:
+
+- display    the N / E the game shows, world / 3 rounded (N from z, E from x)
+- chunks     240 x 240 chunks of 96 units, chunk id = cy * 240 + cx
+- regions    3 x 3 regions of 7680 units, region id = ry * 3 + rx, index of region_names
+- pixels     the custom CRS of assets/js/config.js: (x, -y / apothem) * 2^zoom
+- tiles      z/x/y of 256 pixel tiles at a zoom, as L.tileLayer numbers them
+- hexes      pointy-top axial (q, r) and odd-r offset (row, col) of hexes of a given size
+- lattice    the staggered points of generate_roads.py: row j at y = j, x = i -+ 0.25
+
+The batched functions take scalars or arrays of any shape (lists too) and
+return arrays, so millions of points convert in one call. Ids and indices are
+int64, -1 where a point is off the map. partition() groups points by any of
+these keys with one sort.
+
+numpy is imported by the batched functions only. The constants, display_point()
+and region_label_points() are plain Python, so scripts that convert one point
+at a time (jobs, grids) start without numpy.
+"""
+
+import math
+
+map_width = 23040       # world units, see assets/js/config.js
+map_height = 23040      # world units
+chunk_size = 96         # world units per chunk edge
+chunk_cols = map_width // chunk_size    # 240
+chunk_rows = map_height // chunk_size   # 240
+region_cols = 3
+region_rows = 3
+region_size = map_width // region_cols  # 7680 world units
+display_scale = 3       # world units per displayed N / E unit
+apothem = 2 / math.sqrt(3)  # CRS y scale
+tile_size = 256         # tile edge in pixels
+
+# By region id, from the lower left (region 0) to the upper right (region 8)
+region_names = ['Calenthyr', 'Oruvale', 'Veltrassa',
+                'Solvenar', 'Marundel', 'Tessavar',
+                'Elyvarin', 'Draxionne', 'Zepharel']
+
+
+def _floats(*values):
+    import numpy as np
+    return [np.asarray(v, dtype=np.float64) for v in values]
+
+
+def _on_map(x, y):
+    return (x >= 0) & (x < map_width) & (y >= 0) & (y < map_height)
+
+
+# ---------- Display ----------
+def display_point(x, z):
+    """(n, e) ints the game shows for one world [x, z], same rounding as display_coords()."""
+    return round(z / display_scale), round(x / display_scale)
+
+
+def display_coords(x, z):
+    """(n, e) the game shows for world [x, z]."""
+    import numpy as np
+    x, z = _floats(x, z)
+    return np.rint(z / display_scale).astype(np.int64), np.rint(x / display_scale).astype(np.int64)
+
+
+def world_coords(n, e):
+    """World [x, z] of displayed (n, e), the centre of that display unit."""
+    n, e = _floats(n, e)
+    return e * display_scale, n * display_scale
+
+
+# ---------- Chunks and regions ----------
+def chunk_coords(x, y):
+    """Chunk column and row of each point (not clipped to the map)."""
+    import numpy as np
+    x, y = _floats(x, y)
+    return np.floor(x / chunk_size).astype(np.int64), np.floor(y / chunk_size).astype(np.int64)
+
+
+def chunk_ids(x, y):
+    """Chunk id of each point, -1 off the map."""
+    import numpy as np
+    x, y = _floats(x, y)
+    cx, cy = chunk_coords(x, y)
+    return np.where(_on_map(x, y), cy * chunk_cols + cx, -1)
+
+
+def region_coords(x, y):
+    """Region column and row of each point (not clipped to the map)."""
+    import numpy as np
+    x, y = _floats(x, y)
+    return np.floor(x / region_size).astype(np.int64), np.floor(y / region_size).astype(np.int64)
+
+
+def region_ids(x, y):
+    """Region id of each point, -1 off the map."""
+    import numpy as np
+    x, y = _floats(x, y)
+    rx, ry = region_coords(x, y)
+    return np.where(_on_map(x, y), ry * region_cols + rx, -1)
+
+
+def region_label_points():
+    """[x, y] where each region's name is shown on the map: middle of its top edge, by region id."""
+    return [[(rx * 2 + 1) * region_size // 2, (ry + 1) * region_size]
+            for ry in range(region_rows) for rx in range(region_cols)]
+
+
+# ---------- Pixels and tiles ----------
+def to_pixels(x, y, zoom=0):
+    """Map pixel of each point at `zoom`, y is negative on the map."""
+    x, y = _floats(x, y)
+    scale = 2.0 ** zoom
+    return x * scale, -y / apothem * scale
+
+
+def from_pixels(px, py, zoom=0):
+    """Inverse of to_pixels()."""
+    px, py = _floats(px, py)
+    scale = 2.0 ** zoom
+    return px / scale, -py * apothem / scale
+
+
+def tile_coords(x, y, zoom):
+    """Tile x and y of each point at `zoom`."""
+    import numpy as np
+    x, y = _floats(x, y)
+    scale = 2.0 ** zoom / tile_size
+    return np.floor(x * scale).astype(np.int64), np.floor(-y / apothem * scale).astype(np.int64)
+
+
+# ---------- Hexes ----------
+def hex_axial(x, y, size):
+    """
+    Axial (q, r) of the pointy-top hex of circumradius `size` containing each
+    point, hex (0, 0) centred on the origin. Cube rounding, so points are
+    assigned to the nearest centre.
+    """
+    import numpy as np
+    x, y = _floats(x, y)
+    q = (math.sqrt(3) / 3 * x - y / 3) / size
+    r = (2 / 3 * y) / size
+    s = -q - r
+
+    rq, rr, rs = np.rint(q), np.rint(r), np.rint(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+
+def hex_centers(q, r, size):
+    """Centre [x, y] of axial hexes (q, r) of circumradius `size`."""
+    q, r = _floats(q, r)
+    return size * math.sqrt(3) * (q + r / 2), size * 1.5 * r
+
+
+def axial_to_offset(q, r):
+    """Odd-r offset (row, col): rows are r, odd rows are shifted half a hex right."""
+    import numpy as np
+    q, r = np.asarray(q, dtype=np.int64), np.asarray(r, dtype=np.int64)
+    return r, q + (r - (r & 1)) // 2
+
+
+def offset_to_axial(row, col):
+    """Inverse of axial_to_offset()."""
+    import numpy as np
+    row, col = np.asarray(row, dtype=np.int64), np.asarray(col, dtype=np.int64)
+    return col - (row - (row & 1)) // 2, row
+
+
+# ---------- Staggered lattice ----------
+def row_shift(j):
+    """x shift of lattice row j: -0.25 on even rows, +0.25 on odd rows."""
+    import numpy as np
+    return np.where(np.asarray(j, dtype=np.int64) % 2 == 1, 0.25, -0.25)
+
+
+def stagger(x, y):
+    """Points with integer rows y moved onto the lattice, odd rows half a unit right of even ones."""
+    import numpy as np
+    x, y = _floats(x, y)
+    return x + row_shift(np.rint(y)), y
+
+
+def lattice_coords(x, y, eps=1e-9):
+    """(i, j) lattice indices of staggered points, or None if any point is off the lattice."""
+    import numpy as np
+    x, y = _floats(x, y)
+    j = np.rint(y)
+    unshifted = x - row_shift(j)
+    i = np.rint(unshifted)
+    if not (np.allclose(y, j, atol=eps) and np.allclose(unshifted, i, atol=eps)):
+        return None
+    return i.astype(np.int64), j.astype(np.int64)
+
+
+# ---------- Grouping ----------
+def partition(*keys):
+    """
+    Group points by one or more integer key arrays (chunk ids, tile x and y, ...)
+    with one sort. Yields (key, indices) in key order, key a tuple of ints and
+    indices in input order within each group.
+    """
+    import numpy as np
+    keys = [np.asarray(k).reshape(-1) for k in keys]
+    if not keys or not len(keys[0]):
+        return
+    # lexsort sorts by its last key first and is stable
+    order = np.lexsort(keys[::-1])
+    stacked = np.stack([k[order] for k in keys], axis=1)
+    starts = np.flatnonzero(np.any(np.diff(stacked, axis=0) != 0, axis=1)) + 1
+    for group in np.split(order, starts):
+        yield tuple(int(k[group[0]]) for k in keys), group
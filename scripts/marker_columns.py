@@ -0,0 +1,243 @@
+"""
+Compact columnar binary form of the point marker layers (claims, caves, ...).
+
+A file is an 8 byte magic, a little-endian u32 header length, a JSON header and
+then one 8-byte aligned block per column, so every block can be viewed in place
+as a typed array, by numpy here (memory-mapped) or by library.js in the browser:
+
+- geometry: the point coordinates, x and y interleaved, int32 when they are all
+  integers that fit, float64 otherwise
+- int / bool / float properties: the smallest numpy dtype that holds them
+- string properties: indices into a table of the distinct strings, stored as
+  u32 offsets followed by the UTF-8 bytes
+- decimal properties: strings that are plain unsigned integers (claim entityId)
+  are stored as u64 and come back as the same strings
+
+Every feature must be a Point with the same property keys. Files go next to the
+GeoJSON with a .bin extension.
+
+Usage:
+python scripts/marker_columns.py assets/markers/claims.geojson assets/markers/caves.geojson
+python scripts/marker_columns.py --check assets/markers/claims.geojson
+"""
+
+import argparse
+import json
+import mmap
+import os
+import re
+
+import numpy as np
+
+from atomic_files import atomic_open
+from instrumentation import add_arguments, stage, start_run
+
+MAGIC = b'BCMARKS1'
+ALIGN = 8
+INT_DTYPES = ['<u1', '<i1', '<u2', '<i2', '<u4', '<i4', '<u8', '<i8']
+DECIMAL = re.compile(r'0|[1-9][0-9]*')
+
+
+def columns_path(geojson_path):
+    """assets/markers/claims.geojson -> assets/markers/claims.bin"""
+    stem, dot, _ = geojson_path.rpartition('.')
+    return stem + '.bin' if dot else geojson_path + '.bin'
+
+
+def _int_dtype(values):
+    low, high = min(values, default=0), max(values, default=0)
+    for dtype in INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    raise ValueError('Integers out of the 64 bit range')
+
+
+def _encode_column(name, values):
+    """(header entry without offsets, [blocks]) for one property column."""
+    if all(isinstance(v, bool) for v in values):
+        return {'name': name, 'kind': 'bool', 'dtype': '<u1'}, [np.asarray(values, dtype='<u1')]
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        dtype = _int_dtype(values)
+        return {'name': name, 'kind': 'int', 'dtype': dtype}, [np.asarray(values, dtype=dtype)]
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return {'name': name, 'kind': 'float', 'dtype': '<f8'}, [np.asarray(values, dtype='<f8')]
+    if all(isinstance(v, str) for v in values):
+        if all(DECIMAL.fullmatch(v) and int(v) < 2**64 for v in values):
+            return {'name': name, 'kind': 'decimal', 'dtype': '<u8'}, [np.asarray([int(v) for v in values], dtype='<u8')]
+        table = {}
+        index = [table.setdefault(v, len(table)) for v in values]
+        encoded = [s.encode('utf-8') for s in table]
+        offsets = np.concatenate([[0], np.cumsum([len(s) for s in encoded], dtype=np.int64)]).astype('<u4')
+        dtype = _int_dtype([len(table)])
+        entry = {'name': name, 'kind': 'string', 'dtype': dtype, 'strings': len(table)}
+        return entry, [np.asarray(index, dtype=dtype), offsets, np.frombuffer(b''.join(encoded), dtype='u1')]
+    raise ValueError('Property ' + repr(name) + ' mixes types or holds values that are not numbers or strings')
+
+
+def encode_marker_columns(geojson):
+    """
+    FeatureCollection, bare list of features (like caves.geojson) or any iterable
+    of features (written as a FeatureCollection) -> bytes. Features are read once,
+    only their values are kept.
+    """
+    collection = not isinstance(geojson, list)
+    features = geojson['features'] if isinstance(geojson, dict) else geojson
+    keys = None
+    coordinates = []
+    values = {}
+    count = 0
+    for feature in features:
+        if feature['geometry']['type'] != 'Point':
+            raise ValueError('Only Point features can be stored in columns')
+        if keys is None:
+            keys = list(feature['properties'])
+            values = {key: [] for key in keys}
+        elif list(feature['properties']) != keys:
+            raise ValueError('Every feature needs the same property keys, in the same order')
+        coordinates.extend(feature['geometry']['coordinates'][:2])
+        for key, value in feature['properties'].items():
+            values[key].append(value)
+        count += 1
+
+    if all(isinstance(c, int) for c in coordinates) and -2**31 <= min(coordinates, default=0) and max(coordinates, default=0) < 2**31:
+        geometry = np.asarray(coordinates, dtype='<i4')
+    else:
+        geometry = np.asarray(coordinates, dtype='<f8')
+
+    header = {'count': count, 'collection': collection, 'geometry': {'dtype': geometry.dtype.str}, 'columns': []}
+    blocks = [geometry]
+    slots = [header['geometry']]
+    for key in keys or []:
+        entry, column_blocks = _encode_column(key, values[key])
+        header['columns'].append(entry)
+        blocks.extend(column_blocks)
+        slots.append(entry)
+        if entry['kind'] == 'string':
+            slots.extend([(entry, 'offsets'), (entry, 'data')])
+
+    # Lay the blocks out one after the other, each aligned
+    offset = 0
+    for slot, block in zip(slots, blocks):
+        if isinstance(slot, tuple):
+            slot[0][slot[1]] = offset
+        else:
+            slot['offset'] = offset
+        offset += -(-block.nbytes // ALIGN) * ALIGN
+
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    start = len(MAGIC) + 4 + len(header_bytes)
+    out = bytearray(MAGIC + np.uint32(len(header_bytes)).astype('<u4').tobytes() + header_bytes)
+    out += bytes(-start % ALIGN)
+    for block in blocks:
+        data = block.tobytes()
+        out += data + bytes(-len(data) % ALIGN)
+    return bytes(out)
+
+
+def write_marker_columns(geojson, path):
+    with atomic_open(path, 'wb') as file:
+        file.write(encode_marker_columns(geojson))
+
+
+class MarkerColumns:
+    """Columns of a marker file as numpy views over `buffer` (bytes or a memory map)."""
+
+    def __init__(self, buffer):
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError('Not a marker columns file')
+        header_length = int(np.frombuffer(buffer, dtype='<u4', count=1, offset=len(MAGIC))[0])
+        start = len(MAGIC) + 4
+        self.header = json.loads(bytes(buffer[start:start + header_length]).decode('utf-8'))
+        self.buffer = buffer
+        self.data_start = -(-(start + header_length) // ALIGN) * ALIGN
+        self.count = self.header['count']
+        geometry = self.header['geometry']
+        self.xy = self._view(geometry['dtype'], geometry['offset'], 2 * self.count).reshape(-1, 2)
+        self.names = [entry['name'] for entry in self.header['columns']]
+
+    def _view(self, dtype, offset, count):
+        return np.frombuffer(self.buffer, dtype=dtype, count=count, offset=self.data_start + offset)
+
+    def raw(self, name):
+        """The stored array of a column, string indices for string columns."""
+        entry = self.header['columns'][self.names.index(name)]
+        return self._view(entry['dtype'], entry['offset'], self.count)
+
+    def strings(self, name):
+        """The string table of a string column."""
+        entry = self.header['columns'][self.names.index(name)]
+        offsets = self._view('<u4', entry['offsets'], entry['strings'] + 1)
+        data = bytes(self._view('u1', entry['data'], int(offsets[-1])))
+        return [data[a:b].decode('utf-8') for a, b in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+    def column(self, name):
+        """A column as Python values, like the GeoJSON properties."""
+        kind = self.header['columns'][self.names.index(name)]['kind']
+        values = self.raw(name)
+        if kind == 'string':
+            table = self.strings(name)
+            return [table[i] for i in values.tolist()]
+        if kind == 'decimal':
+            return [str(v) for v in values.tolist()]
+        if kind == 'bool':
+            return [bool(v) for v in values.tolist()]
+        return values.tolist()
+
+    def features(self):
+        columns = [self.column(name) for name in self.names]
+        for k, (x, y) in enumerate(self.xy.tolist()):
+            yield {
+                "type": "Feature",
+                "properties": {name: column[k] for name, column in zip(self.names, columns)},
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [x, y]
+                }
+            }
+
+    def to_geojson(self):
+        features = list(self.features())
+        return {"type": "FeatureCollection", "features": features} if self.header['collection'] else features
+
+
+def read_marker_columns(path):
+    """Memory-map a marker columns file, nothing is parsed beyond the header."""
+    with open(path, 'rb') as file:
+        return MarkerColumns(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Write the columnar .bin next to marker GeoJSON files")
+    ap.add_argument("inputs", nargs="+", help="GeoJSON marker layers")
+    ap.add_argument("--check", action="store_true", help="Only check that each file round-trips, write nothing")
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    failed = False
+    with start_run('marker_columns', args):
+        for path in args.inputs:
+            with open(path, 'r', encoding='utf-8') as file:
+                geojson = json.load(file)
+            try:
+                with stage(os.path.basename(path)):
+                    data = encode_marker_columns(geojson)
+            except ValueError as e:
+                print(path + ': ' + str(e))
+                failed = True
+                continue
+            same = MarkerColumns(data).to_geojson() == geojson
+            failed |= not same
+            if args.check or not same:
+                print(path + (': round-trips' if same else ': DIFFERS after a round trip') + ' in ' + str(len(data)) + ' bytes')
+            else:
+                # map.js prefers the .bin, a truncated one would break the layer instead of falling back
+                with atomic_open(columns_path(path), 'wb') as file:
+                    file.write(data)
+                print('Wrote ' + columns_path(path) + ' (' + str(len(data)) + ' bytes)')
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
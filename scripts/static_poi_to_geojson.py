@@ -1,108 +1,115 @@
+import argparse
 import json
-
-def generate_caves_geojson(json_key):
-
-    ore_tiers = {
-       1: 'Ferralith',
-       2: 'Pyrelite',
-       3: 'Emarium',
-       4: 'Elenvar',
-       5: 'Luminite',
-       6: 'Rathium',
-       7: 'Aurumite',
-       8: 'Celestium',
-       9: 'Umbracite',
-       10: 'Astralite'
-    }
-        
-    if 'Cave' not in json_key['name']:
-        return None
-    
-    size = 2 if 'Large' in json_key['name'] else 1
-
-    for tier_id, tier_name in ore_tiers.items():
-        if tier_name in json_key['name']:
-            tier = tier_id
-            break
-
-    return {
-        "type": "Feature",
-        "properties": {
-            "name": json_key['name'],
-            "size": size,
-            "tier": tier
-        },
-        "geometry": {
-            "type": "Point",
-            "coordinates": [json_key['location']['x'], json_key['location']['z']]
-        }
-    }
-
-def generate_trees_geojson(json_key):
-    if 'Tree' not in json_key['name']: 
-        return None
-
-    return {
-        "type": "Feature",
-        "properties": {
-            "name": json_key['name'],
-        },
-        "geometry": {
-            "type": "Point",
-            "coordinates": [json_key['location']['x'], json_key['location']['z']]
+import os
+import re
+from contextlib import ExitStack
+
+from atomic_files import atomic_open
+from instrumentation import add_arguments, stage, start_run
+from marker_columns import write_marker_columns
+
+poi_json_file = 'assets/data/caves.json'
+markers_folder = 'assets/markers/'
+
+ore_tiers = {
+    'Ferralith': 1,
+    'Pyrelite': 2,
+    'Emarium': 3,
+    'Elenvar': 4,
+    'Luminite': 5,
+    'Rathium': 6,
+    'Aurumite': 7,
+    'Celestium': 8,
+    'Umbracite': 9,
+    'Astralite': 10
+}
+
+# Output layer -> pattern found in the names of its POIs, all compiled into one
+# regex so each name is scanned once. The leftmost match wins. Names matching
+# none are ruined cities, they have non descriptive names
+poi_patterns = {
+    'caves': r'(?:(?P<large>Large) )?(?:(?P<ore>' + '|'.join(ore_tiers) + r') )?Cave',
+    'trees': r'Tree',
+    'temples': r'Temple',
+}
+poi_regex = re.compile('|'.join('(?P<' + layer + '>' + pattern + ')' for layer, pattern in poi_patterns.items()))
+layers = list(poi_patterns) + ['ruined']
+
+
+def classify_poi(json_key):
+    """(layer, feature) of one entry of caves.json."""
+    name = json_key['name']
+    match = poi_regex.search(name)
+    layer = match.lastgroup if match else 'ruined'
+
+    if layer == 'caves':
+        if match['ore'] is None:
+            raise ValueError('No known ore in cave name ' + repr(name))
+        properties = {
+            "name": name,
+            "size": 2 if match['large'] else 1,
+            "tier": ore_tiers[match['ore']]
         }
-    }
-
-def generate_temples_geojson(json_key):
-    if 'Temple' not in json_key['name']:
-        return None
-
-    return {
-        "type": "Feature",
-        "properties": {
-            "name": json_key['name']
-        },
-        "geometry": {
-            "type": "Point",
-            "coordinates": [json_key['location']['x'], json_key['location']['z']]
-        }
-    }
+    else:
+        properties = {"name": name}
 
-def generate_ruined_geojson(json_key):
-    # Ruined cities have non descriptive names
-    if any(keyword in json_key['name'] for keyword in ['Tree', 'Cave', 'Temple']):
-        return None
-
-    return {
+    return layer, {
         "type": "Feature",
-        "properties": {
-            "name": json_key['name'],
-        },
+        "properties": properties,
         "geometry": {
             "type": "Point",
             "coordinates": [json_key['location']['x'], json_key['location']['z']]
         }
     }
 
-# Load data from caves.json
-with open('assets/data/caves.json', 'r', encoding='utf-8') as file:
-    data = json.load(file)
-
-print(data)
-
-# Parse and save date to respective geojson files
-with open('assets/markers/caves.geojson', 'w') as file:
-    caves_json = [generate_caves_geojson(key) for key in data if generate_caves_geojson(key) is not None]
-    json.dump(caves_json, file)
-
-with open('assets/markers/trees.geojson', 'w') as file:
-    trees_json = [generate_trees_geojson(key) for key in data if generate_trees_geojson(key) is not None]
-    json.dump(trees_json, file)
-
-with open('assets/markers/ruined.geojson', 'w') as file:
-    ruined_json = [generate_ruined_geojson(key) for key in data if generate_ruined_geojson(key) is not None]
-    json.dump(ruined_json, file)
 
-with open('assets/markers/temples.geojson', 'w') as file:
-    temples_json = [generate_temples_geojson(key) for key in data if generate_temples_geojson(key) is not None]
-    json.dump(temples_json, file)
\ No newline at end of file
+def write_poi_layers(data, folder):
+    """
+    Classify every POI once and stream it to its layer file, all layers being
+    written side by side. Returns the cave features, kept for caves.bin, and
+    the count of each layer.
+    """
+    counts = dict.fromkeys(layers, 0)
+    caves = []
+    with ExitStack() as stack:
+        files = {layer: stack.enter_context(atomic_open(os.path.join(folder, layer + '.geojson'), 'w'))
+                 for layer in layers}
+        for file in files.values():
+            file.write('[')
+        for json_key in data:
+            layer, feature = classify_poi(json_key)
+            if counts[layer]:
+                files[layer].write(', ')
+            files[layer].write(json.dumps(feature))
+            counts[layer] += 1
+            if layer == 'caves':
+                caves.append(feature)
+        for file in files.values():
+            file.write(']')
+    return caves, counts
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Split the static POIs of caves.json into caves, trees, temples and ruined cities")
+    ap.add_argument("--input", default=poi_json_file)
+    ap.add_argument("--markers-dir", default=markers_folder)
+    add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    with start_run('static_poi_to_geojson', args):
+        # Load data from caves.json
+        with stage('load') as span:
+            with open(args.input, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            span.items = len(data)
+
+        with stage('classify', len(data)):
+            caves, counts = write_poi_layers(data, args.markers_dir)
+        with stage('columns', len(caves)):
+            write_marker_columns(caves, os.path.join(args.markers_dir, 'caves.bin'))
+
+        print(', '.join(str(count) + ' ' + layer for layer, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import json
+
+import numpy as np
+import pytest
+
+from generate_roads import _drop_collinear_coords, build_roads, road_levels, simplify_coords
+
+
+def test_square_keeps_its_corners():
+    # [2, 0] twice, as rounding to 2 decimals leaves it
+    coords = [[[[0, 0], [1, 0], [2, 0], [2, 0], [2, 2], [0, 2], [0, 0]]]]
+    assert simplify_coords(coords, 0.0) == [[[[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]]]]
+
+
+def test_degenerate_rings_are_not_written():
+    square = [[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]]
+    flat_hole = [[1, 1], [2, 1], [3, 1], [1, 1]]
+    point = [[5, 5], [5, 5], [5, 5], [5, 5]]
+    coords = [[square, flat_hole], [point], [[[6, 6], [7, 7], [6, 6]], square]]
+
+    out = _drop_collinear_coords(coords)
+    assert out == [[[[float(x), float(y)] for x, y in square]]]
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_per_point_roads_are_valid(seed):
+    shape = pytest.importorskip('shapely.geometry').shape
+    rng = np.random.default_rng(seed)
+    points = {(int(x), int(y)) for x, y in rng.integers(0, 60, (300, 2))}
+    fc, _ = build_roads(json.dumps([list(p) for p in points]))
+
+    layers = [fc] + list(road_levels(fc, [-3, -1]).values())
+    for layer in layers:
+        geometry = layer['features'][0]['geometry']
+        assert shape(geometry).is_valid
+        for polygon in geometry['coordinates']:
+            for ring in polygon:
+                assert len(ring) >= 4 and ring[0] == ring[-1]
+                assert all(a != b for a, b in zip(ring, ring[1:]))
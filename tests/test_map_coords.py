@@ -0,0 +1,144 @@
+import numpy as np
+import pytest
+
+import map_coords
+from map_coords import (axial_to_offset, chunk_ids, display_coords, display_point, from_pixels, hex_axial,
+                        hex_centers, lattice_coords, offset_to_axial, partition, region_ids, stagger, to_pixels,
+                        world_coords)
+
+points = 100_000
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(20240)
+
+
+def world_points(rng, margin=500.0):
+    """Points over the map and a margin around it, a few exactly on its edges."""
+    xy = rng.uniform(-margin, map_coords.map_width + margin, (points, 2))
+    xy[:8] = [[0, 0], [map_coords.map_width, 0], [0, map_coords.map_height], [-1e-9, 5],
+              [map_coords.map_width - 1e-9, 5], [5, map_coords.map_height - 1e-9], [23039.5, 23039.5], [-0.0, -0.0]]
+    return xy[:, 0], xy[:, 1]
+
+
+@pytest.mark.parametrize('size', [0.6, 1.0, 6.0, 96.0])
+def test_hex_centre_is_in_its_own_hex(rng, size):
+    q = rng.integers(-10_000, 10_000, points)
+    r = rng.integers(-10_000, 10_000, points)
+    got_q, got_r = hex_axial(*hex_centers(q, r, size), size)
+    assert np.array_equal(got_q, q) and np.array_equal(got_r, r)
+
+
+def test_points_go_to_the_nearest_hex_centre(rng):
+    x, y = rng.uniform(-1000, 1000, (2, points))
+    cx, cy = hex_centers(*hex_axial(x, y, 6.0), 6.0)
+    # Nothing is further than the circumradius from its centre
+    assert np.all(np.hypot(cx - x, cy - y) <= 6.0 + 1e-9)
+
+
+def test_offset_round_trip(rng):
+    q = rng.integers(-1_000_000, 1_000_000, points)
+    r = rng.integers(-1_000_000, 1_000_000, points)
+    got_q, got_r = offset_to_axial(*axial_to_offset(q, r))
+    assert np.array_equal(got_q, q) and np.array_equal(got_r, r)
+
+
+def test_offset_rows_are_axial_rows(rng):
+    q = rng.integers(-1000, 1000, points)
+    r = rng.integers(-1000, 1000, points)
+    row, col = axial_to_offset(q, r)
+    assert np.array_equal(row, r)
+    # One step along q is one column to the right
+    assert np.array_equal(axial_to_offset(q + 1, r)[1], col + 1)
+
+
+@pytest.mark.parametrize('zoom', [-5, -3, 0, 2.5, 5])
+def test_pixels_round_trip(rng, zoom):
+    x, y = world_points(rng)
+    got_x, got_y = from_pixels(*to_pixels(x, y, zoom), zoom)
+    assert np.allclose(got_x, x, rtol=0, atol=1e-9) and np.allclose(got_y, y, rtol=0, atol=1e-9)
+
+
+def test_pixels_follow_the_crs(rng):
+    x, y = world_points(rng)
+    px, py = to_pixels(x, y, -3)
+    assert np.allclose(px, x / 8) and np.allclose(py, -y / map_coords.apothem / 8)
+
+
+def test_lattice_round_trip(rng):
+    i = rng.integers(-100_000, 100_000, points)
+    j = rng.integers(-100_000, 100_000, points)
+    got = lattice_coords(*stagger(i, j))
+    assert got is not None
+    assert np.array_equal(got[0], i) and np.array_equal(got[1], j)
+
+
+def test_off_lattice_points_are_refused(rng):
+    i = rng.integers(-1000, 1000, 1000)
+    j = rng.integers(-1000, 1000, 1000)
+    x, y = stagger(i, j)
+    x[17] += 0.1
+    assert lattice_coords(x, y) is None
+
+
+def test_chunk_and_region_ids_are_minus_one_exactly_off_the_map(rng):
+    x, y = world_points(rng)
+    on_map = (x >= 0) & (x < map_coords.map_width) & (y >= 0) & (y < map_coords.map_height)
+    chunks = chunk_ids(x, y)
+    regions = region_ids(x, y)
+
+    assert np.array_equal(chunks == -1, ~on_map)
+    assert np.array_equal(regions == -1, ~on_map)
+    assert chunks[on_map].min() >= 0 and chunks[on_map].max() < map_coords.chunk_cols * map_coords.chunk_rows
+    assert regions[on_map].min() >= 0 and regions[on_map].max() < len(map_coords.region_names)
+
+
+def test_chunks_nest_in_regions(rng):
+    x, y = world_points(rng, margin=0)
+    on_map = chunk_ids(x, y) >= 0
+    chunks = chunk_ids(x[on_map], y[on_map])
+    cx, cy = chunks % map_coords.chunk_cols, chunks // map_coords.chunk_cols
+    per_region = map_coords.region_size // map_coords.chunk_size
+    assert np.array_equal(region_ids(x[on_map], y[on_map]), (cy // per_region) * map_coords.region_cols + cx // per_region)
+
+
+def test_region_labels_are_in_their_region():
+    for region, (x, y) in enumerate(map_coords.region_label_points()):
+        # Labels sit on the top edge, just below it is their region
+        assert region_ids(x, y - 1) == region
+
+
+def test_display_round_trip(rng):
+    n = rng.integers(0, map_coords.map_height // map_coords.display_scale, points)
+    e = rng.integers(0, map_coords.map_width // map_coords.display_scale, points)
+    got_n, got_e = display_coords(*world_coords(n, e))
+    assert np.array_equal(got_n, n) and np.array_equal(got_e, e)
+
+
+def test_display_point_matches_display_coords(rng):
+    x, z = (v.round() for v in world_points(rng, margin=0))
+    n, e = display_coords(x, z)
+    for k in range(0, points, 997):
+        assert display_point(float(x[k]), float(z[k])) == (n[k], e[k])
+    assert display_point(4.5, 1.5) == (0, 2)   # half to even, as round()
+
+
+@pytest.mark.parametrize('groups', [1, 7, 5000])
+def test_partition_covers_every_index_once_in_input_order(rng, groups):
+    a = rng.integers(0, groups, points)
+    b = rng.integers(-3, 3, points)
+    seen = []
+    keys = []
+    for key, members in partition(a, b):
+        assert np.all(np.diff(members) > 0)
+        assert np.all(a[members] == key[0]) and np.all(b[members] == key[1])
+        keys.append(key)
+        seen.append(members)
+
+    assert keys == sorted(keys) and len(set(keys)) == len(keys)
+    assert np.array_equal(np.sort(np.concatenate(seen)), np.arange(points))
+
+
+def test_partition_of_nothing():
+    assert list(partition(np.array([], dtype=np.int64))) == []
@@ -0,0 +1,66 @@
+import json
+import os
+
+import pytest
+
+from marker_columns import MarkerColumns, columns_path, encode_marker_columns, read_marker_columns, write_marker_columns
+
+markers_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets', 'markers')
+
+# Layer -> properties that have to come back exactly: ids, names, tiers, flags
+checked = {
+    'claims': ['entityId', 'name', 'tier', 'has_bank', 'has_market', 'has_waystone'],
+    'caves': ['name', 'size', 'tier'],
+}
+
+
+def load_layer(layer):
+    with open(os.path.join(markers_folder, layer + '.geojson'), 'r', encoding='utf-8') as file:
+        geojson = json.load(file)
+    return geojson, geojson['features'] if isinstance(geojson, dict) else geojson
+
+
+def assert_same_features(decoded, features, names):
+    assert len(decoded) == len(features)
+    for got, want in zip(decoded, features):
+        assert got['geometry']['coordinates'] == want['geometry']['coordinates'][:2]
+        for name in names:
+            assert got['properties'][name] == want['properties'][name]
+            assert type(got['properties'][name]) is type(want['properties'][name])
+
+
+@pytest.mark.parametrize('layer', list(checked))
+def test_round_trip(layer):
+    geojson, features = load_layer(layer)
+    data = encode_marker_columns(geojson)
+    columns = MarkerColumns(data)
+
+    assert columns.to_geojson() == geojson
+    assert_same_features(list(columns.features()), features, checked[layer])
+
+
+@pytest.mark.parametrize('layer', list(checked))
+def test_committed_bin_matches_geojson(layer):
+    geojson, features = load_layer(layer)
+    columns = read_marker_columns(columns_path(os.path.join(markers_folder, layer + '.geojson')))
+
+    assert_same_features(list(columns.features()), features, checked[layer])
+
+
+def test_write_marker_columns(tmp_path):
+    geojson, _ = load_layer('caves')
+    path = str(tmp_path / 'caves.bin')
+    write_marker_columns(geojson, path)
+
+    with open(path, 'rb') as file:
+        assert file.read() == encode_marker_columns(geojson)
+    assert os.listdir(tmp_path) == ['caves.bin']
+
+
+def test_rejects_mixed_properties():
+    features = [
+        {"type": "Feature", "properties": {"tier": 1}, "geometry": {"type": "Point", "coordinates": [0, 0]}},
+        {"type": "Feature", "properties": {"tier": "one"}, "geometry": {"type": "Point", "coordinates": [1, 1]}},
+    ]
+    with pytest.raises(ValueError):
+        encode_marker_columns(features)